@@ -1 +1,3 @@
+from .db import Base, SessionLocal, engine, get_db
 
+__all__ = ["Base", "SessionLocal", "engine", "get_db"]
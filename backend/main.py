@@ -4,7 +4,10 @@ from routes.api import router as api_router
 from routes.auth import router as auth_router
 from routes.settings import router as settings_router
 from routes.admin import router as admin_router
+from backend.routes.vitals import router as vitals_router
+from backend.routes.analysis import router as analysis_router
 from database.db import engine, Base
+from backend.services.upload_ingest import UploadSizeLimitMiddleware
 import uvicorn
 import logging
 
@@ -23,6 +26,10 @@ origins = [
     "http://127.0.0.1:3000",
 ]
 
+# Enforce SystemSettings.max_upload_size while multipart bodies stream in.
+# Added before CORS so CORS wraps it and its 413 responses carry the CORS headers.
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Configure CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -39,6 +46,8 @@ app.include_router(api_router, prefix="/api")
 app.include_router(auth_router, prefix="/auth", tags=["authentication"])
 app.include_router(settings_router, prefix="/api", tags=["settings"])
 app.include_router(admin_router, prefix="/api/admin", tags=["admin"])
+app.include_router(vitals_router, prefix="/api", tags=["vitals"])
+app.include_router(analysis_router, prefix="/api", tags=["analysis"])
 
 @app.get("/")
 async def root():
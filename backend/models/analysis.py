@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey
 from sqlalchemy.orm import relationship
 from backend.database.db import Base
 from datetime import datetime
@@ -14,16 +14,32 @@ class Analysis(Base):
     analysis_type = Column(String)  # 'xray', 'skin', 'mri'
     priority = Column(String)  # 'low', 'medium', 'high'
     notes = Column(String)
-    results = Column(JSON)  # Store analysis results
+    results = Column(JSON)  # Store analysis results (per filename)
+    model_versions = Column(JSON, nullable=True)  # filename -> model version that scored it
+    reused_from = Column(JSON, nullable=True)  # filename -> near-duplicate prior image its results came from
     risk_assessment = Column(JSON)  # Store risk assessment
     status = Column(String)  # 'pending', 'processing', 'completed', 'failed'
     created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)  # when a worker claimed the job
     completed_at = Column(DateTime, nullable=True)
 
     # Relationships
     patient = relationship("User", foreign_keys=[patient_id])
     doctor = relationship("User", foreign_keys=[doctor_id])
 
+class ImageFingerprint(Base):
+    """Perceptual hashes of one analyzed image, for near-duplicate lookup"""
+    __tablename__ = "image_fingerprints"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    analysis_id = Column(String, ForeignKey("analyses.id"), index=True)
+    patient_id = Column(String, ForeignKey("users.id"), index=True)
+    analysis_type = Column(String)
+    filename = Column(String)
+    phash = Column(String(16))  # 64-bit DCT hash, hex
+    dhash = Column(String(16))  # 64-bit gradient hash, hex
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class AnalysisCreate(BaseModel):
     patient_id: str
     analysis_type: str
@@ -38,6 +54,8 @@ class AnalysisResponse(BaseModel):
     priority: str
     notes: Optional[str]
     results: Dict[str, Any]
+    model_versions: Optional[Dict[str, Any]] = None
+    reused_from: Optional[Dict[str, Any]] = None
     risk_assessment: Dict[str, Any]
     status: str
     created_at: datetime
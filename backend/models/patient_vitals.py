@@ -3,7 +3,7 @@ from sqlalchemy.orm import relationship
 from ..database import Base
 from datetime import datetime
 from typing import Dict, List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 
 class PatientVitalsThreshold(Base):
     __tablename__ = "patient_vitals_thresholds"
@@ -104,12 +104,41 @@ class VitalsReadingCreate(BaseModel):
     systolic: int
     diastolic: int
     heart_rate: int
-    oxygen_saturation: Optional[int]
-    temperature: Optional[float]
-    activity_type: Optional[str]
-    steps_count: Optional[int]
-    location: Optional[str]
-    ambient_temperature: Optional[float]
+    oxygen_saturation: Optional[int] = None
+    temperature: Optional[float] = None
+    activity_type: Optional[str] = None
+    steps_count: Optional[int] = None
+    location: Optional[str] = None
+    ambient_temperature: Optional[float] = None
+
+class VitalsColumns(BaseModel):
+    """Columnar burst of readings from one device: one list per field, index-aligned"""
+    device_id: str
+    timestamp: List[datetime]
+    systolic: List[int]
+    diastolic: List[int]
+    heart_rate: List[int]
+    oxygen_saturation: Optional[List[Optional[int]]] = None
+    temperature: Optional[List[Optional[float]]] = None
+    activity_type: Optional[List[Optional[str]]] = None
+    steps_count: Optional[List[Optional[int]]] = None
+    location: Optional[List[Optional[str]]] = None
+    ambient_temperature: Optional[List[Optional[float]]] = None
+
+    @model_validator(mode="after")
+    def check_lengths(self):
+        size = len(self.timestamp)
+        for name in VITALS_COLUMNS:
+            column = getattr(self, name)
+            if column is not None and len(column) != size:
+                raise ValueError(f"Column '{name}' has {len(column)} values, expected {size}")
+        return self
+
+# Per-reading fields of VitalsReadingCreate, in column order
+VITALS_COLUMNS = (
+    "timestamp", "systolic", "diastolic", "heart_rate", "oxygen_saturation", "temperature",
+    "activity_type", "steps_count", "location", "ambient_temperature"
+)
 
 # Predefined condition thresholds
 DEFAULT_THRESHOLDS = {
@@ -1,16 +1,140 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Header
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from typing import List
 from ..services.ml_analysis import MedicalImageAnalyzer
-from ..auth.jwt import get_current_user
+from ..services.inference_executor import InferenceQueueFull
+from ..services.analysis_jobs import AnalysisJobQueue
+from ..services.image_dedup import ImageDedupIndex
+from ..services.upload_ingest import UploadTooLarge
+from ..services.inference_metrics import registry as metrics_registry
+from ..auth.auth_handler import get_current_user
 from ..models.user import User
 from ..models.analysis import Analysis, AnalysisCreate
 from sqlalchemy.orm import Session
 from ..database import get_db
 import uuid
+import os
+import json
+import asyncio
+from contextlib import aclosing
 from datetime import datetime
 
 router = APIRouter()
-analyzer = MedicalImageAnalyzer()
+analyzer = MedicalImageAnalyzer()  # Cheap: models load lazily or via warm-up
+dedup_index = ImageDedupIndex()
+job_queue = AnalysisJobQueue(analyzer, dedup_index=dedup_index)
+
+MODEL_POLL_SECONDS = int(os.getenv("AIMED_MODEL_POLL_SECONDS", "0"))  # 0 disables polling
+METRICS_TOKEN = os.getenv("AIMED_METRICS_TOKEN")  # scrapers send it as a bearer token when set
+
+@router.on_event("startup")
+async def warm_up_models():
+    """Load model weights in the background so the API can serve immediately"""
+    if os.getenv("AIMED_WARM_MODELS_ON_STARTUP", "true").lower() == "true":
+        analyzer.warm_up()
+    await job_queue.start()
+    if MODEL_POLL_SECONDS > 0:
+        asyncio.create_task(_poll_model_versions())
+
+async def _poll_model_versions():
+    """Hot-swap to new model versions as they appear in the registry"""
+    while True:
+        await asyncio.sleep(MODEL_POLL_SECONDS)
+        try:
+            analyzer.registry.refresh()
+        except Exception as e:
+            print(f"Error refreshing model registry: {str(e)}")
+
+@router.on_event("shutdown")
+async def stop_job_workers():
+    await job_queue.stop()
+
+MAX_CONCURRENT_FILES = int(os.getenv("AIMED_MAX_CONCURRENT_FILES", "4"))
+ANALYSIS_TYPES = ('xray', 'skin', 'mri')
+
+def _save_analysis(db: Session, current_user: User, patient_id: str, analysis_type: str, priority: str,
+                   notes: str, analysis_results: dict, model_versions: dict, risk_assessment: dict,
+                   reused_from: dict = None, fingerprints: dict = None) -> Analysis:
+    analysis = Analysis(
+        id=str(uuid.uuid4()),
+        patient_id=patient_id,
+        doctor_id=current_user.id,
+        analysis_type=analysis_type,
+        priority=priority,
+        notes=notes,
+        results=analysis_results,
+        model_versions=model_versions,
+        reused_from=reused_from or None,
+        risk_assessment=risk_assessment,
+        status="completed",
+        created_at=datetime.utcnow(),
+        completed_at=datetime.utcnow()
+    )
+    db.add(analysis)
+    db.commit()
+    db.refresh(analysis)
+
+    if fingerprints:
+        try:
+            dedup_index.add(db, analysis.id, patient_id, analysis_type, fingerprints)
+        except Exception as e:
+            print(f"Error indexing images of analysis {analysis.id}: {str(e)}")
+    return analysis
+
+async def _fingerprint_files(files: List[UploadFile]) -> dict:
+    """Perceptual hashes per filename; files that can't be hashed are left to the analyzer to report"""
+    async def fingerprint_one(file: UploadFile):
+        try:
+            return file.filename, await analyzer.fingerprint(file)
+        except Exception as e:
+            print(f"Error fingerprinting {file.filename}: {str(e)}")
+            return file.filename, None
+
+    fingerprints = await asyncio.gather(*[fingerprint_one(file) for file in files])
+    return {filename: fingerprint for filename, fingerprint in fingerprints if fingerprint is not None}
+
+def _find_reusable(db: Session, patient_id: str, analysis_type: str, fingerprint):
+    """Results of the closest completed prior image of the patient, or None"""
+    for match in dedup_index.find_similar(db, patient_id, analysis_type, fingerprint):
+        prior = db.query(Analysis).filter(Analysis.id == match.analysis_id).first()
+        if prior is None or prior.status != 'completed' or match.filename not in (prior.results or {}):
+            continue
+        model_version = (prior.model_versions or {}).get(match.filename)
+        reused_from = {
+            "analysis_id": prior.id,
+            "filename": match.filename,
+            "phash_distance": match.phash_distance,
+            "dhash_distance": match.dhash_distance
+        }
+        return prior.results[match.filename], model_version, reused_from
+    return None
+
+async def _analyze_files(db: Session, patient_id: str, analysis_type: str, files: List[UploadFile],
+                         reuse_prior: bool, fingerprints: dict):
+    """analyzer.analyze_files plus near-duplicate reuse.
+
+    Yields (filename, results, model_version, error, reused_from). With
+    ``reuse_prior`` the files are fingerprinted into ``fingerprints``, and
+    a file whose near-duplicate was already analyzed for the same patient
+    takes that file's results instead of running inference.
+    """
+    if reuse_prior:
+        fingerprints.update(await _fingerprint_files(files))
+
+    to_analyze = []
+    for file in files:
+        reusable = None
+        if file.filename in fingerprints:
+            reusable = _find_reusable(db, patient_id, analysis_type, fingerprints[file.filename])
+        if reusable is None:
+            to_analyze.append(file)
+            continue
+        results, model_version, reused_from = reusable
+        yield file.filename, results, model_version, None, reused_from
+
+    async with aclosing(analyzer.analyze_files(analysis_type, to_analyze, MAX_CONCURRENT_FILES)) as analyzed:
+        async for filename, results, model_version, error in analyzed:
+            yield filename, results, model_version, error, None
 
 @router.post("/analysis")
 async def create_analysis(
@@ -19,63 +143,203 @@ async def create_analysis(
     analysis_type: str = Form(...),
     priority: str = Form(...),
     notes: str = Form(...),
+    stream: bool = Form(False),
+    background: bool = Form(False),
+    reuse_prior: bool = Form(False),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Create a new analysis request with AI-powered image processing"""
+    """Create a new analysis request with AI-powered image processing
+    
+    Files are analyzed concurrently. With ``stream=true`` the response is
+    NDJSON: one line per file as soon as it is ready, then a final line with
+    the combined risk assessment and the analysis id. With ``background=true``
+    the uploads are queued as a ``pending`` job and the response returns
+    immediately; poll ``/analysis/{analysis_id}/status`` for progress.
+    With ``reuse_prior=true`` files that are near-duplicates of an earlier
+    image of the same patient (re-exports, re-encodes, slight crops) reuse
+    its results; ``reused_from`` names the source image of each. Queued
+    jobs always run inference, so ``reuse_prior`` can't be combined with
+    ``background``.
+    """
     
     if current_user.role not in ['doctor', 'admin']:
         raise HTTPException(status_code=403, detail="Only doctors can create analysis requests")
     
+    if analysis_type not in ANALYSIS_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported analysis type")
+
+    if background and reuse_prior:
+        raise HTTPException(status_code=400, detail="reuse_prior is not supported for background analyses")
+
+    if background:
+        return await _queue_analysis(files, db, current_user, patient_id, analysis_type, priority, notes)
+
+    if stream:
+        return StreamingResponse(
+            _stream_analysis(files, db, current_user, patient_id, analysis_type, priority, notes, reuse_prior),
+            media_type="application/x-ndjson"
+        )
+
     try:
-        # Initialize analysis results
+        # Process uploaded files concurrently
         analysis_results = {}
+        model_versions = {}
+        reused_from = {}
+        fingerprints = {}
+        # Closed on the first error, which cancels the files still being analyzed
+        async with aclosing(_analyze_files(db, patient_id, analysis_type, files, reuse_prior, fingerprints)) as outcomes:
+            async for filename, results, model_version, error, reused in outcomes:
+                if error is not None:
+                    raise error
+                analysis_results[filename] = results
+                model_versions[filename] = model_version
+                if reused is not None:
+                    reused_from[filename] = reused
         
-        # Process each uploaded file
-        for file in files:
-            # Analyze based on type
-            if analysis_type == 'xray':
-                results = await analyzer.analyze_xray(file)
-            elif analysis_type == 'skin':
-                results = await analyzer.analyze_skin_lesion(file)
-            elif analysis_type == 'mri':
-                results = await analyzer.analyze_mri(file)
-            else:
-                raise HTTPException(status_code=400, detail="Unsupported analysis type")
-            
-            # Merge results
-            analysis_results[file.filename] = results
-        
-        # Get risk assessment
-        risk_assessment = await analyzer.get_risk_assessment(analysis_results[files[0].filename])
+        # Get risk assessment for the whole study
+        risk_assessment = await analyzer.get_study_risk_assessment(analysis_results)
         
         # Create analysis record
-        analysis = Analysis(
-            id=str(uuid.uuid4()),
-            patient_id=patient_id,
-            doctor_id=current_user.id,
-            analysis_type=analysis_type,
-            priority=priority,
-            notes=notes,
-            results=analysis_results,
-            risk_assessment=risk_assessment,
-            status="completed",
-            created_at=datetime.utcnow()
+        analysis = _save_analysis(
+            db, current_user, patient_id, analysis_type, priority, notes,
+            analysis_results, model_versions, risk_assessment, reused_from, fingerprints
         )
         
-        # Save to database
-        db.add(analysis)
-        db.commit()
-        db.refresh(analysis)
-        
         return {
             "analysis_id": analysis.id,
             "results": analysis_results,
+            "model_versions": model_versions,
+            "reused_from": reused_from,
             "risk_assessment": risk_assessment
         }
         
+    except HTTPException:
+        raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _queue_analysis(files: List[UploadFile], db: Session, current_user: User,
+                          patient_id: str, analysis_type: str, priority: str, notes: str):
+    """Save uploads, record a pending analysis and hand it to the job workers"""
+    analysis = Analysis(
+        id=str(uuid.uuid4()),
+        patient_id=patient_id,
+        doctor_id=current_user.id,
+        analysis_type=analysis_type,
+        priority=priority,
+        notes=notes,
+        results={},
+        risk_assessment={},
+        status="pending",
+        created_at=datetime.utcnow()
+    )
+    
+    try:
+        await job_queue.save_uploads(analysis.id, files)
+        db.add(analysis)
+        db.commit()
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    job_queue.enqueue(analysis.id, priority)
+    
+    return JSONResponse(status_code=202, content={
+        "analysis_id": analysis.id,
+        "status": analysis.status,
+        "status_url": f"/analysis/{analysis.id}/status"
+    })
+
+async def _stream_analysis(files: List[UploadFile], db: Session, current_user: User, patient_id: str,
+                           analysis_type: str, priority: str, notes: str, reuse_prior: bool = False):
+    """NDJSON event stream for create_analysis(stream=true)"""
+    analysis_results = {}
+    model_versions = {}
+    reused_from = {}
+    fingerprints = {}
+    errors = {}
+
+    # Closed if the client disconnects, which cancels the files still being analyzed
+    async with aclosing(_analyze_files(db, patient_id, analysis_type, files, reuse_prior, fingerprints)) as outcomes:
+        async for filename, results, model_version, error, reused in outcomes:
+            if error is not None:
+                errors[filename] = str(error)
+                yield json.dumps({"event": "file_failed", "filename": filename, "detail": str(error)}) + "\n"
+                continue
+            analysis_results[filename] = results
+            model_versions[filename] = model_version
+            if reused is not None:
+                reused_from[filename] = reused
+            yield json.dumps({
+                "event": "file_completed",
+                "filename": filename,
+                "results": results,
+                "model_version": model_version,
+                "reused_from": reused
+            }) + "\n"
+
+    if not analysis_results:
+        yield json.dumps({"event": "failed", "errors": errors}) + "\n"
+        return
+
+    try:
+        risk_assessment = await analyzer.get_study_risk_assessment(analysis_results)
+        analysis = _save_analysis(
+            db, current_user, patient_id, analysis_type, priority, notes,
+            analysis_results, model_versions, risk_assessment, reused_from, fingerprints
+        )
+    except Exception as e:
+        yield json.dumps({"event": "failed", "detail": str(e)}) + "\n"
+        return
+
+    yield json.dumps({
+        "event": "completed",
+        "analysis_id": analysis.id,
+        "risk_assessment": risk_assessment,
+        "errors": errors
+    }) + "\n"
+
+@router.get("/analysis/ready")
+async def get_analysis_readiness():
+    """Report per-model load state; 503 until every model is ready"""
+    
+    readiness = analyzer.get_readiness()
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
+@router.get("/analysis/models")
+async def get_model_versions(
+    current_user: User = Depends(get_current_user)
+):
+    """List active, staging and available versions of every model"""
+    
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can manage models")
+    
+    return analyzer.get_model_status()
+
+@router.post("/analysis/models/{model_name}/activate")
+async def activate_model_version(
+    model_name: str,
+    version: str = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Load and warm a model version in the background, then switch traffic to it"""
+    
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can manage models")
+    
+    try:
+        analyzer.activate_model(model_name, version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    return JSONResponse(status_code=202, content=analyzer.get_model_status()[model_name])
 
 @router.get("/analysis/{analysis_id}")
 async def get_analysis(
@@ -96,6 +360,59 @@ async def get_analysis(
     
     return analysis
 
+@router.get("/analysis/{analysis_id}/status")
+async def get_analysis_status(
+    analysis_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Poll the processing status of a queued analysis"""
+    
+    analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
+    
+    if not analysis:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    # Check permissions
+    if current_user.role == 'patient' and analysis.patient_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this analysis")
+    
+    return {
+        "analysis_id": analysis.id,
+        "status": analysis.status,
+        "priority": analysis.priority,
+        "queue_position": job_queue.queue_position(analysis.id) if analysis.status == 'pending' else None,
+        "created_at": analysis.created_at,
+        "completed_at": analysis.completed_at
+    }
+
+@router.get("/analysis/{analysis_id}/similar")
+async def get_similar_images(
+    analysis_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Near-duplicate images from the patient's other analyses, per file of this one"""
+    
+    analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
+    
+    if not analysis:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    
+    # Check permissions
+    if current_user.role == 'patient' and analysis.patient_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this analysis")
+    
+    return {
+        filename: [
+            match.to_dict() for match in dedup_index.find_similar(
+                db, analysis.patient_id, analysis.analysis_type, fingerprint,
+                exclude_analysis_id=analysis.id
+            )
+        ]
+        for filename, fingerprint in dedup_index.fingerprints_for(db, analysis.id).items()
+    }
+
 @router.get("/analysis/patient/{patient_id}")
 async def get_patient_analyses(
     patient_id: str,
@@ -125,3 +442,23 @@ async def get_doctor_analyses(
     
     analyses = db.query(Analysis).filter(Analysis.doctor_id == doctor_id).all()
     return analyses
+
+@router.get("/analysis/batching/metrics")
+async def get_batching_metrics(
+    current_user: User = Depends(get_current_user)
+):
+    """Get micro-batching statistics (batch sizes and queue waits) per model"""
+    
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can view inference metrics")
+    
+    return analyzer.get_batching_metrics()
+
+@router.get("/metrics")
+async def get_metrics(authorization: str = Header(None)):
+    """Inference timers and counters in the Prometheus text format"""
+    
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
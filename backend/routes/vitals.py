@@ -0,0 +1,121 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+from typing import List, Union
+from ..services.vitals_ingest import (
+    VitalsIngestService, VitalsValidationError, columns_from_readings, columns_from_batch, MAX_INGEST_ROWS
+)
+from ..services.vitals_rollups import vitals_rollups, MAX_CHART_POINTS
+from ..services.vitals_wire import VITALS_MEDIA_TYPE, WireFormatError, decode_upload
+from ..services.vitals_store import vitals_store
+from ..services.threshold_resolver import threshold_resolver
+from ..auth.auth_handler import get_current_user
+from ..models.user import User
+from ..models.patient_vitals import VitalsReadingCreate, VitalsColumns
+from sqlalchemy.orm import Session
+from ..database.db import get_db
+import asyncio
+from datetime import datetime, timedelta
+
+router = APIRouter()
+
+_bulk_payload = TypeAdapter(Union[VitalsColumns, List[VitalsReadingCreate]])
+
+@router.on_event("startup")
+async def preload_thresholds():
+    """Load recently active patients' alert thresholds in the background"""
+    threshold_resolver.warm_up()
+
+@router.on_event("shutdown")
+async def flush_vitals_store():
+    await asyncio.to_thread(vitals_store.flush)
+
+# The body is parsed by content type inside the handler, so it is described here
+@router.post("/vitals/{patient_id}/bulk", openapi_extra={"requestBody": {"required": True, "content": {
+    "application/json": {"schema": {"oneOf": [{"type": "object"}, {"type": "array", "items": {"type": "object"}}]}},
+    VITALS_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}}
+}}})
+async def bulk_ingest_vitals(
+    patient_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Ingest a burst of wearable readings, as a list of readings or one device's columns.
+
+    JSON by default; devices can send the compact binary format instead
+    with ``Content-Type: application/vnd.aimed.vitals``.
+    """
+    if current_user.id != patient_id and current_user.role not in ['admin', 'doctor']:
+        raise HTTPException(status_code=403, detail="Not authorized to upload vitals for this patient")
+
+    body = await request.body()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == VITALS_MEDIA_TYPE:
+        try:
+            columns = decode_upload(body)
+        except WireFormatError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        try:
+            payload = _bulk_payload.validate_json(body)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors(include_url=False))
+        columns = columns_from_batch(payload) if isinstance(payload, VitalsColumns) else columns_from_readings(payload)
+    if len(columns["timestamp"]) > MAX_INGEST_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_INGEST_ROWS} readings per upload")
+
+    try:
+        # Validation and inserts are blocking; keep them off the event loop
+        service = VitalsIngestService(db)
+        report = await asyncio.to_thread(service.ingest, patient_id, columns)
+    except VitalsValidationError as e:
+        raise HTTPException(status_code=422, detail={"message": str(e), "errors": e.errors})
+    except Exception as e:
+        print(f"Error ingesting vitals: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if report["failed_chunks"] and not report["inserted"]:
+        raise HTTPException(status_code=500, detail=report)
+    return report
+
+@router.get("/vitals/{patient_id}/rollups")
+async def get_vitals_rollups(
+    patient_id: str,
+    start: datetime = None,
+    end: datetime = None,
+    max_points: int = MAX_CHART_POINTS,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Chart series at the finest of minute/hour/day resolution that fits ``max_points`` buckets"""
+    if current_user.id != patient_id and current_user.role not in ['admin', 'doctor']:
+        raise HTTPException(status_code=403, detail="Not authorized to view these vitals")
+
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=30)
+    if start >= end or max_points < 1:
+        raise HTTPException(status_code=400, detail="Invalid range")
+
+    try:
+        return await asyncio.to_thread(vitals_rollups.buckets, patient_id, start, end, max_points, db)
+    except Exception as e:
+        print(f"Error getting vitals rollups: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/vitals/{patient_id}/reconcile")
+async def reconcile_vitals_store(
+    patient_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Merge stored readings missing from the columnar vitals store, e.g. after a failed append"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can reconcile vitals")
+
+    try:
+        merged = await asyncio.to_thread(vitals_store.reconcile, patient_id, db)
+    except Exception as e:
+        print(f"Error reconciling vitals store: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"patient_id": patient_id, "merged": merged}
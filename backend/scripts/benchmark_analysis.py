@@ -0,0 +1,244 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import argparse
+import asyncio
+import io
+import json
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+import numpy as np
+from PIL import Image
+from fastapi import UploadFile
+from backend.services.ml_analysis import MedicalImageAnalyzer, MODEL_NORMALIZATIONS
+from backend.services.inference_cache import InferenceResultCache
+from backend.services.inference_executor import InferenceExecutor
+from backend.services.image_preprocessing import DecodedImage, decode_image
+
+# Label counts match the production models
+LABEL_COUNTS = {'xray': 14, 'skin': 7, 'mri': 8}
+
+
+class StubModel:
+    """Random-weight linear classifier with the same input/output contract as the real models"""
+
+    def __init__(self, num_classes: int, input_shape, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.weights = rng.standard_normal((int(np.prod(input_shape)), num_classes), dtype=np.float32) * 0.01
+
+    def predict(self, batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        logits = batch.reshape(len(batch), -1) @ self.weights
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+class BenchmarkAnalyzer(MedicalImageAnalyzer):
+    """Analyzer with offline models and no result cache, so every request does real work"""
+
+    def __init__(self, model_kind: str, **kwargs):
+        self.model_kind = model_kind
+        # Label-only model root; no weights are read
+        self.model_root = tempfile.mkdtemp(prefix="aimed-bench-models-")
+        with open(os.path.join(self.model_root, 'disease_labels.json'), 'w') as f:
+            json.dump({
+                name: [f"{name}_condition_{i}" for i in range(count)] for name, count in LABEL_COUNTS.items()
+            }, f)
+        super().__init__(
+            cache=InferenceResultCache(memory_entries=0, disk_max_bytes=0),
+            model_root=self.model_root,
+            **kwargs
+        )
+
+    def load_original_model(self, model_version):
+        name = model_version.name
+        if self.model_kind == 'densenet':
+            return self._load_random_densenet(name)
+        return StubModel(LABEL_COUNTS[name], self.preprocessor.sample_shape(MODEL_NORMALIZATIONS[name]))
+
+    def _load_random_densenet(self, name: str):
+        # Full-size architectures with random weights, no downloads needed
+        if name == 'skin':
+            import torchvision
+            return torchvision.models.densenet121(num_classes=LABEL_COUNTS[name]).eval()
+        from tensorflow.keras.applications import DenseNet121
+        return DenseNet121(weights=None, include_top=True, classes=LABEL_COUNTS[name])
+
+    def _forward(self, name: str, model, batch: np.ndarray) -> np.ndarray:
+        if isinstance(model, StubModel):
+            return model.predict(batch)
+        return super()._forward(name, model, batch)
+
+
+def make_image(analysis_type: str, size: int, seed: int) -> bytes:
+    """Synthetic study image: grayscale X-ray/MRI, colored skin lesion; PNG or JPEG encoded"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    blob = np.exp(-(((x - size / 2) ** 2 + (y - size / 2) ** 2) / (2 * (size / 5) ** 2)))
+    noise = rng.normal(0, 20, (size, size))
+    if analysis_type == 'skin':
+        base = np.stack([200 - 90 * blob, 160 - 110 * blob, 140 - 100 * blob], axis=-1) + noise[..., None]
+        image = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8), 'RGB')
+        image_format = 'JPEG'
+    else:
+        base = 60 + 150 * blob + noise
+        image = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8), 'L')
+        image_format = 'PNG' if analysis_type == 'mri' else 'JPEG'
+    buffer = io.BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, Any]:
+    latencies_ms = np.array(latencies) * 1000.0
+    return {
+        "requests": len(latencies),
+        "throughput_per_s": len(latencies) / elapsed if elapsed > 0 else None,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean())
+    }
+
+
+async def run_concurrently(call: Callable, items: List[Any], concurrency: int) -> Dict[str, Any]:
+    """Run ``call`` over ``items`` with ``concurrency`` callers, timing each call"""
+    latencies = []
+    pending = list(reversed(items))
+
+    async def worker():
+        while pending:
+            item = pending.pop()
+            started = time.perf_counter()
+            await call(item)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+async def benchmark_type(analyzer: BenchmarkAnalyzer, analysis_type: str, size: int,
+                         requests: int, concurrency: int) -> Dict[str, Any]:
+    unique_images = [make_image(analysis_type, size, seed) for seed in range(min(requests, 16))]
+    images = [unique_images[i % len(unique_images)] for i in range(requests)]
+    normalization = MODEL_NORMALIZATIONS[analysis_type]
+    unique_decoded = [decode_image(contents) for contents in unique_images]
+    decoded = [unique_decoded[i % len(unique_decoded)].image for i in range(requests)]
+    unique_samples = [analyzer.preprocessor.preprocess(d, normalization) for d in unique_decoded]
+    samples = [unique_samples[i % len(unique_samples)] for i in range(requests)]
+    labels = analyzer.disease_labels[analysis_type]
+    probabilities = [
+        dict(zip(labels, np.random.default_rng(i).random(len(labels)).tolist()))
+        for i in range(requests)
+    ]
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def decode(contents):
+        await loop.run_in_executor(pool, decode_image, contents)
+
+    async def preprocess(image):
+        # Fresh wrapper each time so the resize cache does not hide resize cost
+        await loop.run_in_executor(
+            pool, lambda: analyzer.preprocessor.preprocess(DecodedImage(image), normalization)
+        )
+
+    async def inference(sample):
+        await analyzer.batchers[analysis_type].submit(sample)
+
+    async def risk(results):
+        await analyzer.get_risk_assessment(results)
+
+    async def end_to_end(contents):
+        await analyzer.get_analyze_fn(analysis_type)(
+            UploadFile(file=io.BytesIO(contents), filename="bench.img")
+        )
+
+    stages = {
+        "decode": await run_concurrently(decode, images, concurrency),
+        "preprocess": await run_concurrently(preprocess, decoded, concurrency),
+        "inference": await run_concurrently(inference, samples, concurrency),
+        "risk_assessment": await run_concurrently(risk, probabilities, concurrency),
+        "end_to_end": await run_concurrently(end_to_end, images, concurrency)
+    }
+    pool.shutdown()
+    return stages
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    analyzer = BenchmarkAnalyzer(
+        args.models,
+        executor=InferenceExecutor(max_workers=args.workers, max_queue_size=max(args.concurrency) * 4)
+    )
+    for name in args.types:
+        analyzer.models[name].get()  # exclude model loading from the measurements
+
+    results = []
+    for analysis_type in args.types:
+        for size in args.sizes:
+            for concurrency in args.concurrency:
+                stages = await benchmark_type(analyzer, analysis_type, size, args.requests, concurrency)
+                results.append({
+                    "analysis_type": analysis_type,
+                    "image_size": size,
+                    "concurrency": concurrency,
+                    "stages": stages,
+                    "peak_rss_mb": peak_rss_mb()
+                })
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "model_kind": args.models,
+        "batching": analyzer.get_batching_metrics(),
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image analysis pipeline offline")
+    parser.add_argument("--types", nargs="+", default=list(LABEL_COUNTS), choices=list(LABEL_COUNTS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[256, 1024, 2048])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=64, help="Requests per stage and configuration")
+    parser.add_argument("--workers", type=int, default=2, help="Inference worker threads")
+    parser.add_argument("--models", default="stub", choices=["stub", "densenet"],
+                        help="'stub' needs only numpy; 'densenet' builds random-weight DenseNet121s")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import argparse
+import json
+import numpy as np
+from backend.services.ml_analysis import MedicalImageAnalyzer, MODEL_NORMALIZATIONS
+from backend.services.image_preprocessing import decode_image
+from backend.services.optimized_models import QUANTIZATION
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def load_samples(analyzer: MedicalImageAnalyzer, name: str, sample_dir: str, count: int) -> np.ndarray:
+    """Preprocess sample images for a model, or synthesize noise images if none are given"""
+    normalization = MODEL_NORMALIZATIONS[name]
+    if sample_dir:
+        paths = sorted(
+            os.path.join(sample_dir, f) for f in os.listdir(sample_dir)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )[:count]
+        decoded = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                decoded.append(decode_image(f.read()))
+        return analyzer.preprocessor.preprocess_batch(decoded, normalization)
+    return analyzer.parity_samples(name, count)
+
+
+def check_model(analyzer: MedicalImageAnalyzer, name: str, samples: np.ndarray):
+    model_version = analyzer.models[name]
+    original = analyzer.load_original_model(model_version)
+    optimized = analyzer.load_optimized_model(model_version, original)
+    return analyzer.check_optimized_parity(name, original, optimized, samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check optimized models against the originals")
+    parser.add_argument("--samples", help="Directory of sample images (defaults to synthetic noise)")
+    parser.add_argument("--count", type=int, default=64, help="Maximum number of samples per model")
+    parser.add_argument("--quantization", default=QUANTIZATION, choices=["int8", "fp16", "none"])
+    parser.add_argument("--models", nargs="+", default=list(MODEL_NORMALIZATIONS))
+    args = parser.parse_args()
+
+    # The originals are loaded with the eager backend; exports are built on demand
+    analyzer = MedicalImageAnalyzer(backend='eager', quantization=args.quantization)
+    report = {}
+    for name in args.models:
+        samples = load_samples(analyzer, name, args.samples, args.count)
+        report[name] = check_model(analyzer, name, samples)
+
+    print(json.dumps(report, indent=2))
+    if not all(result["passed"] for result in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import numpy as np
+from sqlalchemy import column, select, table, update
+from ..database.db import SessionLocal
+from ..models.patient_vitals import VitalsReading
+from .threshold_evaluator import (
+    ThresholdEvaluator, threshold_evaluator, flag_names, reading_context, SEVERITIES, NORMAL, HIGH
+)
+from .threshold_resolver import AlertSettings
+
+# Alerting configuration, overridable per deployment
+DEFAULT_ALERT_FREQUENCY_MINUTES = float(os.getenv("AIMED_ALERT_FREQUENCY_MINUTES", "15"))
+ALERT_BURST = int(os.getenv("AIMED_ALERT_BURST", "1"))
+EPISODE_GAP_SECONDS = float(os.getenv("AIMED_ALERT_EPISODE_GAP_SECONDS", "600"))
+DELIVERY_INTERVAL_SECONDS = float(os.getenv("AIMED_ALERT_DELIVERY_INTERVAL_SECONDS", "30"))
+
+DEFAULT_ALERT_METHODS = ("email",)
+NOTIFY_SEVERITY = HIGH  # episodes at or above this severity notify their recipients
+
+# A channel delivers one batch of alerts to one recipient
+Channel = Callable[[str, List[Dict[str, Any]]], Awaitable[None]]
+
+# alert_recipients holds provider IDs; the email channel needs their account address
+_users = table("users", column("id"), column("email"))
+
+
+class UndeliverableError(Exception):
+    """A channel cannot reach the recipient; the alerts are dropped rather than retried"""
+
+
+class TokenBucket:
+    """Allows ``capacity`` alerts at once, refilled at one per ``interval`` seconds"""
+
+    def __init__(self, capacity: int, interval: float):
+        self.capacity = max(1, capacity)
+        self.interval = interval
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def take(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self.tokens = self._refilled(now)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def full(self, now: Optional[float] = None) -> bool:
+        """True once refilled to capacity, when the bucket is no different from a new one"""
+        return self._refilled(time.monotonic() if now is None else now) >= self.capacity
+
+    def _refilled(self, now: float) -> float:
+        if self.interval <= 0:
+            return float(self.capacity)
+        return min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+
+
+class Episode:
+    """Consecutive abnormal readings of one patient, stored as a single alert record"""
+
+    def __init__(self, patient_id: str, record_id: str, reading: Dict[str, Any], timestamp: datetime,
+                 severity: int, flags: int):
+        self.patient_id = patient_id
+        self.record_id = record_id
+        self.started_at = timestamp
+        self.last_at = timestamp
+        self.readings = 1
+        self.severity = severity
+        self.max_severity = severity
+        self.flags = flags
+        self.peak = reading
+        self.notified_severity = NORMAL
+        self.suppressed = 0  # notifications held back by the rate limit
+        self.ended_at = None
+        self.anomaly = None  # detector summary of the latest unusual reading
+
+    def add(self, reading: Dict[str, Any], timestamp: datetime, severity: int, flags: int) -> bool:
+        """Fold a reading in; True when it raised the episode's severity"""
+        self.last_at = timestamp
+        self.readings += 1
+        self.severity = severity
+        self.flags |= flags
+        if severity > self.max_severity:
+            self.max_severity = severity
+            self.peak = reading
+            return True
+        return False
+
+    def details(self) -> Dict[str, Any]:
+        """``VitalsReading.alert_details`` for the episode record"""
+        return {
+            "severity": SEVERITIES[self.max_severity],
+            "threshold_exceeded": flag_names(self.flags),
+            "context": reading_context(
+                self.started_at, self.peak.get("activity_type"), self.peak.get("location"),
+                self.peak.get("ambient_temperature")
+            ),
+            "episode": {
+                "started_at": self.started_at.isoformat(),
+                "last_reading_at": self.last_at.isoformat(),
+                "ended_at": self.ended_at.isoformat() if self.ended_at else None,
+                "readings": self.readings,
+                "current_severity": SEVERITIES[self.severity],
+                "peak": {vital: self.peak.get(vital) for vital in ("systolic", "diastolic", "heart_rate")},
+                "notified_severity": SEVERITIES[self.notified_severity],
+                "suppressed_notifications": self.suppressed
+            },
+            "anomaly": self.anomaly
+        }
+
+
+async def send_email_alerts(recipient: str, alerts: List[Dict[str, Any]]):
+    """Email channel: one message listing every alert queued for the recipient's address"""
+    if "@" not in recipient:
+        raise UndeliverableError(f"no email address for recipient {recipient}")
+    # Imported here so the alert engine doesn't require the mail settings
+    from .email import send_bulk_email
+    rows = "".join(
+        f"<li>{alert['patient_id']}: {alert['severity']} BP episode since {alert['started_at']} "
+        f"(peak {alert['peak']['systolic']}/{alert['peak']['diastolic']}, "
+        f"{', '.join(alert['threshold_exceeded'])})</li>"
+        for alert in alerts
+    )
+    await send_bulk_email([recipient], f"AIMed: {len(alerts)} vitals alert(s)", f"<ul>{rows}</ul>")
+
+
+class AlertEngine:
+    """Turns a stream of live readings into rate-limited, batched alerts.
+
+    Consecutive abnormal readings of a patient are coalesced into one
+    episode, written once as a ``VitalsReading`` alert record and updated
+    only when its severity rises or it ends (a normal reading, or no
+    abnormal reading for ``episode_gap`` seconds). An episode at or above
+    ``NOTIFY_SEVERITY`` notifies the patient's ``alert_recipients`` when it
+    opens or escalates, if their token bucket allows: one alert per
+    ``alert_frequency`` minutes per patient and condition. A held-back
+    notification goes out on a later reading once a token is available.
+    Notifications are queued and delivered in batches per method and
+    recipient every ``delivery_interval`` seconds; email recipients are
+    provider IDs, resolved to their account address at delivery.
+    """
+
+    def __init__(self, evaluator: ThresholdEvaluator = threshold_evaluator, session_factory=SessionLocal,
+                 episode_gap: float = EPISODE_GAP_SECONDS, delivery_interval: float = DELIVERY_INTERVAL_SECONDS,
+                 burst: int = ALERT_BURST):
+        self.evaluator = evaluator
+        self.session_factory = session_factory
+        self.episode_gap = episode_gap
+        self.delivery_interval = delivery_interval
+        self.burst = burst
+        self.channels: Dict[str, Channel] = {"email": send_email_alerts}
+        self._episodes: Dict[str, Episode] = {}
+        self._buckets: Dict[tuple, TokenBucket] = {}
+        self._outbox: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+        self._pending: List[tuple] = []  # episode record writes not yet stored
+        self._store_lock = asyncio.Lock()
+        self._stats = defaultdict(int)
+        self._task = None
+
+    def register_channel(self, method: str, channel: Channel):
+        self.channels[method] = channel
+
+    def episode(self, patient_id: str) -> Optional[Episode]:
+        return self._episodes.get(patient_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, open_episodes=len(self._episodes),
+                    queued=sum(len(alerts) for alerts in self._outbox.values()))
+
+    async def observe(self, patient_id: str, reading: Dict[str, Any],
+                      anomaly: Optional[Dict[str, Any]] = None) -> Optional[Episode]:
+        """Feed one live reading, with its anomaly detector summary if unusual; returns the open episode, if any"""
+        self._ensure_delivery()
+        self._stats["readings"] += 1
+        # Off the loop: a cache miss reads the patient's thresholds and alert settings from the database
+        severity, flags, settings = await asyncio.to_thread(self._evaluate, patient_id, reading)
+        timestamp = datetime.fromisoformat(reading["timestamp"])
+
+        episode = self._episodes.get(patient_id)
+        if episode is not None and (
+            severity == NORMAL or (timestamp - episode.last_at).total_seconds() > self.episode_gap
+        ):
+            self._close(episode, timestamp if severity == NORMAL else episode.last_at)
+            episode = None
+        if severity == NORMAL:
+            await self._store()
+            return None
+
+        if episode is None:
+            episode = Episode(patient_id, str(uuid.uuid4()), reading, timestamp, severity, flags)
+            episode.anomaly = anomaly
+            self._episodes[patient_id] = episode
+            self._open(episode, reading, timestamp)
+        else:
+            escalated = episode.add(reading, timestamp, severity, flags)
+            episode.anomaly = anomaly or episode.anomaly
+            if escalated:
+                self._write(episode)
+
+        if episode.max_severity >= NOTIFY_SEVERITY and episode.max_severity > episode.notified_severity:
+            self._notify(episode, settings)
+        await self._store()
+        return episode
+
+    def sweep(self, now: Optional[datetime] = None):
+        """Close episodes whose patient has sent no abnormal reading for ``episode_gap`` seconds,
+        and forget rate limits that have refilled; the closed records are written by ``_store``"""
+        now = now or datetime.utcnow()
+        for episode in list(self._episodes.values()):
+            if (now - episode.last_at).total_seconds() > self.episode_gap:
+                self._close(episode, episode.last_at)
+        clock = time.monotonic()
+        for key in [key for key, bucket in self._buckets.items() if bucket.full(clock)]:
+            del self._buckets[key]
+
+    async def flush(self):
+        """Deliver everything queued, one batch per method and recipient"""
+        outbox, self._outbox = self._outbox, defaultdict(list)
+        addresses = {}
+        recipients = {recipient for method, recipient in outbox if method == "email" and "@" not in recipient}
+        if recipients:
+            try:
+                addresses = await asyncio.to_thread(self._email_addresses, recipients)
+            except Exception as e:
+                print(f"Error resolving alert recipients: {str(e)}")
+                for key in [key for key in outbox if key[0] == "email" and key[1] in recipients]:
+                    self._outbox[key][:0] = outbox.pop(key)  # retried on the next flush
+        for (method, recipient), alerts in outbox.items():
+            channel = self.channels.get(method)
+            if channel is None:
+                print(f"Error delivering alerts: no channel for method {method}")
+                self._stats["undeliverable"] += len(alerts)
+                continue
+            try:
+                await channel(addresses.get(recipient, recipient) if method == "email" else recipient, alerts)
+                self._stats["deliveries"] += 1
+                self._stats["delivered"] += len(alerts)
+            except UndeliverableError as e:
+                print(f"Error delivering alerts by {method}: {str(e)}")
+                self._stats["undeliverable"] += len(alerts)
+            except Exception as e:
+                print(f"Error delivering alerts by {method} to {recipient}: {str(e)}")
+                self._outbox[(method, recipient)][:0] = alerts  # retried on the next flush
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.sweep(datetime.max)
+        await self._store()
+        await self.flush()
+
+    def _ensure_delivery(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._deliver())
+
+    async def _deliver(self):
+        while True:
+            await asyncio.sleep(self.delivery_interval)
+            # Separately, so a failing sweep never holds up queued notifications
+            try:
+                self.sweep()
+                await self._store()
+            except Exception as e:
+                print(f"Error closing alert episodes: {str(e)}")
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error in alert delivery: {str(e)}")
+
+    def _settings(self, patient_id: str) -> AlertSettings:
+        return self.evaluator.resolver.settings(patient_id)
+
+    def _evaluate(self, patient_id: str, reading: Dict[str, Any]):
+        """Severity and flags of one reading, with the patient's alert settings when it is abnormal"""
+        evaluation = self.evaluator.evaluate(
+            [patient_id], np.zeros(1, dtype=np.int64),
+            [reading["systolic"]], [reading["diastolic"]], [reading.get("heart_rate")]
+        )
+        severity, flags = int(evaluation.severity[0]), int(evaluation.flags[0])
+        # Only a reading that opens or extends an episode can notify
+        return severity, flags, self._settings(patient_id) if severity != NORMAL else None
+
+    def _email_addresses(self, recipients) -> Dict[str, str]:
+        """Account email of each provider ID that has one"""
+        db = self.session_factory()
+        try:
+            rows = db.execute(select(_users.c.id, _users.c.email).where(_users.c.id.in_(list(recipients))))
+            return {str(user_id): email for user_id, email in rows if email}
+        finally:
+            db.close()
+
+    def _notify(self, episode: Episode, settings: AlertSettings):
+        key = (episode.patient_id, settings.condition)
+        frequency = settings.alert_frequency if settings.alert_frequency is not None else DEFAULT_ALERT_FREQUENCY_MINUTES
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.interval != frequency * 60:
+            # New, or the patient's alert_frequency changed since it was made
+            bucket = self._buckets[key] = TokenBucket(self.burst, frequency * 60)
+        if not bucket.take():
+            episode.suppressed += 1
+            self._stats["suppressed"] += 1
+            return
+        episode.notified_severity = episode.max_severity
+        alert = {
+            "patient_id": episode.patient_id,
+            "record_id": episode.record_id,
+            "condition": settings.condition,
+            "severity": SEVERITIES[episode.max_severity],
+            "threshold_exceeded": flag_names(episode.flags),
+            "started_at": episode.started_at.isoformat(),
+            "readings": episode.readings,
+            "peak": episode.details()["episode"]["peak"]
+        }
+        for method in settings.alert_methods or DEFAULT_ALERT_METHODS:
+            for recipient in settings.alert_recipients:
+                self._outbox[(method, recipient)].append(alert)
+        self._stats["notifications"] += 1
+
+    def _close(self, episode: Episode, ended_at: datetime):
+        episode.ended_at = ended_at
+        self._episodes.pop(episode.patient_id, None)
+        self._write(episode)
+        self._stats["episodes_closed"] += 1
+
+    def _open(self, episode: Episode, reading: Dict[str, Any], timestamp: datetime):
+        self._pending.append(("open", dict(
+            id=episode.record_id,
+            patient_id=episode.patient_id,
+            device_id=f"apple-watch-{episode.patient_id}",
+            timestamp=timestamp,
+            systolic=reading["systolic"],
+            diastolic=reading["diastolic"],
+            heart_rate=reading.get("heart_rate"),
+            activity_type=reading.get("activity_type"),
+            location=reading.get("location"),
+            ambient_temperature=reading.get("ambient_temperature"),
+            alert_generated=True,
+            alert_details=episode.details()
+        )))
+
+    def _write(self, episode: Episode):
+        self._pending.append(("update", dict(id=episode.record_id, alert_details=episode.details())))
+
+    async def _store(self):
+        """Write the queued episode records off the event loop, in the order they were queued"""
+        async with self._store_lock:
+            pending, self._pending = self._pending, []
+            if pending:
+                written, updated = await asyncio.to_thread(self._store_records, pending)
+                self._stats["records_written"] += written
+                self._stats["records_updated"] += updated
+
+    def _store_records(self, pending: List[tuple]):
+        written = updated = 0
+        db = self.session_factory()
+        try:
+            for kind, record in pending:
+                try:
+                    if kind == "open":
+                        db.add(VitalsReading(**record))
+                    else:
+                        db.execute(
+                            update(VitalsReading).where(VitalsReading.id == record["id"]).values(
+                                alert_details=record["alert_details"]
+                            )
+                        )
+                    db.commit()
+                    if kind == "open":
+                        written += 1
+                    else:
+                        updated += 1
+                except Exception as e:
+                    db.rollback()
+                    print(f"Error storing alert episode: {str(e)}")
+        finally:
+            db.close()
+        return written, updated
+
+
+alert_engine = AlertEngine()
@@ -0,0 +1,229 @@
+import asyncio
+import bisect
+import itertools
+import os
+import shutil
+from collections import Counter
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from fastapi import UploadFile
+from sqlalchemy import or_
+from ..database.db import SessionLocal
+from ..models.analysis import Analysis
+from .upload_ingest import copy_upload
+
+# Job queue configuration, overridable per deployment
+UPLOAD_DIR = os.getenv("AIMED_ANALYSIS_UPLOAD_DIR", "uploads/analyses")
+NUM_WORKERS = int(os.getenv("AIMED_ANALYSIS_WORKERS", "2"))
+STALE_JOB_SECONDS = int(os.getenv("AIMED_ANALYSIS_JOB_TIMEOUT", "900"))
+MAX_CONCURRENT_FILES = int(os.getenv("AIMED_MAX_CONCURRENT_FILES", "4"))
+
+# Lower rank is served first
+PRIORITY_RANKS = {'high': 0, 'medium': 1, 'low': 2}
+
+
+class AnalysisJobQueue:
+    """Local worker pool that runs queued analyses outside the HTTP request.
+
+    Jobs are ``Analysis`` rows in ``pending`` state whose uploads were saved
+    under ``upload_dir/<analysis_id>/``. Workers take the highest-priority
+    job first, claim it with a conditional ``pending -> processing`` update,
+    run inference, mark it ``completed`` (or ``failed``) and remove its
+    uploads.
+    """
+
+    def __init__(
+        self,
+        analyzer,
+        session_factory=SessionLocal,
+        num_workers: int = NUM_WORKERS,
+        upload_dir: str = UPLOAD_DIR,
+        dedup_index=None
+    ):
+        self.analyzer = analyzer
+        self.dedup_index = dedup_index
+        self.session_factory = session_factory
+        self.num_workers = max(1, num_workers)
+        self.upload_dir = upload_dir
+        self._queue = None
+        self._workers = []
+        self._sequence = itertools.count()  # FIFO within the same priority
+        self._queued = {}  # analysis_id -> (rank, sequence) while waiting for a worker
+        self._order = []  # the same keys, sorted, for queue_position
+
+    async def save_uploads(self, analysis_id: str, files: List[UploadFile]) -> str:
+        """Persist uploaded files for a job and return their directory"""
+        job_dir = os.path.join(self.upload_dir, analysis_id)
+        await asyncio.to_thread(os.makedirs, job_dir, exist_ok=True)
+        for index, file in enumerate(files):
+            # Prefixed with the upload's position, so empty or repeated names can't overwrite each other
+            name = f"{index}_{os.path.basename(file.filename or '')}"
+            await asyncio.to_thread(copy_upload, file.file, os.path.join(job_dir, name))
+        return job_dir
+
+    def enqueue(self, analysis_id: str, priority: Optional[str]):
+        self._ensure_queue()
+        if analysis_id in self._queued:
+            return
+        key = (PRIORITY_RANKS.get(priority, PRIORITY_RANKS['low']), next(self._sequence))
+        self._queued[analysis_id] = key
+        bisect.insort(self._order, key)
+        self._queue.put_nowait((*key, analysis_id))
+
+    async def start(self):
+        """Start workers and re-queue jobs left over from a previous run"""
+        self._ensure_queue()
+        self._recover_jobs()
+        while len(self._workers) < self.num_workers:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def queue_position(self, analysis_id: str) -> Optional[int]:
+        """1-based position of a job among queued jobs, or None if not queued"""
+        key = self._queued.get(analysis_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._order, key) + 1
+
+    def _ensure_queue(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+
+    def _recover_jobs(self):
+        db = self.session_factory()
+        try:
+            # Jobs claimed too long ago belonged to a dead worker
+            stale_before = datetime.utcnow() - timedelta(seconds=STALE_JOB_SECONDS)
+            db.query(Analysis).filter(
+                Analysis.status == 'processing',
+                or_(Analysis.started_at < stale_before, Analysis.started_at.is_(None))
+            ).update({Analysis.status: 'pending'}, synchronize_session=False)
+            db.commit()
+
+            pending = db.query(Analysis.id, Analysis.priority).filter(
+                Analysis.status == 'pending'
+            ).order_by(Analysis.created_at).all()
+            for analysis_id, priority in pending:
+                self.enqueue(analysis_id, priority)
+        except Exception as e:
+            print(f"Error recovering analysis jobs: {str(e)}")
+        finally:
+            db.close()
+
+    async def _worker(self):
+        while True:
+            rank, sequence, analysis_id = await self._queue.get()
+            self._queued.pop(analysis_id, None)
+            del self._order[bisect.bisect_left(self._order, (rank, sequence))]
+            try:
+                await self._process(analysis_id)
+            except Exception as e:
+                print(f"Error processing analysis job {analysis_id}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def _claim(self, db, analysis_id: str) -> bool:
+        # Conditional update so a job is only ever run by one worker
+        claimed = db.query(Analysis).filter(
+            Analysis.id == analysis_id,
+            Analysis.status == 'pending'
+        ).update({Analysis.status: 'processing', Analysis.started_at: datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+
+    async def _process(self, analysis_id: str):
+        db = self.session_factory()
+        try:
+            if not self._claim(db, analysis_id):
+                return
+            try:
+                await self._complete(db, analysis_id)
+            finally:
+                # The job has run; its uploads are no longer needed
+                await asyncio.to_thread(shutil.rmtree, os.path.join(self.upload_dir, analysis_id), True)
+        finally:
+            db.close()
+
+    async def _complete(self, db, analysis_id: str):
+        analysis = db.query(Analysis).filter(Analysis.id == analysis_id).first()
+
+        try:
+            analysis_results, model_versions, fingerprints = await self._run_analysis(analysis)
+            risk_assessment = await self.analyzer.get_study_risk_assessment(analysis_results)
+        except Exception as e:
+            print(f"Error analyzing job {analysis_id}: {str(e)}")
+            analysis.status = 'failed'
+            analysis.completed_at = datetime.utcnow()
+            db.commit()
+            return
+
+        analysis.results = analysis_results
+        analysis.model_versions = model_versions
+        analysis.risk_assessment = risk_assessment
+        analysis.status = 'completed'
+        analysis.completed_at = datetime.utcnow()
+        db.commit()
+
+        if self.dedup_index is not None and fingerprints:
+            try:
+                self.dedup_index.add(db, analysis.id, analysis.patient_id, analysis.analysis_type, fingerprints)
+            except Exception as e:
+                print(f"Error indexing images of analysis {analysis_id}: {str(e)}")
+
+    async def _run_analysis(self, analysis: Analysis) -> Tuple[Dict[str, Dict[str, float]], Dict[str, str], Dict]:
+        stored, handles = await asyncio.to_thread(_open_uploads, os.path.join(self.upload_dir, analysis.id))
+        try:
+            files = [UploadFile(file=handle, filename=name) for handle, name in zip(handles, _result_names(stored))]
+            analysis_results = {}
+            model_versions = {}
+            # Closed on the first error, so no file is still being read when the handles close
+            async with aclosing(self.analyzer.analyze_files(
+                analysis.analysis_type, files, MAX_CONCURRENT_FILES
+            )) as outcomes:
+                async for filename, results, model_version, error in outcomes:
+                    if error is not None:
+                        raise error
+                    analysis_results[filename] = results
+                    model_versions[filename] = model_version
+            return analysis_results, model_versions, await self._fingerprint(files)
+        finally:
+            for handle in handles:
+                handle.close()
+
+    async def _fingerprint(self, files: List[UploadFile]) -> Dict:
+        if self.dedup_index is None:
+            return {}
+        fingerprints = {}
+        for file in files:
+            try:
+                fingerprints[file.filename] = await self.analyzer.fingerprint(file)
+            except Exception as e:
+                print(f"Error fingerprinting {file.filename}: {str(e)}")
+        return fingerprints
+
+
+def _open_uploads(job_dir: str) -> Tuple[List[str], list]:
+    """Stored upload names in upload order, with a handle open on each"""
+    stored = sorted(os.listdir(job_dir), key=lambda name: int(name.split("_", 1)[0]))
+    handles = []
+    try:
+        for name in stored:
+            handles.append(open(os.path.join(job_dir, name), 'rb'))
+    except Exception:
+        for handle in handles:
+            handle.close()
+        raise
+    return stored, handles
+
+
+def _result_names(stored: List[str]) -> List[str]:
+    """Original upload names, keeping the position prefix where it is needed to tell files apart"""
+    originals = [name.split("_", 1)[1] for name in stored]
+    counts = Counter(originals)
+    return [original if original and counts[original] == 1 else name for name, original in zip(stored, originals)]
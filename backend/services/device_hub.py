@@ -0,0 +1,162 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+# Live monitoring configuration, overridable per deployment
+POLL_INTERVAL_SECONDS = float(os.getenv("AIMED_DEVICE_POLL_SECONDS", "30"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("AIMED_DEVICE_SUBSCRIBER_QUEUE", "16"))
+
+_CLOSED = object()  # queue sentinel ending a subscription
+
+
+class Subscription:
+    """One consumer's bounded queue of readings for a device.
+
+    Iterate with ``async for``; iteration ends when the subscription is
+    closed, either by the consumer or by the hub dropping it for falling
+    behind (``dropped`` is then True).
+    """
+
+    def __init__(self, hub: 'DeviceHub', device_id: str, queue_size: int):
+        self.hub = hub
+        self.device_id = device_id
+        self.dropped = False
+        self.closed = False
+        self._queue = asyncio.Queue(maxsize=queue_size)
+
+    def _offer(self, reading: Dict[str, Any]) -> bool:
+        """Queue a reading without waiting; False if the consumer is too far behind"""
+        try:
+            self._queue.put_nowait(reading)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def _end(self, dropped: bool = False):
+        if self.closed:
+            return
+        self.closed = True
+        self.dropped = dropped
+        # Make room for the sentinel; a dropped consumer loses its backlog anyway
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(_CLOSED)
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        reading = await self._queue.get()
+        if reading is _CLOSED:
+            raise StopAsyncIteration
+        return reading
+
+
+class DeviceHub:
+    """In-process pub/sub for live device readings.
+
+    One poller task per device fetches readings and fans each new reading
+    out to every subscriber, so N viewers of a patient cost one upstream
+    read per interval instead of N. Publishing never waits on a consumer:
+    a subscriber whose queue is full is dropped. Pollers start with the
+    first subscriber and stop with the last.
+
+    ``on_reading`` runs once per new reading per device, independent of
+    how many subscribers are connected.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+        poll_interval: float = POLL_INTERVAL_SECONDS,
+        queue_size: int = SUBSCRIBER_QUEUE_SIZE,
+        on_reading: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None
+    ):
+        self.fetch = fetch
+        self.poll_interval = poll_interval
+        self.queue_size = max(1, queue_size)
+        self.on_reading = on_reading
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._pollers: Dict[str, asyncio.Task] = {}
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        self.dropped_subscribers = 0
+
+    def subscribe(self, device_id: str) -> Subscription:
+        subscription = Subscription(self, device_id, self.queue_size)
+        self._subscribers.setdefault(device_id, set()).add(subscription)
+        # Late joiners see the last known reading right away instead of waiting a full interval
+        if device_id in self._latest:
+            subscription._offer(self._latest[device_id])
+        poller = self._pollers.get(device_id)
+        if poller is None or poller.done():
+            self._pollers[device_id] = asyncio.create_task(self._poll(device_id))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.device_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._stop(subscription.device_id)
+        subscription._end()
+
+    def publish(self, device_id: str, reading: Dict[str, Any]):
+        self._latest[device_id] = reading
+        for subscription in list(self._subscribers.get(device_id, ())):
+            if not subscription._offer(reading):
+                print(f"Dropping slow subscriber of {device_id}")
+                self.dropped_subscribers += 1
+                self._subscribers[device_id].discard(subscription)
+                subscription._end(dropped=True)
+        if not self._subscribers.get(device_id):
+            self._stop(device_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "devices": len(self._pollers),
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "dropped_subscribers": self.dropped_subscribers
+        }
+
+    async def close(self):
+        for device_id in list(self._subscribers):
+            for subscription in list(self._subscribers[device_id]):
+                subscription._end()
+        self._subscribers.clear()
+        pollers = list(self._pollers.values())
+        for poller in pollers:
+            poller.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+        self._pollers.clear()
+
+    def _stop(self, device_id: str):
+        self._subscribers.pop(device_id, None)
+        self._latest.pop(device_id, None)
+        poller = self._pollers.pop(device_id, None)
+        if poller is not None and poller is not asyncio.current_task():
+            poller.cancel()
+
+    async def _poll(self, device_id: str):
+        last_timestamp = None
+        # Exits once _stop() has removed this task or a newer poller replaced it
+        while self._pollers.get(device_id) is asyncio.current_task():
+            try:
+                reading = await self.fetch(device_id)
+            except Exception as e:
+                print(f"Error polling device {device_id}: {str(e)}")
+                reading = None
+
+            # Devices report their latest reading; only publish it once
+            if reading and reading.get("timestamp") != last_timestamp:
+                last_timestamp = reading.get("timestamp")
+                self.publish(device_id, reading)
+                if self.on_reading is not None:
+                    try:
+                        await self.on_reading(device_id, reading)
+                    except Exception as e:
+                        print(f"Error handling reading from {device_id}: {str(e)}")
+
+            await asyncio.sleep(self.poll_interval)
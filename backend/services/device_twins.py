@@ -0,0 +1,89 @@
+import asyncio
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+# Wearables are registered in IoT Hub as "apple-watch-<user id>"
+DEVICE_ID_PREFIX = "apple-watch-"
+
+# Local stand-in for IoT Hub device twins, used when no IoT Hub is configured
+LOCAL_TWIN_DIR = os.getenv("AIMED_LOCAL_TWIN_DIR", "data/twins")
+
+
+def device_id_for(user_id: str) -> str:
+    return f"{DEVICE_ID_PREFIX}{user_id}"
+
+
+def user_id_for(device_id: str) -> str:
+    return device_id[len(DEVICE_ID_PREFIX):] if device_id.startswith(DEVICE_ID_PREFIX) else device_id
+
+
+def vitals_from_reported(reported: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Latest BP reading from a twin's reported properties, or None"""
+    if "vitals" not in reported:
+        return None
+    vitals = reported["vitals"]
+    return {
+        "systolic": vitals["bp_systolic"],
+        "diastolic": vitals["bp_diastolic"],
+        "timestamp": vitals["timestamp"],
+        "heart_rate": vitals["heart_rate"]
+    }
+
+
+class IoTHubTwinSource:
+    """Reads device twins from Azure IoT Hub without blocking the event loop"""
+
+    def __init__(self, connection_str: str):
+        from azure.iot.hub import IoTHubRegistryManager
+
+        self.registry_manager = IoTHubRegistryManager(connection_str)
+
+    async def get_vitals(self, device_id: str) -> Optional[Dict[str, Any]]:
+        # The SDK call is synchronous; run it on a worker thread
+        twin = await asyncio.to_thread(self.registry_manager.get_twin, device_id)
+        return vitals_from_reported(twin.properties.reported)
+
+
+class LocalTwinSource:
+    """In-process stand-in for IoT Hub twins, for development and tests.
+
+    Reported properties come from ``update()`` or, failing that, from
+    ``<twin_dir>/<device_id>.json`` holding the same document IoT Hub would
+    report (``{"vitals": {"bp_systolic": ..., ...}}``).
+    """
+
+    def __init__(self, twin_dir: Optional[str] = LOCAL_TWIN_DIR):
+        self.twin_dir = twin_dir
+        self._reported = {}
+        self._lock = threading.Lock()
+        self.reads = 0  # lets tests check how often twins are polled
+
+    def update(self, device_id: str, reported: Dict[str, Any]):
+        with self._lock:
+            self._reported[device_id] = reported
+
+    async def get_vitals(self, device_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self.reads += 1
+            reported = self._reported.get(device_id)
+        if reported is None and self.twin_dir:
+            reported = await asyncio.to_thread(self._read_file, device_id)
+        return vitals_from_reported(reported) if reported else None
+
+    def _read_file(self, device_id: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.twin_dir, f"{device_id}.json")
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def default_twin_source():
+    """IoT Hub when a connection string is configured, the local stand-in otherwise"""
+    connection_str = os.getenv("AZURE_IOTHUB_CONNECTION_STRING")
+    if connection_str:
+        return IoTHubTwinSource(connection_str)
+    return LocalTwinSource()
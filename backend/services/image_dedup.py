@@ -0,0 +1,237 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from PIL import Image
+from sqlalchemy.orm import Session
+
+# Near-duplicate thresholds in differing bits out of 64, overridable per deployment
+MAX_PHASH_DISTANCE = int(os.getenv("AIMED_DEDUP_MAX_PHASH_DISTANCE", "10"))
+MAX_DHASH_DISTANCE = int(os.getenv("AIMED_DEDUP_MAX_DHASH_DISTANCE", "12"))
+CACHED_INDEXES = int(os.getenv("AIMED_DEDUP_CACHED_INDEXES", "1024"))
+
+PHASH_SIZE = 32  # DCT input size; the 8x8 lowest frequencies form the hash
+HASH_SIZE = 8
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so a 2-D DCT is two matrix products"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    basis = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    basis[0] /= np.sqrt(2.0)
+    return basis
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+class Fingerprint(NamedTuple):
+    phash: int
+    dhash: int
+
+    def distance(self, other: 'Fingerprint') -> Tuple[int, int]:
+        return hamming(self.phash, other.phash), hamming(self.dhash, other.dhash)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def fingerprint_image(source: BinaryIO) -> Fingerprint:
+    """pHash and dHash of an image file.
+
+    Both hashes work on a small grayscale thumbnail, so they survive
+    re-encoding, rescaling and small crops. JPEGs are decoded straight at
+    reduced scale, which makes this much cheaper than a full decode.
+    """
+    source.seek(0)
+    image = Image.open(source)
+    image.draft('L', (PHASH_SIZE * 4, PHASH_SIZE * 4))
+    gray = image.convert('L')
+
+    pixels = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only reflects overall brightness, so it is left out of the median
+    phash = _pack(low > np.median(low[1:]))
+
+    pixels = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    dhash = _pack(pixels[:, 1:] > pixels[:, :-1])
+    return Fingerprint(phash, dhash)
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes under Hamming distance.
+
+    A search only descends into children whose edge distance is within
+    ``max_distance`` of the query's distance to the node (triangle
+    inequality), so small-radius lookups visit a fraction of the entries.
+    """
+
+    def __init__(self):
+        self._root = None  # [key, items, {distance: child}]
+        self.size = 0
+
+    def add(self, key: int, item: Any):
+        self.size += 1
+        if self._root is None:
+            self._root = [key, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [item], {}]
+                return
+            node = child
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """(distance, item) pairs within ``max_distance``, closest first"""
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class SimilarImage(NamedTuple):
+    analysis_id: str
+    filename: str
+    phash_distance: int
+    dhash_distance: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+class ImageDedupIndex:
+    """Per-patient perceptual-hash index over ``ImageFingerprint`` rows.
+
+    A BK-tree for each (patient, analysis type) is built from the patient's
+    rows on first use and kept in a bounded LRU, so a lookup touches only
+    that patient's fingerprints and never scans other analyses. New
+    fingerprints are written to the table and added to a cached tree.
+    ``ImageFingerprint`` is imported on use, so the analyzer can hash
+    images without importing the database.
+    """
+
+    def __init__(self, max_cached: int = CACHED_INDEXES):
+        self.max_cached = max_cached
+        self._trees = OrderedDict()
+        self._building = {}  # key -> trees being built from the table right now
+        self._adds_while_building = {}  # key -> adds committed since those builds began
+        self._lock = threading.Lock()
+
+    def find_similar(
+        self,
+        db: Session,
+        patient_id: str,
+        analysis_type: str,
+        fingerprint: Fingerprint,
+        max_phash_distance: int = MAX_PHASH_DISTANCE,
+        max_dhash_distance: int = MAX_DHASH_DISTANCE,
+        exclude_analysis_id: Optional[str] = None
+    ) -> List[SimilarImage]:
+        """Prior images of the patient within both distance thresholds, closest first"""
+        tree = self._tree(db, patient_id, analysis_type)
+        with self._lock:
+            candidates = tree.search(fingerprint.phash, max_phash_distance)
+        similar = []
+        for phash_distance, (dhash, analysis_id, filename) in candidates:
+            dhash_distance = hamming(fingerprint.dhash, dhash)
+            # dHash confirms pHash matches, filtering out images that only share coarse structure
+            if dhash_distance <= max_dhash_distance and analysis_id != exclude_analysis_id:
+                similar.append(SimilarImage(analysis_id, filename, phash_distance, dhash_distance))
+        return similar
+
+    def add(self, db: Session, analysis_id: str, patient_id: str, analysis_type: str,
+            fingerprints: Dict[str, Fingerprint]):
+        """Store fingerprints of an analysis' files and index them"""
+        from ..models.analysis import ImageFingerprint
+        for filename, fingerprint in fingerprints.items():
+            db.add(ImageFingerprint(
+                analysis_id=analysis_id,
+                patient_id=patient_id,
+                analysis_type=analysis_type,
+                filename=filename,
+                phash=f"{fingerprint.phash:016x}",
+                dhash=f"{fingerprint.dhash:016x}"
+            ))
+        db.commit()
+
+        key = (patient_id, analysis_type)
+        with self._lock:
+            if key in self._building:
+                # A tree being built may have read the table before this commit; it must not be cached
+                self._adds_while_building[key] = self._adds_while_building.get(key, 0) + 1
+            tree = self._trees.get(key)
+            if tree is not None:
+                for filename, fingerprint in fingerprints.items():
+                    tree.add(fingerprint.phash, (fingerprint.dhash, analysis_id, filename))
+
+    def fingerprints_for(self, db: Session, analysis_id: str) -> Dict[str, Fingerprint]:
+        from ..models.analysis import ImageFingerprint
+        rows = db.query(ImageFingerprint).filter(ImageFingerprint.analysis_id == analysis_id).all()
+        return {row.filename: Fingerprint(int(row.phash, 16), int(row.dhash, 16)) for row in rows}
+
+    def _tree(self, db: Session, patient_id: str, analysis_type: str) -> BKTree:
+        from ..models.analysis import ImageFingerprint
+        key = (patient_id, analysis_type)
+        with self._lock:
+            tree = self._trees.get(key)
+            if tree is not None:
+                self._trees.move_to_end(key)
+                return tree
+            self._building[key] = self._building.get(key, 0) + 1
+            adds_before = self._adds_while_building.get(key, 0)
+
+        tree = BKTree()
+        try:
+            rows = db.query(
+                ImageFingerprint.phash, ImageFingerprint.dhash, ImageFingerprint.analysis_id, ImageFingerprint.filename
+            ).filter(
+                ImageFingerprint.patient_id == patient_id,
+                ImageFingerprint.analysis_type == analysis_type
+            ).all()
+            for phash, dhash, analysis_id, filename in rows:
+                tree.add(int(phash, 16), (int(dhash, 16), analysis_id, filename))
+        except Exception:
+            with self._lock:
+                self._finish_build(key)
+            raise
+
+        with self._lock:
+            current = self._adds_while_building.get(key, 0) == adds_before
+            self._finish_build(key)
+            if not current:
+                # Serves this lookup; the next one rebuilds with the new rows
+                return tree
+            # Another request may have built it meanwhile; keep the first so adds aren't lost
+            tree = self._trees.setdefault(key, tree)
+            self._trees.move_to_end(key)
+            while len(self._trees) > self.max_cached:
+                self._trees.popitem(last=False)
+        return tree
+
+    def _finish_build(self, key):
+        # Caller holds the lock
+        self._building[key] -= 1
+        if not self._building[key]:
+            del self._building[key]
+            self._adds_while_building.pop(key, None)
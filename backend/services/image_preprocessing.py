@@ -0,0 +1,105 @@
+import io
+from typing import Dict, List, Sequence, Tuple, Union
+import numpy as np
+from PIL import Image
+
+# ImageNet statistics shared by the Keras DenseNet ("torch" mode) and torchvision pipelines
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+TARGET_SIZE = (224, 224)
+
+# Target normalizations: channel layout, resize filter and per-channel affine
+# transform applied to the uint8 pixels. The filters match what each model
+# was served with before (PIL's default bicubic for Keras, torchvision's
+# bilinear Resize for Torch) so predictions stay unchanged.
+NORMALIZATIONS = {
+    'densenet_keras': {
+        'layout': 'HWC',
+        'resample': Image.BICUBIC,
+        'mean': IMAGENET_MEAN,
+        'std': IMAGENET_STD
+    },
+    'torch_imagenet': {
+        'layout': 'CHW',
+        'resample': Image.BILINEAR,
+        'mean': IMAGENET_MEAN,
+        'std': IMAGENET_STD
+    }
+}
+
+
+class DecodedImage:
+    """An image decoded once, with resized pixels cached per (size, filter)"""
+
+    def __init__(self, image: Image.Image):
+        self.image = image
+        self._resized = {}
+
+    def pixels(self, size: Tuple[int, int], resample: int) -> np.ndarray:
+        """Read-only uint8 HWC view of the image resized to ``size``"""
+        key = (size, resample)
+        if key not in self._resized:
+            self._resized[key] = np.asarray(self.image.resize(size, resample))
+        return self._resized[key]
+
+
+def decode_image(source: Union[bytes, io.IOBase]) -> DecodedImage:
+    """Decode raw bytes or a binary file object to RGB exactly once"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return DecodedImage(Image.open(source).convert('RGB'))
+
+
+class ImagePreprocessor:
+    """Vectorized resize + normalization into preallocated float32 arrays.
+
+    Normalization is folded into a single scale/offset per channel
+    (``x * scale + offset``) and written straight from the uint8 pixel view
+    into the output slot, so no intermediate float images are allocated.
+    """
+
+    def __init__(self, size: Tuple[int, int] = TARGET_SIZE):
+        self.size = size
+        self._affine = {}
+        for name, spec in NORMALIZATIONS.items():
+            scale = (1.0 / (255.0 * spec['std'])).astype(np.float32)
+            offset = (-spec['mean'] / spec['std']).astype(np.float32)
+            if spec['layout'] == 'CHW':
+                scale, offset = scale[:, None, None], offset[:, None, None]
+            self._affine[name] = (scale, offset)
+
+    def sample_shape(self, normalization: str) -> Tuple[int, int, int]:
+        width, height = self.size
+        if NORMALIZATIONS[normalization]['layout'] == 'CHW':
+            return (3, height, width)
+        return (height, width, 3)
+
+    def allocate(self, batch_size: int, normalization: str) -> np.ndarray:
+        return np.empty((batch_size,) + self.sample_shape(normalization), dtype=np.float32)
+
+    def preprocess_into(self, out: np.ndarray, decoded: DecodedImage, normalization: str) -> np.ndarray:
+        """Write one normalized sample into ``out`` (a slot of a batch array)"""
+        spec = NORMALIZATIONS[normalization]
+        pixels = decoded.pixels(self.size, spec['resample'])
+        if spec['layout'] == 'CHW':
+            pixels = pixels.transpose(2, 0, 1)
+        scale, offset = self._affine[normalization]
+        np.multiply(pixels, scale, out=out)
+        np.add(out, offset, out=out)
+        return out
+
+    def preprocess(self, decoded: DecodedImage, normalization: str) -> np.ndarray:
+        return self.preprocess_into(
+            np.empty(self.sample_shape(normalization), dtype=np.float32), decoded, normalization
+        )
+
+    def preprocess_multi(self, decoded: DecodedImage, normalizations: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Several target normalizations from the same decoded pixels"""
+        return {name: self.preprocess(decoded, name) for name in normalizations}
+
+    def preprocess_batch(self, images: List[DecodedImage], normalization: str) -> np.ndarray:
+        batch = self.allocate(len(images), normalization)
+        for index, decoded in enumerate(images):
+            self.preprocess_into(batch[index], decoded, normalization)
+        return batch
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Tuple
+import numpy as np
+from .inference_metrics import BATCH_SIZE, STAGE_SECONDS, time_stage
+
+# Batching defaults, overridable per deployment
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv("AIMED_BATCH_MAX_SIZE", "8"))
+DEFAULT_MAX_WAIT_MS = float(os.getenv("AIMED_BATCH_MAX_WAIT_MS", "10"))
+
+
+class BatchMetrics:
+    """Rolling batch-size and queue-wait statistics for one model"""
+
+    def __init__(self, window: int = 1000):
+        self.batch_sizes = deque(maxlen=window)
+        self.queue_waits_ms = deque(maxlen=window)
+        self.total_batches = 0
+        self.total_items = 0
+
+    def record(self, batch_size: int, queue_waits_ms: List[float]):
+        self.batch_sizes.append(batch_size)
+        self.queue_waits_ms.extend(queue_waits_ms)
+        self.total_batches += 1
+        self.total_items += batch_size
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Summarize the recorded window for tuning batch size against latency"""
+        waits = np.array(self.queue_waits_ms, dtype=np.float64)
+        sizes = np.array(self.batch_sizes, dtype=np.float64)
+        return {
+            "total_batches": self.total_batches,
+            "total_items": self.total_items,
+            "avg_batch_size": float(sizes.mean()) if sizes.size else None,
+            "max_batch_size": int(sizes.max()) if sizes.size else None,
+            "queue_wait_ms": {
+                "p50": float(np.percentile(waits, 50)) if waits.size else None,
+                "p95": float(np.percentile(waits, 95)) if waits.size else None,
+                "p99": float(np.percentile(waits, 99)) if waits.size else None,
+            }
+        }
+
+
+class InferenceBatcher:
+    """Collect concurrent single-image requests into one forward pass per model.
+
+    Callers submit one preprocessed sample; the batcher waits up to
+    ``max_wait_ms`` for more samples (or until ``max_batch_size`` is reached),
+    stacks them, calls ``predict_fn`` once and resolves each caller's future
+    with its own row of the output. When an ``executor`` is given the forward
+    pass runs on its worker pool instead of the event loop.
+
+    ``predict_fn`` may return ``(outputs, tag)`` to identify what produced
+    the batch (e.g. the model version); ``submit`` returns ``(row, tag)``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+        executor=None
+    ):
+        self.name = name
+        self.predict_fn = predict_fn
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.metrics = BatchMetrics()
+        self._input_buffer = None  # reused across batches, grown on shape change
+        self._queue = None
+        self._worker = None
+
+    async def submit(self, sample: np.ndarray) -> Tuple[np.ndarray, Any]:
+        """Queue a single sample (no batch axis) and wait for its prediction and tag"""
+        loop = asyncio.get_running_loop()
+        self._ensure_worker()
+        future = loop.create_future()
+        await self._queue.put((sample, future, time.perf_counter()))
+        return await future
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            # Keep collecting until the batch is full or the wait budget is spent
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._process(batch)
+
+    async def _process(self, batch: List[Tuple[np.ndarray, asyncio.Future, float]]):
+        # Drop requests whose callers have gone away before paying for them
+        batch = [item for item in batch if not item[1].done()]
+        if not batch:
+            return
+
+        started = time.perf_counter()
+        queue_waits = [started - enqueued for _, _, enqueued in batch]
+        self.metrics.record(len(batch), [wait * 1000.0 for wait in queue_waits])
+        BATCH_SIZE.observe(len(batch), self.name)
+        for wait in queue_waits:
+            STAGE_SECONDS.observe(wait, self.name, 'queue_wait')
+
+        try:
+            inputs = self._stack([sample for sample, _, _ in batch])
+            with time_stage(self.name, 'forward'):
+                outputs, tag = await self._forward(inputs)
+        except Exception as e:
+            print(f"Error running {self.name} batch: {str(e)}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), output in zip(batch, outputs):
+            if not future.done():
+                future.set_result((output, tag))
+
+    def _stack(self, samples: List[np.ndarray]) -> np.ndarray:
+        """Copy samples into the preallocated batch buffer instead of a fresh array.
+
+        Safe because a batcher runs one forward pass at a time.
+        """
+        sample = samples[0]
+        buffer = self._input_buffer
+        if buffer is None or buffer.shape[1:] != sample.shape or buffer.dtype != sample.dtype:
+            buffer = np.empty((self.max_batch_size,) + sample.shape, dtype=sample.dtype)
+            self._input_buffer = buffer
+        return np.stack(samples, out=buffer[:len(samples)])
+
+    async def _forward(self, inputs: np.ndarray) -> Tuple[np.ndarray, Any]:
+        if self.executor is not None:
+            result = await self.executor.run(self.predict_fn, inputs)
+        else:
+            result = self.predict_fn(inputs)
+        if isinstance(result, tuple):
+            outputs, tag = result
+            return np.asarray(outputs), tag
+        return np.asarray(result), None
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Cache sizing, overridable per deployment
+DEFAULT_CACHE_DIR = os.getenv("AIMED_INFERENCE_CACHE_DIR", "cache/inference")
+DEFAULT_MEMORY_ENTRIES = int(os.getenv("AIMED_INFERENCE_CACHE_ENTRIES", "2048"))
+DEFAULT_DISK_MAX_BYTES = int(os.getenv("AIMED_INFERENCE_CACHE_DISK_MB", "256")) * 1024 * 1024
+
+
+def weights_fingerprint(*paths: str) -> str:
+    """Short version tag for a set of weight files, based on their size and mtime.
+
+    Replacing a weights file changes the fingerprint, which changes every
+    cache key built from it, so stale results are never served.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        except OSError:
+            digest.update(f"{path}:missing".encode())
+    return digest.hexdigest()[:12]
+
+
+class InferenceResultCache:
+    """Two-tier (memory LRU + on-disk) cache of analyzer results.
+
+    Keys are content addresses: a hash of the image bytes, the analysis type
+    and the model version that produced the result.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+        disk_max_bytes: int = DEFAULT_DISK_MAX_BYTES
+    ):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._disk_sizes = OrderedDict()  # key -> bytes, least recently used first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.disk_max_bytes > 0:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def content_hasher():
+        """Incremental hasher for content read in chunks; matches ``hash_content``"""
+        return hashlib.sha256()
+
+    @staticmethod
+    def hash_content(contents: bytes) -> str:
+        return hashlib.sha256(contents).hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, analysis_type: str, model_version: str) -> str:
+        return hashlib.sha256(f"{content_hash}:{analysis_type}:{model_version}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, value)
+        return value
+
+    def get_from_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        """Memory-tier lookup that never touches disk, so it is safe on the event loop.
+
+        Only hits are counted; follow a miss with ``get`` to consult the disk tier.
+        """
+        with self._lock:
+            if key not in self._memory:
+                return None
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+
+    def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """``get`` for several keys; blocking on disk reads, so run it off the event loop"""
+        return [self.get(key) for key in keys]
+
+    def put(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._remember(key, value)
+        self._write_disk(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._disk_sizes),
+            "disk_bytes": self._disk_bytes
+        }
+
+    def _remember(self, key: str, value: Dict[str, Any]):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load_disk_index(self):
+        """Rebuild the disk LRU order from file access times after a restart"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    stat = os.stat(os.path.join(root, name))
+                    entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_sizes[key] = size
+            self._disk_bytes += size
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.disk_max_bytes <= 0 or key not in self._disk_sizes:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self._forget_disk(key)
+            return None
+        with self._lock:
+            if key in self._disk_sizes:
+                self._disk_sizes.move_to_end(key)
+        return value
+
+    def _write_disk(self, key: str, value: Dict[str, Any]):
+        if self.disk_max_bytes <= 0:
+            return
+        path = self._path(key)
+        data = json.dumps(value).encode()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing inference cache entry: {str(e)}")
+            return
+
+        with self._lock:
+            self._forget_disk(key)
+            self._disk_sizes[key] = len(data)
+            self._disk_bytes += len(data)
+            evicted = []
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk_sizes) > 1:
+                old_key, old_size = self._disk_sizes.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def _forget_disk(self, key: str):
+        size = self._disk_sizes.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
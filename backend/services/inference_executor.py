@@ -0,0 +1,100 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict
+
+# Executor sizing, overridable per deployment
+DEFAULT_WORKERS = int(os.getenv("AIMED_INFERENCE_WORKERS", "2"))
+DEFAULT_QUEUE_SIZE = int(os.getenv("AIMED_INFERENCE_QUEUE_SIZE", "32"))
+DEFAULT_INTRA_OP_THREADS = int(os.getenv("AIMED_INTRA_OP_THREADS", "0"))  # 0 = library default
+
+_threads_configured = False
+_threads_lock = threading.Lock()
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the analysis backlog is full and new work is rejected"""
+    pass
+
+
+def configure_intra_op_threads(threads: int = DEFAULT_INTRA_OP_THREADS):
+    """Cap TensorFlow/Torch intra-op threads so workers don't oversubscribe the CPU.
+
+    Must run before the first model is built; TensorFlow ignores changes
+    after its runtime has been initialized. Safe to call from every model
+    loader; only the first call does any work.
+    """
+    global _threads_configured
+    if threads <= 0 or _threads_configured:
+        return
+
+    with _threads_lock:
+        if _threads_configured:
+            return
+
+        import torch
+        import tensorflow as tf
+
+        torch.set_num_threads(threads)
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except RuntimeError as e:
+            print(f"Could not configure TensorFlow threads: {str(e)}")
+        _threads_configured = True
+
+
+class InferenceExecutor:
+    """Dedicated worker pool for blocking decode, preprocessing and forward passes.
+
+    ``admission()`` bounds how many analyses may be in flight (running plus
+    queued); anything beyond that is rejected with ``InferenceQueueFull``
+    instead of piling up behind the event loop.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_WORKERS,
+        max_queue_size: int = DEFAULT_QUEUE_SIZE
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_in_flight = self.max_workers + max(0, max_queue_size)
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="aimed-inference"
+        )
+        self._in_flight = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def admission(self):
+        """Reserve a slot for one analysis or fail fast when the backlog is full"""
+        if self._in_flight >= self.max_in_flight:
+            self.rejected += 1
+            raise InferenceQueueFull(
+                f"Inference queue is full ({self._in_flight} analyses in flight)"
+            )
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking callable on the worker pool without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.max_workers,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self._in_flight,
+            "rejected": self.rejected
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
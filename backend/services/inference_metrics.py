@@ -0,0 +1,205 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Bucket upper bounds in seconds: sub-millisecond preprocessing up to multi-second CPU forward passes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _format_labels(labelnames: Sequence[str], labels: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Histogram:
+    """Fixed-bucket histogram per label set.
+
+    ``observe`` is a bisect plus two additions under a lock, cheap enough
+    for every request on the inference hot path. Buckets are exported
+    cumulatively, as Prometheus expects.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def snapshot(self, *labels: str) -> Dict[str, float]:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                return {"count": 0, "sum": 0.0}
+            return {"count": sum(series[0]), "sum": series[1]}
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        lines = []
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {repr(float(total))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time, one sample per label set.
+
+    ``kind="counter"`` exports a monotonic total kept elsewhere (e.g. cache hits).
+    """
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str],
+                 collect: Callable[[], Dict[Tuple[str, ...], float]], kind: str = "gauge"):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {str(e)}")
+            return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(values.items())
+        ]
+
+
+class MetricsRegistry:
+    """Named metrics rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Re-registering a name replaces it, e.g. a gauge bound to a new analyzer
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str],
+              collect: Callable[[], Dict[Tuple[str, ...], float]], kind: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, help, labelnames, collect, kind))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Inference hot-path metrics, labelled by model ('xray', 'skin', 'mri')
+STAGE_SECONDS = registry.histogram(
+    "aimed_inference_stage_seconds",
+    "Time spent per analysis stage: ingest, decode, preprocess, queue_wait, forward, total",
+    ("model", "stage")
+)
+BATCH_SIZE = registry.histogram(
+    "aimed_inference_batch_size", "Samples per forward pass", ("model",), BATCH_SIZE_BUCKETS
+)
+REQUESTS = registry.counter(
+    "aimed_inference_requests_total", "Analyzed images by outcome: cached, inferred or error", ("model", "outcome")
+)
+ERRORS = registry.counter(
+    "aimed_inference_errors_total", "Failures by the stage that raised", ("model", "stage")
+)
+RISK_ASSESSMENT_SECONDS = registry.histogram(
+    "aimed_risk_assessment_seconds",
+    "Time to build a risk assessment: 'single' for one result set, 'batch' for a whole study",
+    ("scope",)
+)
+
+
+@contextmanager
+def time_stage(model: str, stage: str):
+    """Observe a stage's duration; failures are counted against the stage and re-raised"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(model, stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, model, stage)
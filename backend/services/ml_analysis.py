@@ -1,78 +1,332 @@
-import torch
-import torchvision.transforms as transforms
-from PIL import Image
-import io
 import numpy as np
-from typing import Dict, List, Tuple
-import tensorflow as tf
-from tensorflow.keras.applications import DenseNet121
-from tensorflow.keras.applications.densenet import preprocess_input
-import cv2
+from typing import BinaryIO, Dict, List, Tuple
 from fastapi import UploadFile
-import os
-import json
+import asyncio
+import functools
+import time
+from .inference_batcher import InferenceBatcher
+from .inference_executor import InferenceExecutor, configure_intra_op_threads
+from .inference_cache import InferenceResultCache
+from .model_loader import ModelWarmer
+from .model_registry import ModelRegistry, ModelVersion, MODEL_ROOT
+from .image_preprocessing import ImagePreprocessor, decode_image
+from .upload_ingest import spool_upload
+from .image_dedup import Fingerprint, fingerprint_image
+from .inference_metrics import registry, REQUESTS, RISK_ASSESSMENT_SECONDS, STAGE_SECONDS, time_stage
+from .optimized_models import (
+    INFERENCE_BACKEND, QUANTIZATION, PARITY_SAMPLES, backend_tag, check_parity, load_optimized_keras,
+    load_optimized_torch
+)
+
+# Probability thresholds for the high and medium risk levels
+HIGH_RISK_THRESHOLD = 0.7
+MEDIUM_RISK_THRESHOLD = 0.4
+RISK_LEVELS = ('low', 'medium', 'high')
+
+# Input normalization expected by each model
+MODEL_NORMALIZATIONS = {
+    'xray': 'densenet_keras',
+    'skin': 'torch_imagenet',
+    'mri': 'densenet_keras'
+}
 
 class MedicalImageAnalyzer:
-    def __init__(self):
-        # Initialize models
-        self.xray_model = self._load_xray_model()
-        self.skin_model = self._load_skin_model()
-        self.mri_model = self._load_mri_model()
-        
-        # Load disease labels
-        self.disease_labels = self._load_disease_labels()
+    def __init__(
+        self,
+        executor: InferenceExecutor = None,
+        cache: InferenceResultCache = None,
+        backend: str = INFERENCE_BACKEND,
+        quantization: str = QUANTIZATION,
+        model_root: str = MODEL_ROOT
+    ):
+        # Dedicated worker pool keeps blocking work off the event loop
+        self.executor = executor or InferenceExecutor()
+
+        # 'eager' serves the original models, 'optimized' their quantized exports
+        self.backend = backend
+        self.quantization = quantization
+
+        # Versioned models, hot-swappable at runtime. Each version loads on first
+        # use or through warm_up(); TensorFlow and Torch are only imported by the
+        # loaders so constructing the analyzer is cheap
+        self.registry = ModelRegistry(
+            list(MODEL_NORMALIZATIONS),
+            loader=self._load_model,
+            warm=self._warm_model,
+            root=model_root,
+            version_suffix=f"-{backend_tag(self.backend, self.quantization)}"
+        )
+        self.models = self.registry.active
+        self.warmer = ModelWarmer(self.models)
+
+        # Results are cached per image content and model version
+        self.cache = cache or InferenceResultCache()
         
-        # Image preprocessing
-        self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-        ])
-
-    def _load_xray_model(self):
+        # Image preprocessing shared by all models
+        self.preprocessor = ImagePreprocessor()
+
+        # One micro-batcher per model so concurrent uploads share a forward pass
+        self.batchers = {
+            name: InferenceBatcher(name, functools.partial(self._predict, name), executor=self.executor)
+            for name in MODEL_NORMALIZATIONS
+        }
+
+        # Scrape-time views of the executor and cache for /metrics
+        registry.gauge(
+            "aimed_inference_in_flight", "Images admitted to the inference pool", (),
+            lambda: {(): self.executor.stats()["in_flight"]}
+        )
+        registry.gauge(
+            "aimed_inference_rejected_total", "Images rejected because the inference queue was full", (),
+            lambda: {(): self.executor.stats()["rejected"]}, kind="counter"
+        )
+        registry.gauge(
+            "aimed_inference_cache_lookups_total", "Result cache lookups by outcome", ("outcome",),
+            lambda: {("hit",): self.cache.hits, ("miss",): self.cache.misses}, kind="counter"
+        )
+
+    @property
+    def xray_model(self):
+        return self.models['xray'].get()
+
+    @property
+    def skin_model(self):
+        return self.models['skin'].get()
+
+    @property
+    def mri_model(self):
+        return self.models['mri'].get()
+
+    @property
+    def disease_labels(self) -> Dict[str, List[str]]:
+        """Labels of the active version of each model"""
+        return {name: model.labels for name, model in self.models.items()}
+
+    @property
+    def model_versions(self) -> Dict[str, str]:
+        """Cache version tag of the active version of each model"""
+        return {name: model.cache_version for name, model in self.models.items()}
+
+    def warm_up(self):
+        """Start loading every model in the background, each in its own thread"""
+        self.warmer.start()
+
+    def get_readiness(self) -> Dict:
+        """Per-model load state for the readiness endpoint"""
+        return self.warmer.status()
+
+    def get_model_status(self) -> Dict:
+        """Active, staging and available versions of every model"""
+        return self.registry.status()
+
+    def activate_model(self, name: str, version: str = None):
+        """Load, warm and switch to another model version without interrupting traffic"""
+        if name not in self.models:
+            raise ValueError(f"Unknown model: {name}")
+        return self.registry.activate(name, version)
+
+    def _load_model(self, model_version: ModelVersion):
+        """Load a model version and, with the optimized backend, swap in its quantized export.
+
+        The export is only served once it matches the original on synthetic
+        samples; otherwise the version fails to load and is never activated.
+        """
+        model = self.load_original_model(model_version)
+        if self.backend != 'optimized':
+            return model
+        optimized = self.load_optimized_model(model_version, model)
+        report = self.check_optimized_parity(model_version.name, model, optimized)
+        if not report["passed"]:
+            raise RuntimeError(
+                f"Optimized {model_version.name} model {model_version.version} failed the parity check: {report}"
+            )
+        return optimized
+
+    def load_original_model(self, model_version: ModelVersion):
+        """The original fp32 model of a version, whatever the serving backend"""
+        loaders = {
+            'xray': self._load_xray_model,
+            'skin': self._load_skin_model,
+            'mri': self._load_mri_model
+        }
+        return loaders[model_version.name](model_version.weights_path)
+
+    def load_optimized_model(self, model_version: ModelVersion, original):
+        """The quantized export of a version's original model, exported first if missing"""
+        if model_version.name == 'skin':
+            return load_optimized_torch('skin', original, model_version.fingerprint, self.quantization)
+        return load_optimized_keras(model_version.name, original, model_version.fingerprint, self.quantization)
+
+    def check_optimized_parity(self, name: str, original, optimized, samples: np.ndarray = None) -> Dict:
+        """Compare an optimized model with its original on ``samples``, synthetic noise by default"""
+        if samples is None:
+            samples = self.parity_samples(name)
+        return check_parity(
+            functools.partial(self._forward, name, original),
+            functools.partial(self._forward, name, optimized),
+            samples
+        )
+
+    def parity_samples(self, name: str, count: int = PARITY_SAMPLES) -> np.ndarray:
+        """Seeded noise images in the model's input layout"""
+        rng = np.random.default_rng(0)
+        batch = self.preprocessor.allocate(count, MODEL_NORMALIZATIONS[name])
+        batch[:] = rng.standard_normal(batch.shape, dtype=np.float32)
+        return batch
+
+    def _load_xray_model(self, weights_path: str = 'models/xray_model.h5'):
         """Load pre-trained model for X-ray analysis"""
+        configure_intra_op_threads()
+        from tensorflow.keras.applications import DenseNet121
         model = DenseNet121(weights=None, include_top=True, classes=14)
-        model.load_weights('models/xray_model.h5')  # You'll need to provide the model weights
+        model.load_weights(weights_path)  # You'll need to provide the model weights
         return model
 
-    def _load_skin_model(self):
+    def _load_skin_model(self, weights_path: str = 'models/skin_model.pth'):
         """Load pre-trained model for skin lesion analysis"""
+        configure_intra_op_threads()
+        import torch
         model = torch.hub.load('pytorch/vision:v0.10.0', 'densenet121', pretrained=True)
-        model.load_state_dict(torch.load('models/skin_model.pth'))  # You'll need to provide the model weights
+        model.load_state_dict(torch.load(weights_path))  # You'll need to provide the model weights
+        model.eval()  # Batched inference must not use batch-norm statistics of the batch
         return model
 
-    def _load_mri_model(self):
+    def _load_mri_model(self, weights_path: str = 'models/mri_model.h5'):
         """Load pre-trained model for MRI analysis"""
+        configure_intra_op_threads()
+        from tensorflow.keras.applications import DenseNet121
         model = DenseNet121(weights=None, include_top=True, classes=8)
-        model.load_weights('models/mri_model.h5')  # You'll need to provide the model weights
+        model.load_weights(weights_path)  # You'll need to provide the model weights
         return model
 
-    def _load_disease_labels(self) -> Dict[str, List[str]]:
-        """Load disease labels for each type of analysis"""
-        with open('models/disease_labels.json', 'r') as f:
-            return json.load(f)
+    def _warm_model(self, model_version: ModelVersion):
+        """Run a synthetic batch so the first real request doesn't pay graph setup costs"""
+        shape = self.preprocessor.sample_shape(MODEL_NORMALIZATIONS[model_version.name])
+        self._forward(model_version.name, model_version.get(), np.zeros((1,) + shape, dtype=np.float32))
+
+    def _predict(self, name: str, batch: np.ndarray) -> Tuple[np.ndarray, ModelVersion]:
+        """Forward pass on the active version; the version is returned so results map to its labels"""
+        model_version = self.models[name]
+        return self._forward(name, model_version.get(), batch), model_version
+
+    def _forward(self, name: str, model, batch: np.ndarray) -> np.ndarray:
+        if name == 'skin':
+            import torch
+            with torch.no_grad():
+                logits = model(torch.from_numpy(batch))
+                return torch.nn.functional.softmax(logits, dim=1).numpy()
+        return model.predict(batch, verbose=0)
+
+    def _preprocess(self, source: BinaryIO, analysis_types: List[str]) -> Dict[str, np.ndarray]:
+        """Decode once and build the input for each requested model"""
+        stage_label = self._stage_label(analysis_types)
+        with time_stage(stage_label, 'decode'):
+            source.seek(0)
+            decoded = decode_image(source)
+        with time_stage(stage_label, 'preprocess'):
+            normalized = self.preprocessor.preprocess_multi(
+                decoded, {MODEL_NORMALIZATIONS[analysis_type] for analysis_type in analysis_types}
+            )
+        return {
+            analysis_type: normalized[MODEL_NORMALIZATIONS[analysis_type]]
+            for analysis_type in analysis_types
+        }
+
+    @staticmethod
+    def _stage_label(analysis_types: List[str]) -> str:
+        # Stages shared by several models in one study are reported once, as 'study'
+        return analysis_types[0] if len(analysis_types) == 1 else 'study'
+
+    def _map_predictions(self, labels: List[str], predictions: np.ndarray) -> Dict[str, float]:
+        """Keep only significant probabilities, keyed by label"""
+        return {
+            label: float(prob)
+            for label, prob in zip(labels, predictions)
+            if prob > 0.2
+        }
+
+    def get_batching_metrics(self) -> Dict[str, Dict]:
+        """Batch-size and queue-wait statistics per model"""
+        metrics = {name: batcher.metrics.snapshot() for name, batcher in self.batchers.items()}
+        metrics["executor"] = self.executor.stats()
+        metrics["cache"] = self.cache.stats()
+        return metrics
+
+    async def _analyze(self, analysis_type: str, image: UploadFile) -> Dict[str, float]:
+        """Serve from the result cache or run the image through its model"""
+        results, _ = (await self._analyze_study(image, [analysis_type]))[analysis_type]
+        return results
+
+    async def analyze_study(self, image: UploadFile, analysis_types: List[str]) -> Dict[str, Dict[str, float]]:
+        """Score one image with several models, decoding and resizing it only once"""
+        study_results = await self._analyze_study(image, analysis_types)
+        return {analysis_type: results for analysis_type, (results, _) in study_results.items()}
+
+    async def _analyze_study(self, image: UploadFile, analysis_types: List[str]) -> Dict[str, Tuple[Dict[str, float], str]]:
+        """Like analyze_study, but each result comes with the model version that produced it"""
+        started = time.perf_counter()
+        outcomes = {}
+        try:
+            study_results = await self._run_study(image, analysis_types, outcomes)
+        except Exception:
+            # Counted once per file: a failed study is an error even if some types were cached
+            for analysis_type in analysis_types:
+                REQUESTS.inc(analysis_type, 'error')
+            raise
+        elapsed = time.perf_counter() - started
+        for analysis_type in analysis_types:
+            REQUESTS.inc(analysis_type, outcomes[analysis_type])
+            STAGE_SECONDS.observe(elapsed, analysis_type, 'total')
+        return study_results
+
+    async def _run_study(self, image: UploadFile, analysis_types: List[str],
+                         outcomes: Dict[str, str]) -> Dict[str, Tuple[Dict[str, float], str]]:
+        """Fills ``outcomes`` with 'cached' or 'inferred' per type; the caller counts them"""
+        # Hashed and size-checked in chunks; the decoder reads the same file-backed buffer
+        with time_stage(self._stage_label(analysis_types), 'ingest'):
+            upload = await asyncio.to_thread(spool_upload, image.file, image.filename)
+        content_hash = upload.content_hash
+        study_results = {}
+        versions = {analysis_type: self.models[analysis_type] for analysis_type in analysis_types}
+        keys = [self.cache.make_key(content_hash, analysis_type, versions[analysis_type].cache_version)
+                for analysis_type in analysis_types]
+        # Memory hits are served here; only a lookup that may read the disk tier leaves the event loop
+        cached = [self.cache.get_from_memory(key) for key in keys]
+        unresolved = [i for i, value in enumerate(cached) if value is None]
+        if unresolved:
+            from_disk = await asyncio.to_thread(self.cache.get_many, [keys[i] for i in unresolved])
+            for i, value in zip(unresolved, from_disk):
+                cached[i] = value
+        for analysis_type, value in zip(analysis_types, cached):
+            if value is not None:
+                study_results[analysis_type] = (dict(value), versions[analysis_type].version)
+                outcomes[analysis_type] = 'cached'
+
+        missing = [analysis_type for analysis_type in analysis_types if analysis_type not in study_results]
+        if not missing:
+            return study_results
+
+        async with self.executor.admission():
+            # Preprocess on the worker pool, then batch with concurrent requests
+            inputs = await self.executor.run(self._preprocess, upload.file, missing)
+            predictions = await asyncio.gather(*[
+                self.batchers[analysis_type].submit(inputs[analysis_type])
+                for analysis_type in missing
+            ])
+
+        for analysis_type, (model_predictions, model_version) in zip(missing, predictions):
+            # Labels and cache key come from the version that actually ran
+            results = self._map_predictions(model_version.labels, model_predictions)
+            cache_key = self.cache.make_key(content_hash, analysis_type, model_version.cache_version)
+            await asyncio.to_thread(self.cache.put, cache_key, results)
+            study_results[analysis_type] = (results, model_version.version)
+            outcomes[analysis_type] = 'inferred'
+        return study_results
 
     async def analyze_xray(self, image: UploadFile) -> Dict[str, float]:
         """Analyze chest X-ray images for various conditions"""
         try:
-            # Read and preprocess image
-            contents = await image.read()
-            img = Image.open(io.BytesIO(contents)).convert('RGB')
-            img = img.resize((224, 224))
-            img_array = np.array(img)
-            img_array = preprocess_input(img_array)
-            img_array = np.expand_dims(img_array, axis=0)
-
-            # Get predictions
-            predictions = self.xray_model.predict(img_array)[0]
-            
-            # Map predictions to diseases
-            results = {}
-            for disease, prob in zip(self.disease_labels['xray'], predictions):
-                if prob > 0.2:  # Only include significant probabilities
-                    results[disease] = float(prob)
-            
-            return results
+            return await self._analyze('xray', image)
         except Exception as e:
             print(f"Error analyzing X-ray: {str(e)}")
             raise
@@ -80,23 +334,7 @@ class MedicalImageAnalyzer:
     async def analyze_skin_lesion(self, image: UploadFile) -> Dict[str, float]:
         """Analyze skin lesions for various conditions"""
         try:
-            # Read and preprocess image
-            contents = await image.read()
-            img = Image.open(io.BytesIO(contents)).convert('RGB')
-            img_tensor = self.transform(img)
-            img_tensor = img_tensor.unsqueeze(0)
-
-            # Get predictions
-            with torch.no_grad():
-                predictions = torch.nn.functional.softmax(self.skin_model(img_tensor), dim=1)[0]
-            
-            # Map predictions to conditions
-            results = {}
-            for condition, prob in zip(self.disease_labels['skin'], predictions):
-                if prob > 0.2:
-                    results[condition] = float(prob)
-            
-            return results
+            return await self._analyze('skin', image)
         except Exception as e:
             print(f"Error analyzing skin lesion: {str(e)}")
             raise
@@ -104,63 +342,197 @@ class MedicalImageAnalyzer:
     async def analyze_mri(self, image: UploadFile) -> Dict[str, float]:
         """Analyze MRI scans for various conditions"""
         try:
-            # Read and preprocess image
-            contents = await image.read()
-            img = Image.open(io.BytesIO(contents)).convert('RGB')
-            img = img.resize((224, 224))
-            img_array = np.array(img)
-            img_array = preprocess_input(img_array)
-            img_array = np.expand_dims(img_array, axis=0)
-
-            # Get predictions
-            predictions = self.mri_model.predict(img_array)[0]
-            
-            # Map predictions to conditions
-            results = {}
-            for condition, prob in zip(self.disease_labels['mri'], predictions):
-                if prob > 0.2:
-                    results[condition] = float(prob)
-            
-            return results
+            return await self._analyze('mri', image)
         except Exception as e:
             print(f"Error analyzing MRI: {str(e)}")
             raise
 
+    async def fingerprint(self, image: UploadFile) -> Fingerprint:
+        """Perceptual hashes of an upload, for near-duplicate lookup"""
+        return await self.executor.run(fingerprint_image, image.file)
+
+    def get_analyze_fn(self, analysis_type: str):
+        """Return the analyzer coroutine for an analysis type"""
+        analyze_fns = {
+            'xray': self.analyze_xray,
+            'skin': self.analyze_skin_lesion,
+            'mri': self.analyze_mri
+        }
+        if analysis_type not in analyze_fns:
+            raise ValueError(f"Unsupported analysis type: {analysis_type}")
+        return analyze_fns[analysis_type]
+
+    async def analyze_files(self, analysis_type: str, files: List[UploadFile], max_concurrency: int = 4):
+        """Analyze files concurrently (bounded).
+
+        Yields (filename, results, model_version, error) as each file finishes.
+        Files still running are cancelled when the generator is closed early,
+        e.g. by a caller that stops at the first error.
+        """
+        self.get_analyze_fn(analysis_type)  # validates the type
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def analyze_one(file: UploadFile):
+            async with semaphore:
+                try:
+                    results, model_version = (await self._analyze_study(file, [analysis_type]))[analysis_type]
+                    return file.filename, results, model_version, None
+                except Exception as e:
+                    print(f"Error analyzing {file.filename}: {str(e)}")
+                    return file.filename, None, None, e
+
+        tasks = [asyncio.ensure_future(analyze_one(file)) for file in files]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def combine_results(self, results_by_file: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+        """Merge per-file results into one study-level result (highest probability per condition)"""
+        combined = {}
+        for results in results_by_file.values():
+            for condition, probability in results.items():
+                if probability > combined.get(condition, 0.0):
+                    combined[condition] = probability
+        return combined
+
     async def get_risk_assessment(self, analysis_results: Dict[str, float]) -> Dict[str, any]:
         """Generate risk assessment based on analysis results"""
-        high_risk_threshold = 0.7
-        medium_risk_threshold = 0.4
+        with RISK_ASSESSMENT_SECONDS.time('single'):
+            high_risk_threshold = HIGH_RISK_THRESHOLD
+            medium_risk_threshold = MEDIUM_RISK_THRESHOLD
 
-        risks = {
-            "high": [],
-            "medium": [],
-            "low": []
-        }
+            risks = {
+                "high": [],
+                "medium": [],
+                "low": []
+            }
 
-        for condition, probability in analysis_results.items():
-            if probability >= high_risk_threshold:
-                risks["high"].append({
-                    "condition": condition,
-                    "probability": probability,
-                    "recommendation": self._get_recommendation(condition)
-                })
-            elif probability >= medium_risk_threshold:
-                risks["medium"].append({
-                    "condition": condition,
+            for condition, probability in analysis_results.items():
+                if probability >= high_risk_threshold:
+                    risks["high"].append({
+                        "condition": condition,
+                        "probability": probability,
+                        "recommendation": self._get_recommendation(condition)
+                    })
+                elif probability >= medium_risk_threshold:
+                    risks["medium"].append({
+                        "condition": condition,
+                        "probability": probability,
+                        "recommendation": self._get_recommendation(condition)
+                    })
+                else:
+                    risks["low"].append({
+                        "condition": condition,
+                        "probability": probability
+                    })
+
+            return {
+                "risk_levels": risks,
+                "summary": self._generate_risk_summary(risks),
+                "immediate_actions": self._get_immediate_actions(risks)
+            }
+
+    def results_matrix(self, results_by_file: Dict[str, Dict[str, float]]) -> Tuple[np.ndarray, List[str], List[str]]:
+        """Per-file results as an images x conditions probability matrix.
+
+        Returns ``(probabilities, conditions, filenames)``; conditions a file
+        did not report count as 0.
+        """
+        filenames = list(results_by_file)
+        conditions = list(dict.fromkeys(
+            condition for results in results_by_file.values() for condition in results
+        ))
+        columns = {condition: column for column, condition in enumerate(conditions)}
+        probabilities = np.zeros((len(filenames), len(conditions)))
+        for row, results in enumerate(results_by_file.values()):
+            if results:
+                probabilities[row, [columns[condition] for condition in results]] = list(results.values())
+        return probabilities, conditions, filenames
+
+    async def get_study_risk_assessment(self, results_by_file: Dict[str, Dict[str, float]]) -> Dict[str, any]:
+        """Risk assessment of a whole study from per-file results, with a summary per file"""
+        probabilities, conditions, filenames = self.results_matrix(results_by_file)
+        return await self.get_batch_risk_assessment(probabilities, conditions, filenames)
+
+    async def get_batch_risk_assessment(
+        self,
+        probabilities: np.ndarray,
+        conditions: List[str],
+        image_ids: List[str] = None
+    ) -> Dict[str, any]:
+        """Risk assessment for a batch of images in one pass.
+
+        ``probabilities`` is an images x conditions matrix, e.g. the stacked
+        outputs of a batched forward pass. Thresholds are applied to the whole
+        matrix at once; only conditions at medium risk or above are turned
+        into entries. The study-level assessment (highest probability per
+        condition) has the same shape as ``get_risk_assessment``; ``images``
+        holds per-image counts, flagged conditions and summary.
+        """
+        with RISK_ASSESSMENT_SECONDS.time('batch'):
+            probabilities = np.asarray(probabilities, dtype=np.float64)
+            if image_ids is None:
+                image_ids = [str(index) for index in range(len(probabilities))]
+            if not conditions:
+                # Nothing reported above the output threshold, e.g. a clean study
+                probabilities = np.zeros((len(image_ids), 0))
+            probabilities = probabilities.reshape(len(image_ids), len(conditions))
+
+            # 0 = low, 1 = medium, 2 = high, for every image and condition at once
+            thresholds = np.array([MEDIUM_RISK_THRESHOLD, HIGH_RISK_THRESHOLD])
+            levels = np.digitize(probabilities, thresholds)
+            counts = np.stack([(levels == level).sum(axis=1) for level in range(len(RISK_LEVELS))], axis=1)
+            max_levels = levels.max(axis=1, initial=0)
+
+            # Only flagged cells become Python objects; gathered as lists to avoid numpy scalar access
+            recommendations = [self._get_recommendation(condition) for condition in conditions]
+            flagged = [{"high": [], "medium": []} for _ in image_ids]
+            rows, columns = np.nonzero(levels)
+            for row, column, level, probability in zip(
+                rows.tolist(), columns.tolist(), levels[rows, columns].tolist(), probabilities[rows, columns].tolist()
+            ):
+                flagged[row][RISK_LEVELS[level]].append({
+                    "condition": conditions[column],
                     "probability": probability,
-                    "recommendation": self._get_recommendation(condition)
-                })
-            else:
-                risks["low"].append({
-                    "condition": condition,
-                    "probability": probability
+                    "recommendation": recommendations[column]
                 })
 
-        return {
-            "risk_levels": risks,
-            "summary": self._generate_risk_summary(risks),
-            "immediate_actions": self._get_immediate_actions(risks)
-        }
+            images = {}
+            for row, (image_id, (low_count, medium_count, high_count), max_level) in enumerate(
+                zip(image_ids, counts.tolist(), max_levels.tolist())
+            ):
+                images[image_id] = {
+                    "risk_level": RISK_LEVELS[max_level],
+                    "counts": {"high": high_count, "medium": medium_count, "low": low_count},
+                    "risk_levels": flagged[row],
+                    "summary": self._summarize_risk_counts(high_count, medium_count)
+                }
+
+            # Study level: highest probability of each condition across images
+            study = probabilities.max(axis=0, initial=0.0)
+            study_levels = np.digitize(study, thresholds)
+            risks = {"high": [], "medium": [], "low": []}
+            for condition, level_index, probability, recommendation in zip(
+                conditions, study_levels.tolist(), study.tolist(), recommendations
+            ):
+                level = RISK_LEVELS[level_index]
+                entry = {"condition": condition, "probability": probability}
+                if level != 'low':
+                    entry["recommendation"] = recommendation
+                risks[level].append(entry)
+
+            return {
+                "risk_levels": risks,
+                "summary": self._generate_risk_summary(risks),
+                "immediate_actions": self._get_immediate_actions(risks),
+                "image_counts": {
+                    level: int(np.count_nonzero(max_levels == index)) for index, level in enumerate(RISK_LEVELS)
+                },
+                "images": images
+            }
 
     def _get_recommendation(self, condition: str) -> str:
         """Get medical recommendations for a specific condition"""
@@ -175,9 +547,9 @@ class MedicalImageAnalyzer:
 
     def _generate_risk_summary(self, risks: Dict) -> str:
         """Generate a summary of the risk assessment"""
-        high_risk_count = len(risks["high"])
-        medium_risk_count = len(risks["medium"])
-        
+        return self._summarize_risk_counts(len(risks["high"]), len(risks["medium"]))
+
+    def _summarize_risk_counts(self, high_risk_count: int, medium_risk_count: int) -> str:
         if high_risk_count > 0:
             return f"Urgent medical attention recommended. {high_risk_count} high-risk conditions detected."
         elif medium_risk_count > 0:
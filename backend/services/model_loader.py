@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Load states reported by the readiness endpoint
+NOT_LOADED = "not_loaded"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class LazyModel:
+    """A model that is loaded on first use or by an explicit background warm-up.
+
+    Concurrent callers share a single load; later callers block until it
+    finishes. A failed load is reported and retried on the next ``get()``.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self.loader = loader
+        self.state = NOT_LOADED
+        self.error = None
+        self.load_seconds = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        """Return the loaded model, loading it in the calling thread if needed"""
+        if self.state == READY:
+            return self._model
+
+        with self._lock:
+            if self.state == READY:
+                return self._model
+
+            self.state = LOADING
+            started = time.perf_counter()
+            try:
+                self._model = self.loader()
+            except Exception as e:
+                self.state = FAILED
+                self.error = str(e)
+                print(f"Error loading {self.name} model: {str(e)}")
+                raise
+
+            self.load_seconds = time.perf_counter() - started
+            self.error = None
+            self.state = READY
+            return self._model
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "load_seconds": self.load_seconds,
+            "error": self.error
+        }
+
+
+class ModelWarmer:
+    """Load several ``LazyModel``s independently and in parallel"""
+
+    def __init__(self, models: Dict[str, LazyModel]):
+        self.models = models
+        self._pool = None
+        self._futures = {}
+
+    def start(self) -> Dict[str, Future]:
+        """Kick off background loading of every model not loaded yet"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=max(1, len(self.models)),
+                thread_name_prefix="aimed-model-loader"
+            )
+        for name, model in self.models.items():
+            future = self._futures.get(name)
+            if model.state != READY and (future is None or future.done()):
+                self._futures[name] = self._pool.submit(self._load_quietly, model)
+        return self._futures
+
+    def status(self) -> Dict[str, Any]:
+        models = {name: model.status() for name, model in self.models.items()}
+        return {
+            "ready": all(model.state == READY for model in self.models.values()),
+            "models": models
+        }
+
+    @staticmethod
+    def _load_quietly(model: LazyModel) -> Optional[Any]:
+        # Failures are recorded on the model and surfaced through status()
+        try:
+            return model.get()
+        except Exception:
+            return None
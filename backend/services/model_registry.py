@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from .inference_cache import weights_fingerprint
+from .model_loader import LazyModel
+
+# Registry layout, overridable per deployment:
+#   <root>/<model>/<version>/<weights file>   versioned weights
+#   <root>/<model>/<version>/labels.json      optional per-version labels
+#   <root>/<model>/ACTIVE                     optional pinned version
+MODEL_ROOT = os.getenv("AIMED_MODEL_ROOT", "models")
+WEIGHT_FILES = {'xray': 'model.h5', 'skin': 'model.pth', 'mri': 'model.h5'}
+
+# Flat files used before versioned directories existed
+LEGACY_VERSION = "legacy"
+LEGACY_WEIGHTS = {'xray': 'xray_model.h5', 'skin': 'skin_model.pth', 'mri': 'mri_model.h5'}
+LEGACY_LABELS = 'disease_labels.json'
+
+
+def _read_labels(path: str, name: str) -> List[str]:
+    # Per-version files hold a list; the shared legacy file maps model -> list
+    try:
+        with open(path, 'r') as f:
+            labels = json.load(f)
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"Cannot read {name} labels from {path}: {str(e)}")
+    labels = labels.get(name) if isinstance(labels, dict) else labels
+    if not isinstance(labels, list) or not labels:
+        raise RuntimeError(f"No {name} labels in {path}")
+    return labels
+
+
+class ModelVersion(LazyModel):
+    """One version of one model: its weights, labels and cache version tag.
+
+    Labels are read with the weights, on first use or warm-up, so a missing
+    or unreadable labels file fails that load (and shows in the readiness
+    status) instead of failing the import of the API.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        version: str,
+        weights_path: str,
+        labels_path: str,
+        loader: Callable[['ModelVersion'], Any],
+        version_suffix: str = ""
+    ):
+        super().__init__(name, lambda: self._load(loader))
+        self.version = version
+        self.weights_path = weights_path
+        self.labels_path = labels_path
+        self._labels = None
+        # Ties cached results and optimized exports to these exact weights
+        self.fingerprint = weights_fingerprint(weights_path, labels_path)
+        self.cache_version = f"{version}-{self.fingerprint}{version_suffix}"
+
+    @property
+    def labels(self) -> List[str]:
+        if self._labels is None:
+            self._labels = _read_labels(self.labels_path, self.name)
+        return self._labels
+
+    def _load(self, loader: Callable[['ModelVersion'], Any]) -> Any:
+        # A model without labels can't map its outputs, so missing labels fail the load
+        self._labels = _read_labels(self.labels_path, self.name)
+        return loader(self)
+
+    def status(self) -> Dict[str, Any]:
+        status = super().status()
+        status["version"] = self.version
+        return status
+
+
+class ModelRegistry:
+    """Discovers versioned weights and hot-swaps the active version of each model.
+
+    ``active`` maps model name to its serving ``ModelVersion``. A new version
+    is loaded and warmed in the background and only then replaces the old
+    one with a single dict assignment, so requests never see a half-loaded
+    model and never wait on a cold one.
+    """
+
+    def __init__(
+        self,
+        names: List[str],
+        loader: Callable[[ModelVersion], Any],
+        warm: Callable[[ModelVersion], None],
+        root: str = MODEL_ROOT,
+        version_suffix: str = ""
+    ):
+        self.names = names
+        self.loader = loader
+        self.warm = warm
+        self.root = root
+        self.version_suffix = version_suffix
+        self.active = {name: self._make_version(name, self.resolve_version(name)) for name in names}
+        self.staging = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, len(names)), thread_name_prefix="aimed-model-swap")
+
+    def discover(self, name: str) -> List[str]:
+        """Available versions of a model, oldest first"""
+        model_dir = os.path.join(self.root, name)
+        versions = []
+        if os.path.isdir(model_dir):
+            versions = sorted(
+                entry for entry in os.listdir(model_dir)
+                if os.path.isfile(os.path.join(model_dir, entry, WEIGHT_FILES[name]))
+            )
+        if not versions and os.path.exists(os.path.join(self.root, LEGACY_WEIGHTS[name])):
+            versions = [LEGACY_VERSION]
+        return versions
+
+    def resolve_version(self, name: str) -> str:
+        """Pinned version from the ACTIVE file, else the newest discovered one"""
+        versions = self.discover(name)
+        pin_path = os.path.join(self.root, name, "ACTIVE")
+        if os.path.exists(pin_path):
+            with open(pin_path, 'r') as f:
+                pinned = f.read().strip()
+            if pinned in versions:
+                return pinned
+            if pinned:
+                print(f"Error resolving {name} model: pinned version {pinned!r} is not available")
+        return versions[-1] if versions else LEGACY_VERSION
+
+    def get(self, name: str) -> ModelVersion:
+        return self.active[name]
+
+    def activate(self, name: str, version: Optional[str] = None) -> Future:
+        """Load, warm and then switch to ``version`` (default: resolved version) in the background"""
+        version = version or self.resolve_version(name)
+        # Only discovered versions, so the name never reaches a path unchecked
+        if version not in self.discover(name):
+            raise ValueError(f"Unknown {name} model version: {version}")
+        with self._lock:
+            staged = self.staging.get(name)
+            if staged is not None and staged[0].version == version and not staged[1].done():
+                return staged[1]
+            candidate = self._make_version(name, version)
+            future = self._pool.submit(self._load_and_swap, candidate)
+            self.staging[name] = (candidate, future)
+            return future
+
+    def refresh(self) -> Dict[str, Future]:
+        """Start a swap for every model whose resolved version differs from the active one"""
+        swaps = {}
+        for name in self.names:
+            version = self.resolve_version(name)
+            if version != self.active[name].version:
+                swaps[name] = self.activate(name, version)
+        return swaps
+
+    def status(self) -> Dict[str, Any]:
+        status = {}
+        for name in self.names:
+            staged = self.staging.get(name)
+            status[name] = {
+                "active": self.active[name].status(),
+                "staging": staged[0].status() if staged and not staged[1].done() else None,
+                "available": self.discover(name)
+            }
+        return status
+
+    def _make_version(self, name: str, version: str) -> ModelVersion:
+        if version == LEGACY_VERSION:
+            weights_path = os.path.join(self.root, LEGACY_WEIGHTS[name])
+            labels_path = os.path.join(self.root, LEGACY_LABELS)
+        else:
+            version_dir = os.path.join(self.root, name, version)
+            weights_path = os.path.join(version_dir, WEIGHT_FILES[name])
+            labels_path = os.path.join(version_dir, "labels.json")
+            if not os.path.exists(labels_path):
+                labels_path = os.path.join(self.root, LEGACY_LABELS)
+        return ModelVersion(name, version, weights_path, labels_path, self.loader, self.version_suffix)
+
+    def _load_and_swap(self, candidate: ModelVersion) -> ModelVersion:
+        try:
+            candidate.get()
+            self.warm(candidate)
+        except Exception as e:
+            print(f"Error activating {candidate.name} model {candidate.version}: {str(e)}")
+            raise
+
+        # Atomic switch; in-flight batches keep their reference to the old version
+        previous = self.active[candidate.name]
+        self.active[candidate.name] = candidate
+        print(f"Activated {candidate.name} model {candidate.version} (was {previous.version})")
+        return candidate
@@ -0,0 +1,144 @@
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+
+# Optimized backend configuration, overridable per deployment
+INFERENCE_BACKEND = os.getenv("AIMED_INFERENCE_BACKEND", "eager")  # 'eager' or 'optimized'
+QUANTIZATION = os.getenv("AIMED_QUANTIZATION", "int8")  # 'int8', 'fp16' or 'none'
+OPTIMIZED_MODEL_DIR = os.getenv("AIMED_OPTIMIZED_MODEL_DIR", "models/optimized")
+
+# Parity tolerances against the original fp32 model
+PARITY_MAX_ABS_DIFF = float(os.getenv("AIMED_PARITY_MAX_ABS_DIFF", "0.05"))
+PARITY_MIN_TOP1_AGREEMENT = float(os.getenv("AIMED_PARITY_MIN_TOP1", "0.98"))
+PARITY_SAMPLES = int(os.getenv("AIMED_PARITY_SAMPLES", "16"))  # synthetic images checked before serving an export
+
+
+def backend_tag(backend: str = INFERENCE_BACKEND, quantization: str = QUANTIZATION) -> str:
+    """Suffix for model versions so cached results never mix backends"""
+    if backend != "optimized":
+        return "eager"
+    return f"optimized-{quantization}"
+
+
+class TFLiteModel:
+    """Keras-compatible ``predict`` on top of a TensorFlow Lite interpreter"""
+
+    def __init__(self, model_path: str):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        self._interpreter = tf.lite.Interpreter(model_path=model_path)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        self._lock = threading.Lock()  # interpreters are not thread-safe
+
+    def predict(self, batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input['index'], batch.astype(self._input['dtype'], copy=False))
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output['index']).copy()
+
+
+def export_keras_model(
+    model,
+    output_path: str,
+    quantization: str = QUANTIZATION,
+    representative_samples: Optional[np.ndarray] = None
+) -> str:
+    """Convert a Keras model to a graph-optimized, quantized TFLite flatbuffer"""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization in ("int8", "fp16"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8" and representative_samples is not None:
+        # Calibrate activation ranges too; without samples only weights are int8
+        converter.representative_dataset = lambda: ([sample[None, ...]] for sample in representative_samples)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+
+def export_torch_model(model, output_path: str, quantization: str = QUANTIZATION) -> str:
+    """Trace, freeze and optimize a Torch model for CPU inference.
+
+    ``int8`` applies dynamic quantization to the linear layers. Convolutions
+    stay fp32, and ``fp16`` is treated as ``none`` because CPU kernels do
+    not run half precision faster.
+    """
+    import torch
+
+    model = model.eval()
+    if quantization == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.zeros(1, 3, 224, 224))
+        optimized = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    torch.jit.save(optimized, output_path)
+    return output_path
+
+
+def load_optimized_keras(name: str, model, version: str, quantization: str = QUANTIZATION) -> TFLiteModel:
+    """Load the TFLite export for ``model``, exporting it first if missing.
+
+    ``version`` identifies the source weights, so new weights get a new export.
+    """
+    path = os.path.join(OPTIMIZED_MODEL_DIR, f"{name}-{version}-{quantization}.tflite")
+    if not os.path.exists(path):
+        export_keras_model(model, path, quantization)
+    return TFLiteModel(path)
+
+
+def load_optimized_torch(name: str, model, version: str, quantization: str = QUANTIZATION):
+    """Load the TorchScript export for ``model``, exporting it first if missing"""
+    import torch
+
+    path = os.path.join(OPTIMIZED_MODEL_DIR, f"{name}-{version}-{quantization}.pt")
+    if not os.path.exists(path):
+        export_torch_model(model, path, quantization)
+    return torch.jit.load(path)
+
+
+def check_parity(
+    reference_predict: Callable[[np.ndarray], np.ndarray],
+    candidate_predict: Callable[[np.ndarray], np.ndarray],
+    samples: np.ndarray,
+    batch_size: int = 8,
+    max_abs_diff: float = PARITY_MAX_ABS_DIFF,
+    min_top1_agreement: float = PARITY_MIN_TOP1_AGREEMENT
+) -> Dict[str, Any]:
+    """Compare an optimized model against the original on a sample batch"""
+    reference = []
+    candidate = []
+    for start in range(0, len(samples), batch_size):
+        batch = samples[start:start + batch_size]
+        reference.append(np.asarray(reference_predict(batch), dtype=np.float32))
+        candidate.append(np.asarray(candidate_predict(batch), dtype=np.float32))
+    reference = np.concatenate(reference)
+    candidate = np.concatenate(candidate)
+
+    abs_diff = np.abs(reference - candidate)
+    top1_agreement = float(np.mean(reference.argmax(axis=1) == candidate.argmax(axis=1)))
+    report = {
+        "samples": int(len(samples)),
+        "max_abs_diff": float(abs_diff.max()),
+        "mean_abs_diff": float(abs_diff.mean()),
+        "top1_agreement": top1_agreement
+    }
+    report["passed"] = (
+        report["max_abs_diff"] <= max_abs_diff and top1_agreement >= min_top1_agreement
+    )
+    return report
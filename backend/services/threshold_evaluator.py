@@ -0,0 +1,135 @@
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+import numpy as np
+from .threshold_resolver import (
+    ThresholdResolver, threshold_resolver, THRESHOLD_FIELDS,
+    SYSTOLIC_MAX, SYSTOLIC_MIN, DIASTOLIC_MAX, DIASTOLIC_MIN, HEART_RATE_MAX, HEART_RATE_MIN
+)
+
+# Exceeded-threshold bits, in the order alert_details lists them
+EXCEEDED_FLAGS = (
+    "high_systolic", "low_systolic", "high_diastolic", "low_diastolic", "high_heart_rate", "low_heart_rate"
+)
+HIGH_SYSTOLIC, LOW_SYSTOLIC, HIGH_DIASTOLIC, LOW_DIASTOLIC, HIGH_HEART_RATE, LOW_HEART_RATE = (
+    1 << bit for bit in range(len(EXCEEDED_FLAGS))
+)
+BP_FLAGS = HIGH_SYSTOLIC | LOW_SYSTOLIC | HIGH_DIASTOLIC | LOW_DIASTOLIC  # what makes a reading abnormal
+
+# Severity classes; "normal" marks readings within the BP thresholds
+SEVERITIES = ("normal", "moderate", "high", "critical")
+NORMAL, MODERATE, HIGH, CRITICAL = range(len(SEVERITIES))
+HIGH_DEVIATION = 0.1  # fraction beyond a threshold
+CRITICAL_DEVIATION = 0.2
+
+
+class Evaluation(NamedTuple):
+    flags: np.ndarray  # uint8 bitmask of EXCEEDED_FLAGS per reading
+    severity: np.ndarray  # int8 index into SEVERITIES per reading
+    alert_rows: np.ndarray  # indices of readings outside their BP thresholds
+
+    def exceeded(self, row: int) -> List[str]:
+        return flag_names(int(self.flags[row]))
+
+    def severity_name(self, row: int) -> str:
+        return SEVERITIES[int(self.severity[row])]
+
+
+def flag_names(flags: int) -> List[str]:
+    return [name for bit, name in enumerate(EXCEEDED_FLAGS) if flags & (1 << bit)]
+
+
+def _deviation(values: np.ndarray, high: np.ndarray, low: np.ndarray) -> np.ndarray:
+    # Relative distance to the farther threshold, as the per-reading check has always measured it
+    outside = (values > high) | (values < low)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        deviation = np.maximum(np.abs(values - high) / high, np.abs(values - low) / low)
+    return np.where(outside, deviation, 0.0)
+
+
+def evaluate_limits(systolic, diastolic, heart_rate, limits: np.ndarray) -> Evaluation:
+    """Exceeded flags and severity for readings against per-reading threshold rows.
+
+    ``limits`` has one row per reading, columns in ``THRESHOLD_FIELDS``
+    order. A missing heart rate (NaN) never sets the heart-rate flags.
+    """
+    systolic = np.asarray(systolic, dtype=np.float64)
+    diastolic = np.asarray(diastolic, dtype=np.float64)
+    heart_rate = np.asarray(heart_rate, dtype=np.float64)
+
+    flags = np.zeros(len(systolic), dtype=np.uint8)
+    for flag, values, column, above in (
+        (HIGH_SYSTOLIC, systolic, SYSTOLIC_MAX, True),
+        (LOW_SYSTOLIC, systolic, SYSTOLIC_MIN, False),
+        (HIGH_DIASTOLIC, diastolic, DIASTOLIC_MAX, True),
+        (LOW_DIASTOLIC, diastolic, DIASTOLIC_MIN, False),
+        (HIGH_HEART_RATE, heart_rate, HEART_RATE_MAX, True),
+        (LOW_HEART_RATE, heart_rate, HEART_RATE_MIN, False),
+    ):
+        exceeded = values > limits[:, column] if above else values < limits[:, column]
+        flags |= np.where(exceeded, flag, 0).astype(np.uint8)
+
+    deviation = np.maximum(
+        _deviation(systolic, limits[:, SYSTOLIC_MAX], limits[:, SYSTOLIC_MIN]),
+        _deviation(diastolic, limits[:, DIASTOLIC_MAX], limits[:, DIASTOLIC_MIN])
+    )
+    abnormal = (flags & BP_FLAGS) != 0
+    severity = np.select(
+        [~abnormal, deviation > CRITICAL_DEVIATION, deviation > HIGH_DEVIATION],
+        [NORMAL, CRITICAL, HIGH],
+        default=MODERATE
+    ).astype(np.int8)
+    return Evaluation(flags, severity, np.nonzero(abnormal)[0])
+
+
+def limits_row(thresholds: Dict[str, float]) -> np.ndarray:
+    """A threshold dict as a one-row limits matrix"""
+    return np.array([[thresholds[field] for field in THRESHOLD_FIELDS]], dtype=np.float64)
+
+
+def reading_context(timestamp: datetime, activity: Optional[str] = None, location: Optional[str] = None,
+                    ambient_temperature: Optional[float] = None) -> Dict[str, Any]:
+    """Contextual information stored with an alert"""
+    return {
+        "time_of_day": timestamp.strftime("%H:%M"),
+        "activity": activity or "unknown",
+        "location": location or "unknown",
+        "ambient_temp": ambient_temperature
+    }
+
+
+class ThresholdEvaluator:
+    """Evaluates batches of readings from many patients against their thresholds in one pass"""
+
+    def __init__(self, resolver: ThresholdResolver = threshold_resolver):
+        self.resolver = resolver
+
+    def evaluate(self, patient_ids: Sequence[str], patient_index: np.ndarray,
+                 systolic, diastolic, heart_rate) -> Evaluation:
+        """``patient_index[i]`` is reading i's position in ``patient_ids``; each patient's row is fetched once"""
+        limits = self.resolver.rows(patient_ids)[np.asarray(patient_index, dtype=np.int64)]
+        return evaluate_limits(systolic, diastolic, heart_rate, limits)
+
+    def evaluate_columns(self, patient_id: str, columns: Dict[str, list]) -> Evaluation:
+        """One patient's bulk-ingest columns (see ``vitals_ingest``)"""
+        size = len(columns["systolic"])
+        return self.evaluate([patient_id], np.zeros(size, dtype=np.int64),
+                             columns["systolic"], columns["diastolic"], columns["heart_rate"])
+
+    @staticmethod
+    def alert_details(evaluation: Evaluation, columns: Dict[str, list],
+                      rows: Optional[Sequence[int]] = None) -> Dict[int, Dict[str, Any]]:
+        """``VitalsReading.alert_details`` for ``rows``, by default just the readings that need an alert record"""
+        details = {}
+        for row in (evaluation.alert_rows.tolist() if rows is None else rows):
+            details[row] = {
+                "severity": evaluation.severity_name(row),
+                "threshold_exceeded": evaluation.exceeded(row),
+                "context": reading_context(
+                    columns["timestamp"][row], columns["activity_type"][row],
+                    columns["location"][row], columns["ambient_temperature"][row]
+                )
+            }
+        return details
+
+
+threshold_evaluator = ThresholdEvaluator()
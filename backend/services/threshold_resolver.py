@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+import numpy as np
+from sqlalchemy import String, cast, event
+from ..database.db import SessionLocal
+from ..models.patient_vitals import PatientVitalsThreshold, VitalsReading, DEFAULT_THRESHOLDS
+
+# Threshold cache configuration, overridable per deployment
+THRESHOLD_TTL_SECONDS = float(os.getenv("AIMED_THRESHOLD_TTL_SECONDS", "300"))
+ACTIVE_PATIENT_DAYS = int(os.getenv("AIMED_THRESHOLD_ACTIVE_DAYS", "7"))
+
+DEFAULT_CONDITION = "normal"
+
+# Column order of the threshold table
+THRESHOLD_FIELDS = (
+    "systolic_max", "systolic_min", "diastolic_max", "diastolic_min", "heart_rate_max", "heart_rate_min"
+)
+SYSTOLIC_MAX, SYSTOLIC_MIN, DIASTOLIC_MAX, DIASTOLIC_MIN, HEART_RATE_MAX, HEART_RATE_MIN = range(len(THRESHOLD_FIELDS))
+
+
+class AlertSettings(NamedTuple):
+    """Non-numeric part of a patient's effective thresholds"""
+    condition: str
+    threshold_id: Optional[str]  # None when the condition defaults apply
+    alert_frequency: Optional[int]  # minutes between alerts
+    alert_methods: List[str]
+    alert_recipients: List[str]
+
+
+def _condition_limits(condition: str) -> np.ndarray:
+    defaults = DEFAULT_THRESHOLDS.get(condition, DEFAULT_THRESHOLDS[DEFAULT_CONDITION])
+    return np.array([defaults[field] for field in THRESHOLD_FIELDS], dtype=np.float64)
+
+
+def _default_settings(condition: str = DEFAULT_CONDITION) -> AlertSettings:
+    return AlertSettings(condition, None, None, [], [])
+
+
+class ThresholdResolver:
+    """Effective vitals thresholds per patient, held in a compact array-backed table.
+
+    Each cached patient owns one row of a float matrix (columns in
+    ``THRESHOLD_FIELDS`` order) plus its alert settings, so the hot-path
+    abnormality check is an array lookup and comparison, and many patients
+    can be gathered at once with ``rows()``. A patient's row comes from
+    their ``PatientVitalsThreshold`` if any (missing fields filled from
+    their condition), otherwise from ``DEFAULT_THRESHOLDS`` for the
+    condition on their patient profile.
+
+    Rows are invalidated when a threshold row changes in this process (ORM
+    events), and expire after ``ttl`` seconds to pick up changes made
+    elsewhere, including patient profile edits.
+    """
+
+    def __init__(self, session_factory=SessionLocal, ttl: float = THRESHOLD_TTL_SECONDS, capacity: int = 256):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._index = {}  # patient_id -> row; rows are reused on reload, never freed
+        self._limits = np.zeros((capacity, len(THRESHOLD_FIELDS)), dtype=np.float64)
+        self._expires_at = np.zeros(capacity, dtype=np.float64)
+        self._settings = [None] * capacity
+        self._lock = threading.Lock()
+
+    # Lookups
+
+    def limits(self, patient_id: str) -> np.ndarray:
+        """The patient's threshold row (a copy), columns in ``THRESHOLD_FIELDS`` order"""
+        return self.rows([patient_id])[0]
+
+    def rows(self, patient_ids: Sequence[str]) -> np.ndarray:
+        """Threshold rows for many patients at once, shape (len(patient_ids), fields)"""
+        indices = self._indices(patient_ids)
+        with self._lock:
+            return self._limits[indices]
+
+    def thresholds(self, patient_id: str) -> Dict[str, float]:
+        return dict(zip(THRESHOLD_FIELDS, self.limits(patient_id).tolist()))
+
+    def settings(self, patient_id: str) -> AlertSettings:
+        row = self._indices([patient_id])[0]
+        with self._lock:
+            return self._settings[row]
+
+    def bp_limits(self, patient_id: str) -> Dict[str, tuple]:
+        """(min, max) per BP vital, as taken by ``VitalsRollups.count_outside``"""
+        limits = self.limits(patient_id).tolist()
+        return {
+            "systolic": (limits[SYSTOLIC_MIN], limits[SYSTOLIC_MAX]),
+            "diastolic": (limits[DIASTOLIC_MIN], limits[DIASTOLIC_MAX]),
+        }
+
+    # Loading
+
+    def preload(self, patient_ids: Optional[Iterable[str]] = None):
+        """Load rows for the given patients, or for everyone with readings in the last few days"""
+        db = self.session_factory()
+        try:
+            if patient_ids is None:
+                since = datetime.utcnow() - timedelta(days=ACTIVE_PATIENT_DAYS)
+                patient_ids = [
+                    patient_id for (patient_id,) in db.query(VitalsReading.patient_id).filter(
+                        VitalsReading.timestamp >= since
+                    ).distinct()
+                ]
+            self._load(db, list(patient_ids))
+        except Exception as e:
+            print(f"Error preloading vitals thresholds: {str(e)}")
+        finally:
+            db.close()
+
+    def warm_up(self):
+        """Start ``preload`` in a background thread, so neither startup nor a first lookup waits on it"""
+        threading.Thread(target=self.preload, name="threshold-preload", daemon=True).start()
+
+    def invalidate(self, patient_id: Optional[str] = None):
+        """Expire a patient's row (or every row) so the next lookup reloads it"""
+        with self._lock:
+            if patient_id is None:
+                self._expires_at[:] = 0
+                return
+            row = self._index.get(str(patient_id))
+            if row is not None:
+                self._expires_at[row] = 0
+
+    def _indices(self, patient_ids: Sequence[str]) -> np.ndarray:
+        now = time.monotonic()
+        with self._lock:
+            missing = [
+                patient_id for patient_id in dict.fromkeys(patient_ids)
+                if patient_id not in self._index or self._expires_at[self._index[patient_id]] <= now
+            ]
+        if missing:
+            db = self.session_factory()
+            try:
+                self._load(db, missing)
+            except Exception as e:
+                print(f"Error loading vitals thresholds: {str(e)}")
+                # Serve the condition defaults for now and retry on the next lookup
+                unknown = [patient_id for patient_id in missing if patient_id not in self._index]
+                self._store([(patient_id, _condition_limits(DEFAULT_CONDITION), _default_settings())
+                             for patient_id in unknown], expires_at=0.0)
+            finally:
+                db.close()
+        with self._lock:
+            return np.array([self._index[patient_id] for patient_id in patient_ids], dtype=np.int64)
+
+    def _load(self, db, patient_ids: List[str]):
+        """Resolve rows for ``patient_ids`` with at most two queries in total"""
+        if not patient_ids:
+            return
+        thresholds = {}
+        for threshold in db.query(PatientVitalsThreshold).filter(
+            PatientVitalsThreshold.patient_id.in_(patient_ids)
+        ).order_by(PatientVitalsThreshold.updated_at):
+            thresholds[threshold.patient_id] = threshold  # the most recently updated wins
+        conditions = self._conditions(db, [patient_id for patient_id in patient_ids if patient_id not in thresholds])
+
+        resolved = []
+        for patient_id in patient_ids:
+            threshold = thresholds.get(patient_id)
+            condition = threshold.condition if threshold and threshold.condition else conditions.get(
+                patient_id, DEFAULT_CONDITION
+            )
+            limits = _condition_limits(condition)
+            if threshold is not None:
+                for column, field in enumerate(THRESHOLD_FIELDS):
+                    value = getattr(threshold, field)
+                    if value is not None:
+                        limits[column] = value
+            settings = AlertSettings(
+                condition=condition,
+                threshold_id=threshold.id,
+                alert_frequency=threshold.alert_frequency,
+                alert_methods=list(threshold.alert_methods or []),
+                alert_recipients=list(threshold.alert_recipients or []),
+            ) if threshold is not None else _default_settings(condition)
+            resolved.append((patient_id, limits, settings))
+        self._store(resolved, time.monotonic() + self.ttl)
+
+    def _store(self, resolved: List[tuple], expires_at: float):
+        with self._lock:
+            for patient_id, limits, settings in resolved:
+                row = self._index.get(patient_id)
+                if row is None:
+                    row = self._grow()
+                    self._index[patient_id] = row
+                self._limits[row] = limits
+                self._expires_at[row] = expires_at
+                self._settings[row] = settings
+
+    def _grow(self) -> int:
+        row = len(self._index)
+        if row == len(self._limits):
+            self._limits = np.concatenate([self._limits, np.zeros_like(self._limits)])
+            self._expires_at = np.concatenate([self._expires_at, np.zeros_like(self._expires_at)])
+            self._settings.extend([None] * len(self._settings))
+        return row
+
+    @staticmethod
+    def _conditions(db, patient_ids: List[str]) -> Dict[str, str]:
+        """Condition from each patient profile: the first listed one with default thresholds"""
+        if not patient_ids:
+            return {}
+        try:
+            # Imported here so the vitals services don't depend on the profile models
+            from ..models.patient import Patient
+            rows = db.query(Patient.user_id, Patient.medical_conditions).filter(
+                cast(Patient.user_id, String).in_(patient_ids)
+            ).all()
+        except Exception as e:
+            print(f"Error reading patient conditions: {str(e)}")
+            return {}
+        conditions = {}
+        for user_id, medical_conditions in rows:
+            for condition in (medical_conditions or "").split(","):
+                condition = condition.strip().lower()
+                if condition in DEFAULT_THRESHOLDS:
+                    conditions[str(user_id)] = condition
+                    break
+        return conditions
+
+
+threshold_resolver = ThresholdResolver()
+
+
+@event.listens_for(PatientVitalsThreshold, "after_insert")
+@event.listens_for(PatientVitalsThreshold, "after_update")
+@event.listens_for(PatientVitalsThreshold, "after_delete")
+def _invalidate_threshold(mapper, connection, target):
+    threshold_resolver.invalidate(target.patient_id)
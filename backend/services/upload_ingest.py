@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Optional
+from .inference_cache import InferenceResultCache
+
+# Upload ingestion configuration, overridable per deployment
+CHUNK_SIZE = int(os.getenv("AIMED_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+SPOOL_MEMORY_BYTES = int(os.getenv("AIMED_UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+SETTINGS_TTL_SECONDS = float(os.getenv("AIMED_UPLOAD_SETTINGS_TTL", "30"))
+DEFAULT_MAX_UPLOAD_MB = 10  # SystemSettings.max_upload_size default
+
+
+class UploadTooLarge(Exception):
+    """An upload exceeded ``SystemSettings.max_upload_size``"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds the maximum size of {max_bytes // (1024 * 1024)} MB")
+        self.max_bytes = max_bytes
+
+
+class UploadSizeLimit:
+    """``SystemSettings.max_upload_size`` in bytes, re-read at most every ``ttl`` seconds.
+
+    Without a ``session_factory`` the application database is used, opened
+    on the first read so the analyzer and offline scripts don't import it.
+    """
+
+    def __init__(self, session_factory=None, ttl: float = SETTINGS_TTL_SECONDS):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._max_bytes = DEFAULT_MAX_UPLOAD_MB * 1024 * 1024
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def max_bytes(self) -> int:
+        with self._lock:
+            if time.monotonic() >= self._expires_at:
+                self._max_bytes = self._read_setting()
+                self._expires_at = time.monotonic() + self.ttl
+            return self._max_bytes
+
+    async def max_bytes_async(self) -> int:
+        """``max_bytes`` for the event loop: the settings read, when due, runs in a thread"""
+        if time.monotonic() < self._expires_at:
+            return self._max_bytes
+        return await asyncio.to_thread(self.max_bytes)
+
+    def _read_setting(self) -> int:
+        try:
+            # Imported here so the analyzer and offline scripts don't pull in the database or the API models
+            if self.session_factory is None:
+                from ..database.db import SessionLocal
+                self.session_factory = SessionLocal
+            db = self.session_factory()
+        except Exception as e:
+            print(f"Error reading upload size limit: {str(e)}")
+            return self._max_bytes
+        try:
+            from ..models.settings import SystemSettings
+            settings = db.query(SystemSettings).first()
+            max_upload_mb = settings.max_upload_size if settings and settings.max_upload_size else DEFAULT_MAX_UPLOAD_MB
+        except Exception as e:
+            print(f"Error reading upload size limit: {str(e)}")
+            return self._max_bytes
+        finally:
+            db.close()
+        return max_upload_mb * 1024 * 1024
+
+
+upload_size_limit = UploadSizeLimit()
+
+
+class SpooledUpload:
+    """A size-checked upload behind a seekable binary file, plus its content hash"""
+
+    def __init__(self, filename: str, file: BinaryIO, size: int, content_hash: str):
+        self.filename = filename
+        self.file = file
+        self.size = size
+        self.content_hash = content_hash
+
+
+def _is_file_backed(file) -> bool:
+    # Starlette spools multipart files to disk past 1 MB; real files are already on disk
+    return isinstance(file, tempfile.SpooledTemporaryFile) or (hasattr(file, 'name') and hasattr(file, 'fileno'))
+
+
+def spool_upload(file: BinaryIO, filename: str, max_bytes: Optional[int] = None,
+                 chunk_size: int = CHUNK_SIZE) -> SpooledUpload:
+    """Hash and size-check an upload chunk by chunk, never holding it in memory whole.
+
+    File-backed sources are read in place; anything else (e.g. a socket
+    stream) is copied into a spooled temp file first. Raises
+    ``UploadTooLarge`` as soon as ``max_bytes`` is exceeded. Blocking; run
+    it off the event loop.
+    """
+    max_bytes = upload_size_limit.max_bytes() if max_bytes is None else max_bytes
+    hasher = InferenceResultCache.content_hasher()
+    size = 0
+
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    target = None if _is_file_backed(file) else tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    try:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            hasher.update(chunk)
+            if target is not None:
+                target.write(chunk)
+    except Exception:
+        if target is not None:
+            target.close()
+        raise
+
+    source = file if target is None else target
+    source.seek(0)
+    return SpooledUpload(filename, source, size, hasher.hexdigest())
+
+
+def copy_upload(file: BinaryIO, path: str, max_bytes: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """Stream an upload to ``path`` in chunks, enforcing the size limit; returns bytes written"""
+    max_bytes = upload_size_limit.max_bytes() if max_bytes is None else max_bytes
+    written = 0
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    try:
+        with open(path, 'wb') as out:
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                out.write(chunk)
+    except UploadTooLarge:
+        os.remove(path)
+        raise
+    return written
+
+
+class UploadSizeLimitMiddleware:
+    """Reject multipart request bodies over the upload limit while they stream in.
+
+    A declared ``Content-Length`` over the limit is refused before any body
+    is read; otherwise received bytes are counted and the request is cut off
+    with 413 as soon as the limit is crossed, before the form parser has
+    spooled the rest. The limit covers the whole request, so a multi-file
+    upload may use ``max_upload_size`` in total.
+    """
+
+    def __init__(self, app, size_limit: UploadSizeLimit = upload_size_limit):
+        self.app = app
+        self.size_limit = size_limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        max_bytes = await self.size_limit.max_bytes_async()
+        declared = self._header(scope, b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > max_bytes:
+            await self._reject(send, max_bytes)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Stop the body parser here; the rest of the body is never read
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if exceeded and not response_started:
+                return  # replaced by the 413 below
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except Exception:
+            if not exceeded or response_started:
+                raise
+        if exceeded and not response_started:
+            await self._reject(send, max_bytes)
+
+    @staticmethod
+    def _header(scope, name: bytes) -> Optional[str]:
+        for key, value in scope.get("headers", []):
+            if key.lower() == name:
+                return value.decode("latin-1")
+        return None
+
+    def _is_multipart(self, scope) -> bool:
+        content_type = self._header(scope, b"content-type") or ""
+        return content_type.startswith("multipart/form-data")
+
+    @staticmethod
+    async def _reject(send, max_bytes: int):
+        body = json.dumps({"detail": str(UploadTooLarge(max_bytes))}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
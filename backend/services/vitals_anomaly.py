@@ -0,0 +1,258 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional
+import numpy as np
+from sqlalchemy.orm import Session
+from .vitals_store import VitalsStore, vitals_store, to_epoch_ms
+
+# Anomaly detector configuration, overridable per deployment
+WINDOW_READINGS = int(os.getenv("AIMED_ANOMALY_WINDOW_READINGS", "120"))
+EWMA_ALPHA = float(os.getenv("AIMED_ANOMALY_EWMA_ALPHA", "0.05"))
+Z_THRESHOLD = float(os.getenv("AIMED_ANOMALY_Z_THRESHOLD", "3.0"))
+WARMUP_READINGS = int(os.getenv("AIMED_ANOMALY_WARMUP_READINGS", "30"))
+SEED_HOURS = int(os.getenv("AIMED_ANOMALY_SEED_HOURS", "48"))
+CACHED_PATIENTS = int(os.getenv("AIMED_ANOMALY_PATIENTS", "4096"))
+
+HOUR_MS = 60 * 60 * 1000
+MINUTE_MS = 60 * 1000
+ANOMALY_VITALS = ("systolic", "diastolic", "heart_rate")
+# Largest plausible change per minute; faster swings are flagged
+RATE_LIMITS = np.array([30.0, 20.0, 40.0])
+MIN_STD = 1.0  # floor for the baseline spread, so a flat baseline doesn't flag every wiggle
+
+# Anomaly bits: one per vital and kind, vital-major
+ANOMALY_KINDS = ("zscore", "ewma", "rate_of_change")
+ANOMALY_FLAGS = tuple(f"{vital}_{kind}" for vital in ANOMALY_VITALS for kind in ANOMALY_KINDS)
+
+
+class Anomalies(NamedTuple):
+    """Per-reading scores against the patient's own baseline; NaN where not yet defined"""
+    zscore: np.ndarray  # (n, vitals) against the rolling window of previous readings
+    ewma_zscore: np.ndarray  # (n, vitals) against the exponentially weighted mean/variance
+    rate: np.ndarray  # (n, vitals) change per minute (at least one) since the previous reading
+    flags: np.ndarray  # uint16 bitmask of ANOMALY_FLAGS per reading
+
+    def details(self, row: int) -> Optional[Dict[str, Any]]:
+        """Summary for ``alert_details``, or None when the reading is unremarkable"""
+        flags = int(self.flags[row])
+        if not flags:
+            return None
+        scores = {}
+        for i, vital in enumerate(ANOMALY_VITALS):
+            values = (self.zscore[row, i], self.ewma_zscore[row, i], self.rate[row, i])
+            scores[vital] = {
+                kind: round(float(value), 2) if not np.isnan(value) else None
+                for kind, value in zip(("zscore", "ewma_zscore", "rate_per_min"), values)
+            }
+        return {"flags": flag_names(flags), **scores}
+
+
+def flag_names(flags: int) -> List[str]:
+    return [name for bit, name in enumerate(ANOMALY_FLAGS) if flags & (1 << bit)]
+
+
+class _PatientBaseline:
+    """Rolling state of one patient: a ring of the last readings plus EWMA moments"""
+
+    def __init__(self, window: int):
+        vitals = len(ANOMALY_VITALS)
+        self.lock = threading.Lock()
+        self.ring = np.full((window, vitals), np.nan)
+        self.position = 0  # next slot to overwrite; the ring is oldest-first from here
+        self.count = np.zeros(vitals, dtype=np.int64)  # valid readings seen per vital
+        self.ewma_mean = np.zeros(vitals)
+        self.ewma_var = np.zeros(vitals)
+        self.last_value = np.full(vitals, np.nan)
+        self.last_ms = np.zeros(vitals, dtype=np.int64)
+        self.newest_ms = None  # timestamp of the newest reading folded in
+
+    def copy(self) -> '_PatientBaseline':
+        clone = _PatientBaseline(len(self.ring))
+        for name in ("ring", "count", "ewma_mean", "ewma_var", "last_value", "last_ms"):
+            getattr(clone, name)[:] = getattr(self, name)
+        clone.position, clone.newest_ms = self.position, self.newest_ms
+        return clone
+
+    def update(self, timestamps: np.ndarray, values: np.ndarray, alpha: float, z_threshold: float,
+               warmup: int) -> Anomalies:
+        """Score readings sorted by time and fold them in"""
+        size, vitals = values.shape
+        if not size:
+            empty = np.empty((0, vitals))
+            return Anomalies(empty, empty, empty, np.zeros(0, dtype=np.uint16))
+        window = len(self.ring)
+        valid = ~np.isnan(values)
+
+        # Rolling window: the previous ``window`` readings of each one, from cumulative sums over ring + batch
+        history = np.concatenate([self.ring[self.position:], self.ring[:self.position], values])
+        present = ~np.isnan(history)
+        filled = np.where(present, history, 0.0)
+        zeros = np.zeros((1, vitals))
+        sums = np.concatenate([zeros, np.cumsum(filled, axis=0)])
+        squares = np.concatenate([zeros, np.cumsum(filled * filled, axis=0)])
+        counts = np.concatenate([zeros, np.cumsum(present, axis=0)])
+        ends = np.arange(window, window + size)
+        starts = ends - window
+        n = counts[ends] - counts[starts]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (sums[ends] - sums[starts]) / n
+            variance = np.maximum((squares[ends] - squares[starts]) / n - mean * mean, 0.0)
+            zscore = (values - mean) / np.maximum(np.sqrt(variance), MIN_STD)
+        zscore[n < warmup] = np.nan
+
+        # EWMA moments are a recurrence, so they advance reading by reading (O(1) each)
+        ewma_zscore = np.full((size, vitals), np.nan)
+        ewma_mean, ewma_var, count = self.ewma_mean.tolist(), self.ewma_var.tolist(), self.count.tolist()
+        for i in range(vitals):
+            column = values[:, i].tolist()
+            m, v, c = ewma_mean[i], ewma_var[i], count[i]
+            for row, x in enumerate(column):
+                if x != x:  # missing
+                    continue
+                if c == 0:
+                    m = x
+                else:
+                    diff = x - m
+                    if c >= warmup:
+                        ewma_zscore[row, i] = diff / max(v ** 0.5, MIN_STD)
+                    increment = alpha * diff
+                    m += increment
+                    v = (1 - alpha) * (v + diff * increment)
+                c += 1
+            ewma_mean[i], ewma_var[i], count[i] = m, v, c
+
+        # Rate of change against the previous valid reading of the same vital
+        rows = np.arange(size)[:, None]
+        last_row = np.maximum.accumulate(np.where(valid, rows, -1), axis=0)
+        previous_row = np.concatenate([np.full((1, vitals), -1), last_row[:-1]])
+        previous_value = np.where(previous_row >= 0, values[np.maximum(previous_row, 0), np.arange(vitals)],
+                                  self.last_value)
+        previous_ms = np.where(previous_row >= 0, timestamps[np.maximum(previous_row, 0)], self.last_ms)
+        # At least a minute apart, so closely spaced readings are judged by their raw jump
+        elapsed = np.maximum((timestamps[:, None] - previous_ms) / MINUTE_MS, 1.0)
+        rate = (values - previous_value) / elapsed
+
+        flags = np.zeros(size, dtype=np.uint16)
+        for i in range(vitals):
+            for k, exceeded in enumerate((
+                np.abs(zscore[:, i]) > z_threshold,
+                np.abs(ewma_zscore[:, i]) > z_threshold,
+                np.abs(rate[:, i]) > RATE_LIMITS[i],
+            )):
+                flags |= np.where(exceeded, 1 << (i * len(ANOMALY_KINDS) + k), 0).astype(np.uint16)
+
+        # Advance the state
+        if size >= window:
+            self.ring[:] = values[-window:]
+            self.position = 0
+        else:
+            slots = (self.position + np.arange(size)) % window
+            self.ring[slots] = values
+            self.position = int((self.position + size) % window)
+        self.ewma_mean[:], self.ewma_var[:], self.count[:] = ewma_mean, ewma_var, count
+        seen = valid.any(axis=0)
+        final_row = last_row[-1]
+        self.last_value[seen] = values[final_row[seen], np.nonzero(seen)[0]]
+        self.last_ms[seen] = timestamps[final_row[seen]]
+        self.newest_ms = int(timestamps[-1])
+        return Anomalies(zscore, ewma_zscore, rate, flags)
+
+
+class VitalsAnomalyDetector:
+    """Flags readings that deviate from the patient's own recent baseline.
+
+    Each patient keeps a fixed-size ring of their last ``window`` readings
+    and exponentially weighted moments per vital, so scoring a reading
+    costs the same however long their history is. A patient's baseline is
+    seeded once from the last ``SEED_HOURS`` of the columnar vitals store,
+    never by querying ``VitalsReading``. Each batch is folded in time
+    order; readings no newer than the baseline's newest one are left
+    unscored (NaN) rather than replayed out of order.
+    """
+
+    def __init__(self, store: VitalsStore = vitals_store, window: int = WINDOW_READINGS, alpha: float = EWMA_ALPHA,
+                 z_threshold: float = Z_THRESHOLD, warmup: int = WARMUP_READINGS,
+                 max_patients: int = CACHED_PATIENTS):
+        self.store = store
+        self.window = window
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = min(warmup, window)
+        self.max_patients = max_patients
+        self._patients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, patient_id: str, timestamps_ms: np.ndarray, values: np.ndarray,
+                db: Optional[Session] = None, commit: bool = True) -> Anomalies:
+        """Score readings (``values`` columns in ``ANOMALY_VITALS`` order, NaN if missing), in any order.
+
+        With ``commit`` they are folded into the baseline; without, they are
+        only scored, e.g. until they are known to be stored.
+        """
+        timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+        size, vitals = len(timestamps_ms), len(ANOMALY_VITALS)
+        values = np.asarray(values, dtype=np.float64).reshape(size, vitals)
+        order = np.argsort(timestamps_ms, kind="stable")
+        baseline = self._baseline(patient_id, int(timestamps_ms[order[0]]) if size else 0, db)
+        with baseline.lock:
+            if baseline.newest_ms is not None:
+                order = order[timestamps_ms[order] > baseline.newest_ms]
+            target = baseline if commit else baseline.copy()
+            scored = target.update(timestamps_ms[order], values[order], self.alpha, self.z_threshold, self.warmup)
+        if len(order) == size and np.array_equal(order, np.arange(size)):
+            return scored
+        # Back to the caller's row order, with stale readings unscored
+        anomalies = Anomalies(np.full((size, vitals), np.nan), np.full((size, vitals), np.nan),
+                              np.full((size, vitals), np.nan), np.zeros(size, dtype=np.uint16))
+        for column, part in zip(anomalies, scored):
+            column[order] = part
+        return anomalies
+
+    def observe_columns(self, patient_id: str, columns: Dict[str, list], db: Optional[Session] = None,
+                        commit: bool = True) -> Anomalies:
+        """A bulk-ingest column dict (see ``vitals_ingest``)"""
+        values = np.column_stack([
+            np.array([np.nan if v is None else v for v in columns[vital]], dtype=np.float64)
+            for vital in ANOMALY_VITALS
+        ])
+        return self.observe(patient_id, to_epoch_ms(columns["timestamp"]), values, db, commit)
+
+    def observe_reading(self, patient_id: str, reading: Dict[str, Any], db: Optional[Session] = None) -> Anomalies:
+        """One live reading dict (device twin shape)"""
+        values = [[np.nan if reading.get(vital) is None else reading[vital] for vital in ANOMALY_VITALS]]
+        return self.observe(patient_id, to_epoch_ms([reading["timestamp"]]), values, db)
+
+    def _baseline(self, patient_id: str, before_ms: int, db: Optional[Session]) -> _PatientBaseline:
+        with self._lock:
+            baseline = self._patients.get(patient_id)
+            if baseline is not None:
+                self._patients.move_to_end(patient_id)
+                return baseline
+        baseline = _PatientBaseline(self.window)
+        try:
+            parts = [
+                part for part in self.store.patient(patient_id, db).scan_chunks(
+                    before_ms - SEED_HOURS * HOUR_MS, before_ms - 1
+                ) if len(part["timestamp"])
+            ]
+            if parts:
+                timestamps = np.concatenate([part["timestamp"] for part in parts])
+                values = np.column_stack([
+                    np.concatenate([part[vital] for part in parts]) for vital in ANOMALY_VITALS
+                ]).astype(np.float64)
+                values[values <= 0] = np.nan  # the store's placeholder for a missing value
+                order = np.argsort(timestamps, kind="stable")
+                baseline.update(timestamps[order], values[order], self.alpha, self.z_threshold, self.warmup)
+        except Exception as e:
+            print(f"Error seeding vitals baseline: {str(e)}")
+        with self._lock:
+            # Another caller may have seeded the patient meanwhile; keep theirs
+            baseline = self._patients.setdefault(patient_id, baseline)
+            self._patients.move_to_end(patient_id)
+            while len(self._patients) > self.max_patients:
+                self._patients.popitem(last=False)
+            return baseline
+
+
+vitals_anomaly = VitalsAnomalyDetector()
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+from .vitals_wire import encode_readings, decode_readings, is_wire_format
+
+# Historical vitals archive configuration, overridable per deployment
+ARCHIVE_CONTAINER = os.getenv("AIMED_VITALS_ARCHIVE_CONTAINER", "wearable-data")
+DOWNLOAD_CONCURRENCY = int(os.getenv("AIMED_VITALS_ARCHIVE_CONCURRENCY", "16"))
+LOCAL_BLOB_DIR = os.getenv("AIMED_LOCAL_BLOB_DIR", "data/blobs")  # used when Blob Storage isn't configured
+ARCHIVE_FORMAT = os.getenv("AIMED_VITALS_ARCHIVE_FORMAT", "binary")  # "binary" segments or "json" per reading
+SEGMENT_FLUSH_SECONDS = float(os.getenv("AIMED_VITALS_SEGMENT_FLUSH_SECONDS", "300"))
+SEGMENT_MAX_READINGS = int(os.getenv("AIMED_VITALS_SEGMENT_READINGS", "720"))
+
+# Readings are stored as data/{user}/{yyyy}/{mm}/{dd}/{HHMMSSffffff}.{ext}, so a date range
+# maps to a few listing prefixes and the blob name alone gives its (first) reading's time.
+# A .json blob holds one reading; a .avw blob is a binary segment (see vitals_wire) of
+# readings from the same clock hour, named after its first. An hour may hold several segments.
+_NAME_FORMAT = "%H%M%S%f"
+_JSON_SUFFIX = ".json"
+_SEGMENT_SUFFIX = ".avw"
+_SEGMENT_SPAN = timedelta(hours=1)
+
+
+def user_prefix(user_id: str) -> str:
+    return f"data/{user_id}/"
+
+
+def blob_name_for(user_id: str, timestamp: datetime, suffix: str = _JSON_SUFFIX) -> str:
+    return f"{user_prefix(user_id)}{timestamp:%Y/%m/%d}/{timestamp.strftime(_NAME_FORMAT)}{suffix}"
+
+
+def timestamp_from_name(name: str) -> Optional[datetime]:
+    """Reading time encoded in a partitioned blob name, or None for other names"""
+    parts = name.rsplit("/", 4)
+    if len(parts) != 5:
+        return None
+    stem, suffix = os.path.splitext(parts[4])
+    if suffix not in (_JSON_SUFFIX, _SEGMENT_SUFFIX):
+        return None
+    try:
+        return datetime.strptime("".join(parts[1:4]) + stem, "%Y%m%d" + _NAME_FORMAT)
+    except ValueError:
+        return None
+
+
+def _hour(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _overlaps(name: str, timestamp: datetime, start: datetime, end: datetime) -> bool:
+    if not name.endswith(_SEGMENT_SUFFIX):
+        return start <= timestamp <= end
+    # A segment runs from its name's time to the end of that hour
+    return timestamp <= end and _hour(timestamp) + _SEGMENT_SPAN > start
+
+
+def partition_prefixes(user_id: str, start: datetime, end: datetime) -> List[str]:
+    """Fewest listing prefixes covering [start, end]: whole years, then whole months, then days"""
+    prefixes = []
+    day = start.date()
+    last = end.date()
+    while day <= last:
+        year_end = date(day.year, 12, 31)
+        if day.month == 1 and day.day == 1 and year_end <= last:
+            prefixes.append(f"{user_prefix(user_id)}{day:%Y}/")
+            day = year_end + timedelta(days=1)
+            continue
+        month_end = (date(day.year, day.month, 28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        if day.day == 1 and month_end <= last:
+            prefixes.append(f"{user_prefix(user_id)}{day:%Y/%m}/")
+            day = month_end + timedelta(days=1)
+            continue
+        prefixes.append(f"{user_prefix(user_id)}{day:%Y/%m/%d}/")
+        day += timedelta(days=1)
+    return prefixes
+
+
+class AzureBlobStore:
+    """Blob Storage container; the blocking SDK calls run on worker threads"""
+
+    def __init__(self, connection_str: str, container: str = ARCHIVE_CONTAINER):
+        from azure.storage.blob import BlobServiceClient
+
+        service_client = BlobServiceClient.from_connection_string(connection_str)
+        self.container_client = service_client.get_container_client(container)
+
+    async def list(self, prefix: str) -> List[str]:
+        def _list():
+            return [blob.name for blob in self.container_client.list_blobs(name_starts_with=prefix)]
+        return await asyncio.to_thread(_list)
+
+    async def download(self, name: str) -> bytes:
+        def _download():
+            return self.container_client.get_blob_client(name).download_blob().readall()
+        return await asyncio.to_thread(_download)
+
+    async def upload(self, name: str, data: bytes):
+        def _upload():
+            self.container_client.get_blob_client(name).upload_blob(data, overwrite=True)
+        await asyncio.to_thread(_upload)
+
+
+class LocalBlobStore:
+    """Filesystem stand-in for a Blob Storage container, for development and tests.
+
+    Blob names map to paths under ``root``, so listing a partition prefix
+    only walks that partition's directories.
+    """
+
+    def __init__(self, root: str = LOCAL_BLOB_DIR):
+        self.root = root
+        self.downloads = 0  # lets tests check how many blobs a query touched
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, *name.split("/"))
+
+    async def list(self, prefix: str) -> List[str]:
+        def _list():
+            # Prefixes here always end at a partition boundary ('/')
+            base = self._path(prefix.rstrip("/"))
+            names = []
+            for directory, _, files in os.walk(base):
+                relative = os.path.relpath(directory, self.root).replace(os.sep, "/")
+                names.extend(f"{relative}/{filename}" for filename in files)
+            return sorted(names)
+        return await asyncio.to_thread(_list)
+
+    async def download(self, name: str) -> bytes:
+        def _download():
+            with open(self._path(name), 'rb') as f:
+                return f.read()
+        self.downloads += 1
+        return await asyncio.to_thread(_download)
+
+    async def upload(self, name: str, data: bytes):
+        def _upload():
+            path = self._path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        await asyncio.to_thread(_upload)
+
+
+def default_blob_store(container: str = ARCHIVE_CONTAINER):
+    """Blob Storage when a connection string is configured, the local stand-in otherwise"""
+    connection_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+    if connection_str:
+        return AzureBlobStore(connection_str, container)
+    return LocalBlobStore(os.path.join(LOCAL_BLOB_DIR, container))
+
+
+class VitalsArchive:
+    """Date-partitioned archive of wearable readings in a blob store.
+
+    A range query lists only the partitions overlapping the range, drops
+    blobs whose name falls outside it, and downloads the rest concurrently
+    (at most ``concurrency`` at a time), so cost follows the size of the
+    range rather than the patient's whole history.
+
+    In the binary format, live readings are buffered per patient and
+    written as one segment when the clock hour changes, ``max_readings``
+    accumulate or the oldest has waited ``flush_seconds``. Buffered readings
+    are included in range queries; ``close()`` writes them out. Share one
+    archive per process so readings land in the same buffer.
+    """
+
+    def __init__(self, store, concurrency: int = DOWNLOAD_CONCURRENCY, archive_format: str = ARCHIVE_FORMAT,
+                 flush_seconds: float = SEGMENT_FLUSH_SECONDS, max_readings: int = SEGMENT_MAX_READINGS):
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.archive_format = archive_format
+        self.flush_seconds = flush_seconds
+        self.max_readings = max(1, max_readings)
+        self._pending = {}  # user_id -> (monotonic time of the oldest buffered reading, readings)
+        self._flusher = None
+
+    async def write_reading(self, user_id: str, reading: Dict[str, Any]):
+        timestamp = datetime.fromisoformat(reading["timestamp"])
+        if self.archive_format != "binary":
+            await self.store.upload(blob_name_for(user_id, timestamp), json.dumps(reading).encode())
+            return
+        pending = self._pending.get(user_id)
+        if pending is not None and _hour(datetime.fromisoformat(pending[1][-1]["timestamp"])) != _hour(timestamp):
+            await self.flush(user_id)
+        _, readings = self._pending.setdefault(user_id, (time.monotonic(), []))
+        readings.append(reading)
+        if len(readings) >= self.max_readings:
+            await self.flush(user_id)
+        self._ensure_flusher()
+
+    async def flush(self, user_id: Optional[str] = None, older_than: Optional[float] = None):
+        """Write buffered readings (of one patient, or everyone's buffered for ``older_than`` seconds)"""
+        now = time.monotonic()
+        users = [user_id] if user_id is not None else [
+            user for user, (opened, _) in self._pending.items()
+            if older_than is None or now - opened >= older_than
+        ]
+        for user in users:
+            pending = self._pending.pop(user, None)
+            if pending is None:
+                continue
+            try:
+                await self.write_segment(user, pending[1])
+            except Exception as e:
+                print(f"Error writing vitals segment: {str(e)}")
+                # Keep them buffered, ahead of anything that arrived meanwhile, for the next flush
+                opened, readings = self._pending.get(user, (pending[0], []))
+                self._pending[user] = (pending[0], pending[1] + readings)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(max(self.flush_seconds / 4, 1.0))
+            await self.flush(older_than=self.flush_seconds)
+
+    async def write_segment(self, user_id: str, readings: Sequence[Dict[str, Any]]):
+        """Store readings as binary segments, one per clock hour they span"""
+        hours = {}
+        for reading in readings:
+            timestamp = datetime.fromisoformat(reading["timestamp"])
+            hours.setdefault(_hour(timestamp), []).append((timestamp, reading))
+        await asyncio.gather(*(
+            self.store.upload(
+                blob_name_for(user_id, min(timestamp for timestamp, _ in group), _SEGMENT_SUFFIX),
+                encode_readings([reading for _, reading in group])
+            )
+            for group in hours.values()
+        ))
+
+    async def read_range(self, user_id: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        listings = await asyncio.gather(*(
+            self.store.list(prefix) for prefix in partition_prefixes(user_id, start, end)
+        ))
+        names = []
+        for listing in listings:
+            for name in listing:
+                timestamp = timestamp_from_name(name)
+                # Unrecognised names are fetched and filtered on their content instead
+                if timestamp is None or _overlaps(name, timestamp, start, end):
+                    names.append(name)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(name: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                data = await self.store.download(name)
+            try:
+                readings = decode_readings(data) if is_wire_format(data) else [json.loads(data)]
+                for reading in readings:
+                    datetime.fromisoformat(reading["timestamp"])
+            except (ValueError, TypeError, KeyError) as e:
+                # One damaged blob shouldn't hide the rest of the range
+                print(f"Error reading archived vitals {name}, skipped: {str(e)}")
+                return []
+            return readings
+
+        blobs = await asyncio.gather(*(fetch(name) for name in names))
+        if user_id in self._pending:
+            blobs.append(list(self._pending[user_id][1]))
+        return sorted(
+            (reading for readings in blobs for reading in readings
+             if start <= datetime.fromisoformat(reading["timestamp"]) <= end),
+            key=lambda reading: reading["timestamp"]
+        )
@@ -0,0 +1,176 @@
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Sequence
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from ..models.patient_vitals import VitalsReading, VitalsReadingCreate, VitalsColumns, VITALS_COLUMNS
+from .inference_metrics import registry as metrics_registry
+from .vitals_store import VitalsStore, vitals_store
+from .threshold_evaluator import ThresholdEvaluator, threshold_evaluator
+from .vitals_anomaly import VitalsAnomalyDetector, vitals_anomaly
+
+# Bulk ingest configuration, overridable per deployment
+INGEST_CHUNK_ROWS = int(os.getenv("AIMED_VITALS_INGEST_CHUNK_ROWS", "2000"))
+MAX_INGEST_ROWS = int(os.getenv("AIMED_VITALS_MAX_INGEST_ROWS", "100000"))
+MAX_REPORTED_ERRORS = 50
+
+# Plausible sensor ranges (inclusive); readings outside them are rejected as device errors
+VITALS_RANGES = {
+    "systolic": (40, 300),
+    "diastolic": (20, 200),
+    "heart_rate": (20, 300),
+    "oxygen_saturation": (50, 100),
+}
+
+INGESTED_ROWS = metrics_registry.counter(
+    "aimed_vitals_ingested_rows_total", "Bulk-ingested vitals rows by outcome: inserted or failed", ("outcome",)
+)
+INGEST_SECONDS = metrics_registry.histogram(
+    "aimed_vitals_ingest_seconds", "Time to validate and insert one bulk vitals upload"
+)
+
+
+class VitalsValidationError(Exception):
+    """A bulk upload contained invalid readings; nothing was inserted"""
+
+    def __init__(self, errors: List[Dict[str, Any]], total: int):
+        super().__init__(f"{total} invalid reading values")
+        self.errors = errors
+        self.total = total
+
+
+def columns_from_readings(readings: Sequence[VitalsReadingCreate]) -> Dict[str, list]:
+    """Pivot row payloads into index-aligned columns, plus a per-row device_id column"""
+    columns = {name: [getattr(reading, name) for reading in readings] for name in VITALS_COLUMNS}
+    columns["device_id"] = [reading.device_id for reading in readings]
+    return columns
+
+
+def columns_from_batch(batch: VitalsColumns) -> Dict[str, list]:
+    size = len(batch.timestamp)
+    columns = {
+        name: getattr(batch, name) if getattr(batch, name) is not None else [None] * size
+        for name in VITALS_COLUMNS
+    }
+    columns["device_id"] = [batch.device_id] * size
+    return columns
+
+
+def validate_columns(columns: Dict[str, list]):
+    """Range-check whole columns at once; raises VitalsValidationError listing bad values"""
+    mask_by_field = {}
+    for name, (low, high) in VITALS_RANGES.items():
+        # Missing optional values become NaN, which compares False and so never flags
+        values = np.array([np.nan if v is None else v for v in columns[name]], dtype=np.float64)
+        mask_by_field[name] = (values < low) | (values > high)
+    systolic = np.asarray(columns["systolic"], dtype=np.float64)
+    diastolic = np.asarray(columns["diastolic"], dtype=np.float64)
+    pulse_pressure_bad = systolic <= diastolic
+
+    total = int(sum(mask.sum() for mask in mask_by_field.values()) + pulse_pressure_bad.sum())
+    if not total:
+        return
+
+    errors = []
+    for name, mask in mask_by_field.items():
+        for index in np.nonzero(mask)[0][:MAX_REPORTED_ERRORS].tolist():
+            low, high = VITALS_RANGES[name]
+            errors.append({"index": index, "field": name, "value": columns[name][index],
+                           "error": f"outside {low}-{high}"})
+    for index in np.nonzero(pulse_pressure_bad)[0][:MAX_REPORTED_ERRORS].tolist():
+        errors.append({"index": index, "field": "systolic", "value": columns["systolic"][index],
+                       "error": "systolic must exceed diastolic"})
+    errors.sort(key=lambda error: error["index"])
+    raise VitalsValidationError(errors[:MAX_REPORTED_ERRORS], total)
+
+
+class VitalsIngestService:
+    """Validates a burst of readings as a whole, then inserts it in chunks.
+
+    Each chunk is one multi-row INSERT committed in its own transaction, so
+    a gateway replaying thousands of buffered readings pays a handful of
+    round trips instead of one commit per reading. A failed chunk is rolled
+    back and reported by row range so the sender can retry just that slice.
+    Committed chunks are also appended to the columnar vitals store.
+    Readings outside the patient's thresholds are flagged in the same pass
+    and inserted with their alert details, as are readings the anomaly
+    detector finds unusual for the patient (with ``alert_generated`` unset
+    if they are within thresholds).
+    """
+
+    def __init__(self, db: Session, chunk_rows: int = INGEST_CHUNK_ROWS, store: VitalsStore = vitals_store,
+                 evaluator: ThresholdEvaluator = threshold_evaluator, detector: VitalsAnomalyDetector = vitals_anomaly):
+        self.db = db
+        self.chunk_rows = max(1, chunk_rows)
+        self.store = store
+        self.evaluator = evaluator
+        self.detector = detector
+
+    def ingest(self, patient_id: str, columns: Dict[str, list]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        size = len(columns["timestamp"])
+        validate_columns(columns)
+        # Open (and if new, backfill) the patient's store before any of this upload is committed
+        self.store.patient(patient_id, self.db)
+        evaluation = self.evaluator.evaluate_columns(patient_id, columns)
+        alerted = set(evaluation.alert_rows.tolist())
+
+        names = ("device_id",) + VITALS_COLUMNS
+        inserted = 0
+        anomalous = 0
+        chunks = 0
+        failed = []
+        for start in range(0, size, self.chunk_rows):
+            end = min(start + self.chunk_rows, size)
+            chunk = {name: columns[name][start:end] for name in names}
+            # Scored now but folded into the patient's baseline only once the rows are committed
+            anomalies = self.detector.observe_columns(patient_id, chunk, self.db, commit=False)
+            flagged = (np.nonzero(anomalies.flags)[0] + start).tolist()
+            alert_details = self.evaluator.alert_details(
+                evaluation, columns, sorted(alerted.intersection(range(start, end)).union(flagged))
+            )
+            for row, details in alert_details.items():
+                details["anomaly"] = anomalies.details(row - start)
+            rows = [
+                dict(zip(names, values), id=str(uuid.uuid4()), patient_id=patient_id,
+                     alert_generated=index in alerted, alert_details=alert_details.get(index))
+                for index, values in enumerate(zip(*(columns[name][start:end] for name in names)), start)
+            ]
+            try:
+                self.db.execute(insert(VitalsReading), rows)
+                self.db.commit()
+                inserted += len(rows)
+            except Exception as e:
+                self.db.rollback()
+                print(f"Error inserting vitals rows {start}-{end}: {str(e)}")
+                failed.append({"start": start, "end": end, "error": str(e)})
+                chunks += 1
+                continue
+            chunks += 1
+            anomalous += len(flagged)
+            try:
+                self.detector.observe_columns(patient_id, chunk, self.db)
+            except Exception as e:
+                print(f"Error updating vitals baseline with rows {start}-{end}: {str(e)}")
+            try:
+                self.store.append_columns(patient_id, chunk)
+            except Exception as e:
+                print(f"Error appending vitals rows {start}-{end} to store: {str(e)}")
+
+        seconds = time.perf_counter() - started
+        INGESTED_ROWS.inc("inserted", amount=inserted)
+        if inserted < size:
+            INGESTED_ROWS.inc("failed", amount=size - inserted)
+        INGEST_SECONDS.observe(seconds)
+        return {
+            "rows": size,
+            "inserted": inserted,
+            "chunks": chunks,
+            "alerts": len(alerted),
+            "anomalies": anomalous,
+            "failed_chunks": failed,
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(inserted / seconds, 1) if seconds > 0 else None
+        }
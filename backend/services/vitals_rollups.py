@@ -0,0 +1,414 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from .vitals_store import MISSING, VitalsStore, vitals_store
+
+# Rollup configuration, overridable per deployment
+MAX_CHART_POINTS = int(os.getenv("AIMED_VITALS_MAX_CHART_POINTS", "500"))
+CACHED_PATIENTS = int(os.getenv("AIMED_VITALS_ROLLUP_PATIENTS", "1024"))
+CACHE_BYTES = int(os.getenv("AIMED_VITALS_ROLLUP_CACHE_MB", "512")) * 1024 * 1024
+MINUTE_RETENTION_HOURS = int(os.getenv("AIMED_VITALS_MINUTE_RETENTION_HOURS", "48"))
+HOUR_RETENTION_DAYS = int(os.getenv("AIMED_VITALS_HOUR_RETENTION_DAYS", "90"))
+
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+
+# Coarsest first: (resolution, how far back behind the newest bucket it is kept; None for always)
+RESOLUTIONS = OrderedDict([
+    ("day", (DAY_MS, None)),
+    ("hour", (HOUR_MS, HOUR_RETENTION_DAYS * DAY_MS)),
+    ("minute", (MINUTE_MS, MINUTE_RETENTION_HOURS * HOUR_MS)),
+])
+ROLLUP_VITALS = ("systolic", "diastolic", "heart_rate", "oxygen_saturation")
+
+_ALL_MS = (np.iinfo(np.int64).min, np.iinfo(np.int64).max)
+
+
+def _to_ms(moment: datetime) -> int:
+    return int(np.datetime64(moment, "ms").astype(np.int64))
+
+
+def _values(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """(rows, vitals) float matrix with NaN where a value is missing"""
+    values = np.column_stack([columns[name] for name in ROLLUP_VITALS]).astype(np.float64)
+    values[values == MISSING] = np.nan
+    return values
+
+
+class _RollupLevel:
+    """Count, sum, sum of squares, min and max per vital for fixed-width time buckets.
+
+    Buckets live in growable arrays indexed by a bucket -> row dict, so
+    appending readings is a few vectorized ``ufunc.at`` updates. Late
+    readings may open buckets out of order; rows are re-sorted lazily
+    before the next range query. With a ``retention_ms``, buckets that
+    fall that far behind the newest one are dropped; ``horizon`` is the
+    first bucket still complete, and older readings are left to coarser
+    levels or the raw store.
+    """
+
+    def __init__(self, resolution_ms: int, retention_ms: Optional[int] = None, capacity: int = 64):
+        self.resolution_ms = resolution_ms
+        self.retention_ms = retention_ms
+        self.horizon = _ALL_MS[0]
+        self.size = 0
+        self.sorted = True
+        self.index = {}
+        self._allocate(capacity)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.buckets, self.count, self.sum, self.sumsq, self.min, self.max))
+
+    def _allocate(self, capacity: int):
+        vitals = len(ROLLUP_VITALS)
+        old = self.size and (self.buckets, self.count, self.sum, self.sumsq, self.min, self.max)
+        self.buckets = np.zeros(capacity, dtype=np.int64)
+        self.count = np.zeros((capacity, vitals), dtype=np.int64)
+        self.sum = np.zeros((capacity, vitals))
+        self.sumsq = np.zeros((capacity, vitals))
+        self.min = np.full((capacity, vitals), np.nan)
+        self.max = np.full((capacity, vitals), np.nan)
+        if old:
+            for target, source in zip((self.buckets, self.count, self.sum, self.sumsq, self.min, self.max), old):
+                target[:self.size] = source[:self.size]
+
+    def add(self, timestamps: np.ndarray, values: np.ndarray):
+        if self.retention_ms is not None:
+            keep = timestamps >= self.horizon
+            if not keep.all():
+                timestamps, values = timestamps[keep], values[keep]
+            if not len(timestamps):
+                return
+        keys, inverse = np.unique(timestamps // self.resolution_ms * self.resolution_ms, return_inverse=True)
+        rows = np.fromiter((self._row(key) for key in keys.tolist()), dtype=np.int64, count=len(keys))[inverse]
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0.0)
+        np.add.at(self.count, rows, present)
+        np.add.at(self.sum, rows, filled)
+        np.add.at(self.sumsq, rows, filled * filled)
+        np.fmin.at(self.min, rows, values)  # fmin/fmax skip NaN
+        np.fmax.at(self.max, rows, values)
+        if self.retention_ms is not None:
+            self._expire(int(keys[-1]) - self.retention_ms)
+
+    def _expire(self, cutoff: int):
+        cutoff = cutoff // self.resolution_ms * self.resolution_ms
+        # In steps of an eighth of the retention, so buckets aren't compacted on every append
+        if cutoff - self.horizon < self.retention_ms // 8:
+            return
+        keep = self.buckets[:self.size] >= cutoff
+        kept = int(np.count_nonzero(keep))
+        for name in ("buckets", "count", "sum", "sumsq", "min", "max"):
+            array = getattr(self, name)
+            array[:kept] = array[:self.size][keep]
+            array[kept:self.size] = np.nan if name in ("min", "max") else 0  # rows are reused for new buckets
+        self.size = kept
+        self.index = {key: row for row, key in enumerate(self.buckets[:self.size].tolist())}
+        self.horizon = cutoff
+        if len(self.buckets) > 64 and self.size < len(self.buckets) // 4:
+            self._allocate(max(64, 2 * self.size))  # give back what a large batch grew
+
+    def _row(self, key: int) -> int:
+        row = self.index.get(key)
+        if row is None:
+            if self.size == len(self.buckets):
+                self._allocate(2 * len(self.buckets))
+            row = self.index[key] = self.size
+            if self.size and key < self.buckets[self.size - 1]:
+                self.sorted = False
+            self.buckets[row] = key
+            self.size += 1
+        return row
+
+    def range(self, start_ms: int, end_ms: int) -> Tuple[np.ndarray, ...]:
+        """Views of (buckets, count, sum, sumsq, min, max) for buckets starting in [start_ms, end_ms)"""
+        if not self.sorted:
+            order = np.argsort(self.buckets[:self.size], kind="stable")
+            for name in ("buckets", "count", "sum", "sumsq", "min", "max"):
+                array = getattr(self, name)
+                array[:self.size] = array[:self.size][order]
+            self.index = {key: row for row, key in enumerate(self.buckets[:self.size].tolist())}
+            self.sorted = True
+        lo = np.searchsorted(self.buckets[:self.size], start_ms, side="left")
+        hi = np.searchsorted(self.buckets[:self.size], end_ms, side="left")
+        return (self.buckets[lo:hi], self.count[lo:hi], self.sum[lo:hi],
+                self.sumsq[lo:hi], self.min[lo:hi], self.max[lo:hi])
+
+
+class _Accumulator:
+    """Merges rollup buckets and raw readings into per-group vitals statistics"""
+
+    def __init__(self, groups: int = 1):
+        vitals = len(ROLLUP_VITALS)
+        self.count = np.zeros((groups, vitals), dtype=np.int64)
+        self.sum = np.zeros((groups, vitals))
+        self.sumsq = np.zeros((groups, vitals))
+        self.min = np.full((groups, vitals), np.nan)
+        self.max = np.full((groups, vitals), np.nan)
+
+    def add_buckets(self, groups: np.ndarray, count, total, sumsq, low, high):
+        np.add.at(self.count, groups, count)
+        np.add.at(self.sum, groups, total)
+        np.add.at(self.sumsq, groups, sumsq)
+        np.fmin.at(self.min, groups, low)
+        np.fmax.at(self.max, groups, high)
+
+    def add_raw(self, groups: np.ndarray, values: np.ndarray):
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0.0)
+        self.add_buckets(groups, present, filled, filled * filled, values, values)
+
+    def results(self) -> List[Dict[str, Dict[str, Optional[float]]]]:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum / self.count
+            std = np.sqrt(np.maximum(self.sumsq / self.count - mean * mean, 0.0))
+        results = []
+        for group in range(len(self.count)):
+            stats = {}
+            for column, name in enumerate(ROLLUP_VITALS):
+                count = int(self.count[group, column])
+                stats[name] = {
+                    "count": count,
+                    "mean": float(mean[group, column]) if count else None,
+                    "std": float(std[group, column]) if count else None,
+                    "min": float(self.min[group, column]) if count else None,
+                    "max": float(self.max[group, column]) if count else None,
+                }
+            results.append(stats)
+        return results
+
+
+class _PatientRollups:
+    def __init__(self):
+        self.levels = [
+            (name, _RollupLevel(resolution, retention)) for name, (resolution, retention) in RESOLUTIONS.items()
+        ]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for _, level in self.levels)
+
+    def add(self, columns: Dict[str, np.ndarray]):
+        values = _values(columns)
+        for _, level in self.levels:
+            level.add(columns["timestamp"], values)
+
+
+class VitalsRollups:
+    """Minute, hour and day rollups of each patient's vitals.
+
+    A patient's rollups are built from the vitals store on first use and
+    then kept current by the store's append listener, so they always
+    match the raw readings. Queries cover a range with the coarsest
+    buckets that fit inside it (whole days, then hours at the edges, then
+    minutes) and read raw readings only for the sub-minute remainder, so
+    the cost follows the number of buckets, not readings. Hour and minute
+    buckets are kept for ``HOUR_RETENTION_DAYS`` and
+    ``MINUTE_RETENTION_HOURS``; the edges of older ranges are read raw.
+    The cache holds at most ``max_patients`` patients and ``max_bytes``.
+    """
+
+    def __init__(self, store: VitalsStore = vitals_store, max_patients: int = CACHED_PATIENTS,
+                 max_bytes: int = CACHE_BYTES):
+        self.store = store
+        self.max_patients = max_patients
+        self.max_bytes = max_bytes
+        self._patients = OrderedDict()
+        self._lock = threading.Lock()
+        store.add_listener(self._on_append)
+
+    def _on_append(self, patient_id: str, batch: Dict[str, np.ndarray]):
+        # Called under the patient store's lock; patients not built yet pick the rows up when built
+        with self._lock:
+            rollups = self._patients.get(patient_id)
+        if rollups is not None:
+            rollups.add(batch)
+
+    def _rollups(self, patient_id: str, db: Optional[Session]) -> Tuple[_PatientRollups, Any]:
+        patient_store = self.store.patient(patient_id, db)
+        with patient_store._lock:
+            with self._lock:
+                rollups = self._patients.get(patient_id)
+                if rollups is not None:
+                    self._patients.move_to_end(patient_id)
+                    return rollups, patient_store
+            rollups = _PatientRollups()
+            for part in patient_store.scan_chunks(*_ALL_MS):
+                if len(part["timestamp"]):
+                    rollups.add(part)
+            with self._lock:
+                self._patients[patient_id] = rollups
+                total = sum(cached.nbytes for cached in self._patients.values())
+                while len(self._patients) > 1 and (len(self._patients) > self.max_patients or total > self.max_bytes):
+                    total -= self._patients.popitem(last=False)[1].nbytes
+        return rollups, patient_store
+
+    @staticmethod
+    def _cover(levels: List[_RollupLevel], start_ms: int, end_ms: int) -> List[Tuple[Optional[int], int, int]]:
+        """Split [start_ms, end_ms) into (level index or None for raw, lo, hi) pieces, coarsest buckets first"""
+        pieces = []
+
+        def cover(lo: int, hi: int, depth: int):
+            if lo >= hi:
+                return
+            if depth == len(levels):
+                pieces.append((None, lo, hi))
+                return
+            resolution = levels[depth].resolution_ms
+            aligned_lo = max(-(-lo // resolution) * resolution, levels[depth].horizon)
+            aligned_hi = hi // resolution * resolution
+            if aligned_lo >= aligned_hi:
+                cover(lo, hi, depth + 1)
+                return
+            cover(lo, aligned_lo, depth + 1)
+            pieces.append((depth, aligned_lo, aligned_hi))
+            cover(aligned_hi, hi, depth + 1)
+
+        cover(start_ms, end_ms, 0)
+        return pieces
+
+    def summary(self, patient_id: str, start: datetime, end: datetime,
+                db: Optional[Session] = None) -> Dict[str, Dict[str, Optional[float]]]:
+        """Count, mean, std, min and max of each vital over [start, end]"""
+        start_ms, end_ms = _to_ms(start), _to_ms(end) + 1  # end is inclusive, as in scans
+        rollups, patient_store = self._rollups(patient_id, db)
+        levels = [level for _, level in rollups.levels]
+        accumulator = _Accumulator()
+        with patient_store._lock:
+            for depth, lo, hi in self._cover(levels, start_ms, end_ms):
+                if depth is None:
+                    for part in patient_store.scan_chunks(lo, hi - 1):
+                        if len(part["timestamp"]):
+                            accumulator.add_raw(np.zeros(len(part["timestamp"]), dtype=np.int64), _values(part))
+                else:
+                    buckets, *stats = levels[depth].range(lo, hi)
+                    accumulator.add_buckets(np.zeros(len(buckets), dtype=np.int64), *stats)
+        return accumulator.results()[0]
+
+    def count_outside(self, patient_id: str, start: datetime, end: datetime,
+                      limits: Dict[str, Tuple[float, float]], db: Optional[Session] = None) -> int:
+        """Readings in [start, end] with any vital outside its (min, max) limits.
+
+        Buckets entirely inside or entirely outside the limits are counted
+        from their min/max; only buckets straddling a limit are refined at
+        the next finer resolution, and only their readings are checked raw.
+        """
+        start_ms, end_ms = _to_ms(start), _to_ms(end) + 1
+        rollups, patient_store = self._rollups(patient_id, db)
+        levels = [level for _, level in rollups.levels]
+        columns = [ROLLUP_VITALS.index(name) for name in limits]
+        low = np.array([limits[name][0] for name in limits], dtype=np.float64)
+        high = np.array([limits[name][1] for name in limits], dtype=np.float64)
+        reference = columns[0]  # every reading has the limited vitals, so any one gives the bucket size
+
+        def outside_raw(part: Dict[str, np.ndarray]) -> np.ndarray:
+            values = _values(part)[:, columns]
+            return ((values < low) | (values > high)).any(axis=1)
+
+        def count_raw(parents: np.ndarray, resolution: int) -> int:
+            total = 0
+            for part in patient_store.scan_chunks(int(parents[0]), int(parents[-1]) + resolution - 1):
+                keep = _member(part["timestamp"] // resolution * resolution, parents)
+                total += int(np.count_nonzero(outside_raw(part) & keep))
+            return total
+
+        def count_piece(depth: Optional[int], lo: int, hi: int) -> int:
+            if depth is None:
+                return sum(int(np.count_nonzero(outside_raw(part))) for part in patient_store.scan_chunks(lo, hi - 1))
+            total = 0
+            parents, parent_resolution = None, None
+            for position in range(depth, len(levels)):
+                level = levels[position]
+                buckets, count, _, _, bucket_min, bucket_max = level.range(lo, hi)
+                if parents is not None:
+                    # Only the children of last level's straddling buckets
+                    keep = _member(buckets // parent_resolution * parent_resolution, parents)
+                    buckets, count, bucket_min, bucket_max = buckets[keep], count[keep], bucket_min[keep], bucket_max[keep]
+                bucket_min, bucket_max = bucket_min[:, columns], bucket_max[:, columns]
+                inside = ((bucket_min >= low) & (bucket_max <= high)).all(axis=1)
+                outside = ((bucket_min > high) | (bucket_max < low)).any(axis=1)
+                total += int(count[outside, reference].sum())
+                parents, parent_resolution = buckets[~inside & ~outside], level.resolution_ms
+                # Straddling buckets the next level no longer holds (or the last level's) are checked raw
+                horizon = levels[position + 1].horizon if position + 1 < len(levels) else _ALL_MS[1]
+                unrolled = parents < horizon
+                if unrolled.any():
+                    total += count_raw(parents[unrolled], parent_resolution)
+                    parents = parents[~unrolled]
+                if not len(parents):
+                    return total
+                lo, hi = int(parents[0]), int(parents[-1]) + parent_resolution
+            return total
+
+        with patient_store._lock:
+            return sum(count_piece(depth, lo, hi) for depth, lo, hi in self._cover(levels, start_ms, end_ms))
+
+    def recent(self, patient_id: str, end: datetime, limit: int, db: Optional[Session] = None) -> Dict[str, np.ndarray]:
+        """The last ``limit`` readings at or before ``end``, found through the finest rollups that hold them"""
+        end_ms = _to_ms(end) + 1
+        rollups, patient_store = self._rollups(patient_id, db)
+        with patient_store._lock:
+            start_ms = _ALL_MS[0]
+            for _, level in reversed(rollups.levels):
+                # Whole buckets before the one holding ``end``, so every reading they count is in range
+                buckets, count = level.range(level.horizon, (end_ms - 1) // level.resolution_ms * level.resolution_ms)[:2]
+                held = np.cumsum(count[::-1, 0])
+                if len(held) and held[-1] >= limit:
+                    start_ms = int(buckets[-(int(np.searchsorted(held, limit)) + 1)])
+                    break
+            parts = [part for part in patient_store.scan_chunks(start_ms, end_ms - 1) if len(part["timestamp"])]
+            names = ("timestamp",) + ROLLUP_VITALS
+            columns = {name: np.concatenate([part[name] for part in parts]) for name in names} if parts else {
+                name: np.empty(0, dtype=np.int64) for name in names
+            }
+        order = np.argsort(columns["timestamp"], kind="stable")[-limit:]
+        return {name: column[order] for name, column in columns.items()}
+
+    def buckets(self, patient_id: str, start: datetime, end: datetime, max_points: int = MAX_CHART_POINTS,
+                db: Optional[Session] = None) -> Dict[str, Any]:
+        """Chart series over [start, end] at the finest resolution with at most ``max_points`` buckets"""
+        start_ms, end_ms = _to_ms(start), _to_ms(end) + 1
+        rollups, patient_store = self._rollups(patient_id, db)
+        name, level = rollups.levels[0]
+        for candidate_name, candidate in reversed(rollups.levels):
+            resolution = candidate.resolution_ms
+            if -(-(end_ms - start_ms) // resolution) <= max_points and start_ms // resolution * resolution >= candidate.horizon:
+                name, level = candidate_name, candidate
+                break
+        with patient_store._lock:
+            buckets, count, total, _, low, high = level.range(
+                start_ms // level.resolution_ms * level.resolution_ms, end_ms
+            )
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = total / count
+            points = []
+            for row, bucket in enumerate(buckets.tolist()):
+                point = {"start": _ms_to_datetime(bucket).isoformat(), "count": int(count[row, 0])}
+                for column, vital in enumerate(ROLLUP_VITALS):
+                    if count[row, column]:
+                        point[vital] = {
+                            "mean": float(mean[row, column]),
+                            "min": float(low[row, column]),
+                            "max": float(high[row, column])
+                        }
+                points.append(point)
+        return {"resolution": name, "points": points}
+
+
+def _member(keys: np.ndarray, sorted_values: np.ndarray) -> np.ndarray:
+    """Boolean mask of ``keys`` found in the sorted ``sorted_values``"""
+    positions = np.minimum(np.searchsorted(sorted_values, keys), len(sorted_values) - 1)
+    return sorted_values[positions] == keys
+
+
+def _ms_to_datetime(ms: int) -> datetime:
+    return np.datetime64(ms, "ms").astype(datetime)
+
+
+vitals_rollups = VitalsRollups()
@@ -0,0 +1,241 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+import numpy as np
+from sqlalchemy.orm import Session
+from .vitals_store import MISSING, VitalsStore, vitals_store
+
+# Pattern statistics configuration, overridable per deployment
+WINDOW_DAYS = int(os.getenv("AIMED_VITALS_STATS_WINDOW_DAYS", "30"))
+CACHED_PATIENTS = int(os.getenv("AIMED_VITALS_STATS_PATIENTS", "1024"))
+
+HOUR_MS = 60 * 60 * 1000
+STATS_VITALS = ("systolic", "diastolic", "heart_rate")
+_SYSTOLIC, _DIASTOLIC, _HEART_RATE = range(len(STATS_VITALS))
+ELEVATED_SYSTOLIC = 140  # readings at or above this count towards sustained elevation
+
+
+def _combine(count, mean, m2, comoment, groups: np.ndarray, size: int):
+    """Merge per-slot moments into ``size`` groups (Chan et al.'s pairwise update, vectorized)"""
+    total = np.bincount(groups, weights=count, minlength=size)
+    sums = np.zeros((size, mean.shape[1]))
+    np.add.at(sums, groups, mean * count[:, None])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pooled_mean = sums / total[:, None]
+    delta = np.nan_to_num(mean - pooled_mean[groups])
+    pooled_m2 = np.zeros_like(sums)
+    np.add.at(pooled_m2, groups, m2 + count[:, None] * delta * delta)
+    pooled_comoment = np.bincount(
+        groups, weights=comoment + count * delta[:, _HEART_RATE] * delta[:, _SYSTOLIC], minlength=size
+    )
+    return total, pooled_mean, pooled_m2, pooled_comoment
+
+
+class _MomentRing:
+    """Running moments per hour over a ring of hourly slots.
+
+    Each slot holds the count, mean and M2 (sum of squared deviations) of
+    every vital plus the heart rate/systolic co-moment for one clock hour.
+    New readings are merged into their hour's slot; a slot is reset when
+    its hour comes round again, which expires data older than the ring.
+    """
+
+    def __init__(self, hours: int):
+        self.hours = hours
+        vitals = len(STATS_VITALS)
+        self.slot_hour = np.full(hours, np.iinfo(np.int64).min, dtype=np.int64)
+        self.count = np.zeros(hours)
+        self.mean = np.zeros((hours, vitals))
+        self.m2 = np.zeros((hours, vitals))
+        self.comoment = np.zeros(hours)
+        self.elevated = np.zeros(hours)
+
+    def add(self, hour_ids: np.ndarray, values: np.ndarray):
+        # Only the newest ``hours`` hours of a batch fit in the ring
+        recent = hour_ids > hour_ids.max() - self.hours
+        hour_ids, values = hour_ids[recent], values[recent]
+        hours, inverse = np.unique(hour_ids, return_inverse=True)
+        slots = hours % self.hours
+
+        stale = self.slot_hour[slots] < hours
+        reset = slots[stale]
+        self.slot_hour[reset] = hours[stale]
+        for array in (self.count, self.mean, self.m2, self.comoment, self.elevated):
+            array[reset] = 0
+        # Readings for an hour whose slot already moved on have expired
+        live = self.slot_hour[slots] == hours
+        keep = live[inverse]
+        if not keep.all():
+            remap = np.cumsum(live) - 1
+            hours, slots, inverse, values = hours[live], slots[live], remap[inverse[keep]], values[keep]
+        if not len(hours):
+            return
+
+        # Two-pass moments of the batch per hour, then merged into the slots
+        batch_count = np.bincount(inverse, minlength=len(hours)).astype(np.float64)
+        batch_mean = np.zeros((len(hours), values.shape[1]))
+        np.add.at(batch_mean, inverse, values)
+        batch_mean /= batch_count[:, None]
+        centered = values - batch_mean[inverse]
+        batch_m2 = np.zeros_like(batch_mean)
+        np.add.at(batch_m2, inverse, centered * centered)
+        batch_comoment = np.bincount(
+            inverse, weights=centered[:, _HEART_RATE] * centered[:, _SYSTOLIC], minlength=len(hours)
+        )
+
+        count = self.count[slots]
+        total = count + batch_count
+        delta = batch_mean - self.mean[slots]
+        self.mean[slots] += delta * (batch_count / total)[:, None]
+        self.m2[slots] += batch_m2 + delta * delta * (count * batch_count / total)[:, None]
+        self.comoment[slots] += batch_comoment + delta[:, _HEART_RATE] * delta[:, _SYSTOLIC] * count * batch_count / total
+        self.count[slots] = total
+        self.elevated[slots] += np.bincount(
+            inverse, weights=values[:, _SYSTOLIC] >= ELEVATED_SYSTOLIC, minlength=len(hours)
+        )
+
+    def window(self, first_hour: int, last_hour: int) -> np.ndarray:
+        """Slots holding hours in [first_hour, last_hour]"""
+        return np.nonzero((self.slot_hour >= first_hour) & (self.slot_hour <= last_hour) & (self.count > 0))[0]
+
+
+class _PatientStats:
+    def __init__(self, hours: int):
+        self.hours = hours
+        self.all = _MomentRing(hours)
+        self.activities = {}  # activity code -> _MomentRing
+
+    def add(self, columns: Dict[str, np.ndarray]):
+        values = np.column_stack([columns[name] for name in STATS_VITALS]).astype(np.float64)
+        hour_ids = columns["timestamp"] // HOUR_MS
+        self.all.add(hour_ids, values)
+        activity = columns["activity"]
+        for code in np.unique(activity[activity != MISSING]).tolist():
+            ring = self.activities.get(code)
+            if ring is None:
+                ring = self.activities[code] = _MomentRing(self.hours)
+            mask = activity == code
+            ring.add(hour_ids[mask], values[mask])
+
+
+class VitalsPatternStats:
+    """Windowed running statistics of each patient's BP, kept up to date per reading.
+
+    A patient's state is built from the last ``window_days`` of the vitals
+    store on first use, then updated by the store's append listener, so a
+    pattern query merges at most ``window_days * 24`` hourly slots no matter
+    how many readings they hold. The window moves in whole hours.
+    """
+
+    def __init__(self, store: VitalsStore = vitals_store, window_days: int = WINDOW_DAYS,
+                 max_patients: int = CACHED_PATIENTS):
+        self.store = store
+        self.window_hours = window_days * 24
+        self.max_patients = max_patients
+        self._patients = OrderedDict()
+        self._lock = threading.Lock()
+        store.add_listener(self._on_append)
+
+    def _on_append(self, patient_id: str, batch: Dict[str, np.ndarray]):
+        with self._lock:
+            stats = self._patients.get(patient_id)
+        if stats is not None:
+            stats.add(batch)
+
+    def _stats(self, patient_id: str, now_hour: int, db: Optional[Session]):
+        patient_store = self.store.patient(patient_id, db)
+        with patient_store._lock:
+            with self._lock:
+                stats = self._patients.get(patient_id)
+                if stats is not None:
+                    self._patients.move_to_end(patient_id)
+                    return stats, patient_store
+            # One spare slot so the current, partial hour doesn't evict the oldest full one
+            stats = _PatientStats(self.window_hours + 1)
+            start_ms = (now_hour - self.window_hours) * HOUR_MS
+            for part in patient_store.scan_chunks(start_ms, np.iinfo(np.int64).max):
+                if len(part["timestamp"]):
+                    stats.add(part)
+            with self._lock:
+                self._patients[patient_id] = stats
+                while len(self._patients) > self.max_patients:
+                    self._patients.popitem(last=False)
+        return stats, patient_store
+
+    def patterns(self, patient_id: str, now: Optional[datetime] = None,
+                 db: Optional[Session] = None) -> Optional[Dict[str, Any]]:
+        """Moments over the window ending at ``now``: overall, per hour of day (UTC) and per activity.
+
+        The ring follows the newest readings, so ``now`` (default: the
+        current time) should not fall before them.
+        """
+        now_hour = int(np.datetime64(now or datetime.utcnow(), "ms").astype(np.int64)) // HOUR_MS
+        first_hour = now_hour - self.window_hours
+        stats, patient_store = self._stats(patient_id, now_hour, db)
+
+        with patient_store._lock:
+            ring = stats.all
+            slots = ring.window(first_hour, now_hour)
+            if not len(slots):
+                return None
+            slot_moments = (ring.count[slots], ring.mean[slots], ring.m2[slots], ring.comoment[slots])
+            overall = _combine(*slot_moments, np.zeros(len(slots), dtype=np.int64), 1)
+            hourly = _combine(*slot_moments, ring.slot_hour[slots] % 24, 24)
+            elevated = float(ring.elevated[slots].sum())
+
+            activity_names = list(patient_store._activities)
+            activities = {}
+            for code, activity_ring in stats.activities.items():
+                activity_slots = activity_ring.window(first_hour, now_hour)
+                if len(activity_slots):
+                    activities[activity_names[code]] = _combine(
+                        activity_ring.count[activity_slots], activity_ring.mean[activity_slots],
+                        activity_ring.m2[activity_slots], activity_ring.comoment[activity_slots],
+                        np.zeros(len(activity_slots), dtype=np.int64), 1
+                    )
+
+        count, mean, m2, comoment = (value[0] for value in overall)
+        correlation_denominator = np.sqrt(m2[_HEART_RATE] * m2[_SYSTOLIC])
+        return {
+            "count": int(count),
+            "mean": {name: float(mean[i]) for i, name in enumerate(STATS_VITALS)},
+            "std": {name: float(np.sqrt(m2[i] / count)) for i, name in enumerate(STATS_VITALS)},
+            "correlation_hr_systolic": float(comoment / correlation_denominator) if correlation_denominator else None,
+            "elevated_fraction": elevated / count,
+            "hourly": [
+                {
+                    "count": int(hourly[0][hour]),
+                    "mean": {name: float(hourly[1][hour, i]) for i, name in enumerate(STATS_VITALS)}
+                    if hourly[0][hour] else None
+                }
+                for hour in range(24)
+            ],
+            "activities": {
+                name: {
+                    "count": int(moments[0][0]),
+                    "mean": {vital: float(moments[1][0, i]) for i, vital in enumerate(STATS_VITALS)},
+                    # Sample standard deviation, undefined for a single reading
+                    "std": {
+                        vital: float(np.sqrt(moments[2][0, i] / (moments[0][0] - 1))) if moments[0][0] > 1 else None
+                        for i, vital in enumerate(STATS_VITALS)
+                    }
+                }
+                for name, moments in activities.items()
+            }
+        }
+
+    @staticmethod
+    def hours_mean(patterns: Dict[str, Any], hours, vital: str) -> Optional[float]:
+        """Mean of ``vital`` over a set of hours of day from ``patterns()['hourly']``"""
+        count = sum(patterns["hourly"][hour]["count"] for hour in hours)
+        if not count:
+            return None
+        return sum(
+            patterns["hourly"][hour]["mean"][vital] * patterns["hourly"][hour]["count"]
+            for hour in hours if patterns["hourly"][hour]["count"]
+        ) / count
+
+
+vitals_pattern_stats = VitalsPatternStats()
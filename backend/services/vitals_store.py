@@ -0,0 +1,522 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+import numpy as np
+from sqlalchemy.orm import Session
+from ..models.patient_vitals import VitalsReading
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where single-process use is unchecked
+    fcntl = None
+
+# Columnar vitals store configuration, overridable per deployment
+VITALS_STORE_DIR = os.getenv("AIMED_VITALS_STORE_DIR", "data/vitals")
+CHUNK_ROWS = int(os.getenv("AIMED_VITALS_CHUNK_ROWS", "4096"))
+DECODED_CHUNK_CACHE = int(os.getenv("AIMED_VITALS_DECODED_CHUNKS", "256"))
+HEAD_FLUSH_SECONDS = float(os.getenv("AIMED_VITALS_HEAD_FLUSH_SECONDS", "5"))
+
+MISSING = -1  # stored for an absent SpO2 value or activity
+
+# Column name -> stored dtype; timestamps are epoch milliseconds (UTC)
+COLUMNS = OrderedDict([
+    ("timestamp", np.dtype("<i8")),
+    ("systolic", np.dtype("<i2")),
+    ("diastolic", np.dtype("<i2")),
+    ("heart_rate", np.dtype("<i2")),
+    ("oxygen_saturation", np.dtype("<i2")),
+    ("activity", np.dtype("<i2")),  # index into the patient's activity vocabulary
+])
+
+_HEAD_FILE = "head.bin"
+_ACTIVITIES_FILE = "activities.json"
+_ARCHIVE_FILE = "archive.json"  # how far back the blob archive has been merged in
+_LOCK_FILE = ".lock"
+_CHUNK_SUFFIX = ".chunk"
+_CHUNK_MAGIC = b"AVS1"
+_HEADER = struct.Struct("<4sI")  # magic, rows
+_COLUMN_HEADER = struct.Struct("<BqI")  # delta dtype code, base value, compressed bytes
+_DELTA_DTYPES = (np.dtype("<i1"), np.dtype("<i2"), np.dtype("<i4"), np.dtype("<i8"))
+
+
+def to_epoch_ms(timestamps: Sequence) -> np.ndarray:
+    """datetimes or ISO strings (naive UTC) to int64 epoch milliseconds"""
+    return np.array([np.datetime64(t, "ms") for t in timestamps], dtype="datetime64[ms]").astype(np.int64)
+
+
+def _optional(values: Sequence, size: int) -> np.ndarray:
+    if values is None:
+        return np.full(size, MISSING, dtype=np.int16)
+    return np.array([MISSING if v is None else v for v in values], dtype=np.int16)
+
+
+class VitalsSeries(NamedTuple):
+    """Index-aligned vitals columns for one patient, sorted by timestamp"""
+    timestamp: np.ndarray
+    systolic: np.ndarray
+    diastolic: np.ndarray
+    heart_rate: np.ndarray
+    oxygen_saturation: np.ndarray
+    activity: np.ndarray
+    activities: List[str]  # vocabulary for the activity codes
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+
+def _encode_chunk(columns: Dict[str, np.ndarray]) -> bytes:
+    """Delta-encode each column into the narrowest integer type, then compress it"""
+    rows = len(columns["timestamp"])
+    parts = [_HEADER.pack(_CHUNK_MAGIC, rows)]
+    for name in COLUMNS:
+        values = columns[name].astype(np.int64)
+        deltas = np.diff(values, prepend=values[:1])
+        largest = int(np.abs(deltas).max()) if rows else 0
+        code = next(i for i, dtype in enumerate(_DELTA_DTYPES) if largest <= np.iinfo(dtype).max)
+        payload = zlib.compress(deltas.astype(_DELTA_DTYPES[code]).tobytes(), 6)
+        parts.append(_COLUMN_HEADER.pack(code, int(values[0]) if rows else 0, len(payload)))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def _decode_chunk(buffer) -> Dict[str, np.ndarray]:
+    magic, rows = _HEADER.unpack_from(buffer, 0)
+    if magic != _CHUNK_MAGIC:
+        raise ValueError("Not a vitals chunk")
+    offset = _HEADER.size
+    columns = {}
+    for name, dtype in COLUMNS.items():
+        code, base, size = _COLUMN_HEADER.unpack_from(buffer, offset)
+        offset += _COLUMN_HEADER.size
+        deltas = np.frombuffer(zlib.decompress(buffer[offset:offset + size]), dtype=_DELTA_DTYPES[code])
+        offset += size
+        columns[name] = (np.cumsum(deltas, dtype=np.int64) + base).astype(dtype)
+    return columns
+
+
+class PatientVitalsStore:
+    """One patient's vitals as columnar chunks on disk.
+
+    New readings go to a fixed-capacity head file that is memory-mapped
+    and written in place, one contiguous region per column. When the head
+    fills up it is sorted and sealed into an immutable chunk file: each
+    column delta-encoded to the narrowest integer type and zlib-compressed.
+    Chunk files are named by their time range, so a range scan opens only
+    the chunks that overlap it. Head writes reach the OS page cache at
+    once and are synced to disk on sealing and at most every
+    ``flush_seconds``, so only a machine crash can lose that window.
+    """
+
+    def __init__(self, path: str, chunk_rows: int = CHUNK_ROWS, decoded_cache: Optional['_ChunkCache'] = None,
+                 on_append: Optional[Callable[[Dict[str, np.ndarray]], None]] = None,
+                 flush_seconds: float = HEAD_FLUSH_SECONDS):
+        self.path = path
+        self.chunk_rows = max(1, chunk_rows)
+        self.flush_seconds = flush_seconds
+        self._flushed = time.monotonic()
+        self.decoded_cache = decoded_cache or _ChunkCache(DECODED_CHUNK_CACHE)
+        self.on_append = on_append  # called with each appended batch, under the store lock
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._activities = self._load_activities()
+        self._chunks = self._load_chunks()  # sorted (first_ms, last_ms, filename)
+        self._head = None
+        self._head_columns = None
+        self._open_head()
+
+    # Appending
+
+    def append(self, timestamps: np.ndarray, systolic: Sequence[int], diastolic: Sequence[int],
+               heart_rate: Sequence[int], oxygen_saturation: Optional[Sequence] = None,
+               activity: Optional[Sequence[Optional[str]]] = None):
+        """Append readings; ``timestamps`` are epoch milliseconds, in any order"""
+        size = len(timestamps)
+        if not size:
+            return
+        with self._lock:
+            batch = {
+                "timestamp": np.asarray(timestamps, dtype=np.int64),
+                "systolic": np.asarray(systolic, dtype=np.int16),
+                "diastolic": np.asarray(diastolic, dtype=np.int16),
+                "heart_rate": np.asarray(heart_rate, dtype=np.int16),
+                "oxygen_saturation": _optional(oxygen_saturation, size),
+                "activity": self._activity_codes(activity, size),
+            }
+            start = 0
+            while start < size:
+                count = self._head_count()
+                take = min(self.chunk_rows - count, size - start)
+                in_order = not count or batch["timestamp"][start] >= self._head_columns["timestamp"][count - 1]
+                for name in COLUMNS:
+                    self._head_columns[name][count:count + take] = batch[name][start:start + take]
+                if not in_order or not np.all(np.diff(batch["timestamp"][start:start + take]) >= 0):
+                    self._sort_head(count + take)
+                self._set_head_count(count + take)
+                start += take
+                if count + take == self.chunk_rows:
+                    self._seal_head()
+            if time.monotonic() - self._flushed >= self.flush_seconds:
+                self.flush()
+            if self.on_append is not None:
+                self.on_append(batch)
+
+    def flush(self):
+        """Sync the head file to disk"""
+        with self._lock:
+            self._head.flush()
+            self._flushed = time.monotonic()
+
+    def merge(self, timestamps: np.ndarray, systolic: Sequence[int], diastolic: Sequence[int],
+              heart_rate: Sequence[int], oxygen_saturation: Optional[Sequence] = None,
+              activity: Optional[Sequence[Optional[str]]] = None) -> int:
+        """``append`` only the readings whose timestamps the store doesn't hold yet; returns how many"""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if not len(timestamps):
+            return 0
+        with self._lock:
+            held = [part["timestamp"] for part in self.scan_chunks(int(timestamps.min()), int(timestamps.max()))]
+            new = ~np.isin(timestamps, np.concatenate(held)) if held else np.ones(len(timestamps), dtype=bool)
+            if new.any():
+                rows = np.nonzero(new)[0].tolist()
+                self.append(
+                    timestamps[new], [systolic[row] for row in rows], [diastolic[row] for row in rows],
+                    [heart_rate[row] for row in rows],
+                    None if oxygen_saturation is None else [oxygen_saturation[row] for row in rows],
+                    None if activity is None else [activity[row] for row in rows]
+                )
+        return int(np.count_nonzero(new))
+
+    @property
+    def archive_merged_from(self) -> Optional[int]:
+        """Epoch ms from which archived readings have been merged in, or None if never"""
+        try:
+            with open(os.path.join(self.path, _ARCHIVE_FILE), "r") as f:
+                return json.load(f)["merged_from"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @archive_merged_from.setter
+    def archive_merged_from(self, ms: int):
+        self._write_json(_ARCHIVE_FILE, {"merged_from": int(ms)})
+
+    def _activity_codes(self, activity: Optional[Sequence[Optional[str]]], size: int) -> np.ndarray:
+        if activity is None:
+            return np.full(size, MISSING, dtype=np.int16)
+        codes = {name: code for code, name in enumerate(self._activities)}
+        added = False
+        for name in set(activity):
+            if name is not None and name not in codes:
+                codes[name] = len(self._activities)
+                self._activities.append(name)
+                added = True
+        if added:
+            self._write_json(_ACTIVITIES_FILE, self._activities)
+        return np.array([MISSING if name is None else codes[name] for name in activity], dtype=np.int16)
+
+    # Scanning
+
+    def scan_chunks(self, start_ms: int, end_ms: int) -> Iterator[Dict[str, np.ndarray]]:
+        """Per-chunk column slices within [start_ms, end_ms], without copying.
+
+        Slices of the head are views into the memory-mapped file and are
+        only valid until the next append; use ``scan`` to keep results.
+        """
+        with self._lock:
+            chunks = [name for first, last, name in self._chunks if first <= end_ms and last >= start_ms]
+            count = self._head_count()
+            head = {name: column[:count] for name, column in self._head_columns.items()}
+        for name in chunks:
+            yield self._slice(self._decoded(name), start_ms, end_ms)
+        if count:
+            yield self._slice(head, start_ms, end_ms)
+
+    def scan(self, start: datetime, end: datetime) -> VitalsSeries:
+        """All readings in [start, end] as contiguous arrays, sorted by time"""
+        start_ms, end_ms = (int(np.datetime64(t, "ms").astype(np.int64)) for t in (start, end))
+        with self._lock:
+            parts = [part for part in self.scan_chunks(start_ms, end_ms) if len(part["timestamp"])]
+            columns = {
+                name: np.concatenate([part[name] for part in parts]) if parts else np.empty(0, dtype=dtype)
+                for name, dtype in COLUMNS.items()
+            }
+            activities = list(self._activities)
+        if len(parts) > 1 and np.any(np.diff(columns["timestamp"]) < 0):
+            # Late readings can land in a newer chunk than their neighbours
+            order = np.argsort(columns["timestamp"], kind="stable")
+            columns = {name: column[order] for name, column in columns.items()}
+        return VitalsSeries(activities=activities, **columns)
+
+    @staticmethod
+    def _slice(columns: Dict[str, np.ndarray], start_ms: int, end_ms: int) -> Dict[str, np.ndarray]:
+        timestamps = columns["timestamp"]
+        lo = np.searchsorted(timestamps, start_ms, side="left")
+        hi = np.searchsorted(timestamps, end_ms, side="right")
+        return {name: column[lo:hi] for name, column in columns.items()}
+
+    def _decoded(self, filename: str) -> Dict[str, np.ndarray]:
+        path = os.path.join(self.path, filename)
+        columns = self.decoded_cache.get(path)
+        if columns is None:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                columns = _decode_chunk(mapped)
+            for column in columns.values():
+                column.flags.writeable = False  # shared between callers
+            self.decoded_cache.put(path, columns)
+        return columns
+
+    # Head file: an int64 row count, then one region of ``chunk_rows`` values per column
+
+    def _open_head(self):
+        path = os.path.join(self.path, _HEAD_FILE)
+        size = 8 + sum(dtype.itemsize for dtype in COLUMNS.values()) * self.chunk_rows
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            if os.path.exists(path):
+                self._recover_head(path)
+            with open(path, "wb") as f:
+                f.truncate(size)
+        self._head = np.memmap(path, dtype=np.uint8, mode="r+", shape=(size,))
+        self._head_columns = {}
+        offset = 8
+        for name, dtype in COLUMNS.items():
+            self._head_columns[name] = self._head[offset:offset + dtype.itemsize * self.chunk_rows].view(dtype)
+            offset += dtype.itemsize * self.chunk_rows
+
+    def _recover_head(self, path: str):
+        """Seal a head written with a different chunk size before replacing it"""
+        with open(path, "rb") as f:
+            data = f.read()
+        count = int(np.frombuffer(data[:8], dtype=np.int64)[0]) if len(data) >= 8 else 0
+        capacity = (len(data) - 8) // sum(dtype.itemsize for dtype in COLUMNS.values())
+        if not count or count > capacity:
+            return
+        columns, offset = {}, 8
+        for name, dtype in COLUMNS.items():
+            columns[name] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += dtype.itemsize * capacity
+        self._write_chunk(columns)
+
+    def _head_count(self) -> int:
+        return int(self._head[:8].view(np.int64)[0])
+
+    def _set_head_count(self, count: int):
+        self._head[:8].view(np.int64)[0] = count
+
+    def _sort_head(self, count: int):
+        order = np.argsort(self._head_columns["timestamp"][:count], kind="stable")
+        for column in self._head_columns.values():
+            column[:count] = column[:count][order]
+
+    def _seal_head(self):
+        count = self._head_count()
+        if not count:
+            return
+        # Copy out first: scan_chunks() callers may still hold views of the head
+        self._write_chunk({name: np.array(column[:count]) for name, column in self._head_columns.items()})
+        self._set_head_count(0)
+        self.flush()  # so a restart doesn't find the sealed rows in the head as well
+
+    def _write_chunk(self, columns: Dict[str, np.ndarray]):
+        first, last = int(columns["timestamp"][0]), int(columns["timestamp"][-1])
+        filename = f"{first:016d}-{last:016d}-{len(self._chunks):06d}{_CHUNK_SUFFIX}"
+        temp_path = os.path.join(self.path, filename + ".tmp")
+        with open(temp_path, "wb") as f:
+            f.write(_encode_chunk(columns))
+        os.replace(temp_path, os.path.join(self.path, filename))
+        self._chunks.append((first, last, filename))
+        self._chunks.sort()
+
+    def _load_chunks(self) -> List[tuple]:
+        chunks = []
+        for filename in os.listdir(self.path):
+            if filename.endswith(_CHUNK_SUFFIX):
+                first, last, _ = filename[:-len(_CHUNK_SUFFIX)].split("-")
+                chunks.append((int(first), int(last), filename))
+        return sorted(chunks)
+
+    def _load_activities(self) -> List[str]:
+        try:
+            with open(os.path.join(self.path, _ACTIVITIES_FILE), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _write_json(self, filename: str, value):
+        temp_path = os.path.join(self.path, filename + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(value, f)
+        os.replace(temp_path, os.path.join(self.path, filename))
+
+
+class _ChunkCache:
+    """LRU of decoded chunk columns, shared by all patients"""
+
+    def __init__(self, max_chunks: int):
+        self.max_chunks = max_chunks
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        with self._lock:
+            columns = self._entries.get(key)
+            if columns is not None:
+                self._entries.move_to_end(key)
+            return columns
+
+    def put(self, key: str, columns: Dict[str, np.ndarray]):
+        with self._lock:
+            self._entries[key] = columns
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_chunks:
+                self._entries.popitem(last=False)
+
+
+class VitalsStore:
+    """Per-patient columnar vitals stores under one directory.
+
+    A patient's store is created on first use and, when a session is
+    given, backfilled from ``VitalsReading`` so it starts complete. After
+    that every ingest path appends to it alongside the database, and
+    ``reconcile`` merges in any rows the two have diverged on. Listeners
+    (e.g. rollups) see every appended batch.
+
+    The store is written in place without cross-process coordination,
+    so one process owns the directory: it takes an exclusive lock on it
+    at first use, and a second process fails instead of corrupting it.
+    Serve the backend from a single worker process; per-worker
+    directories would each hold only the readings that worker ingested.
+    """
+
+    def __init__(self, root: str = VITALS_STORE_DIR, chunk_rows: int = CHUNK_ROWS):
+        self.root = root
+        self.chunk_rows = chunk_rows
+        self.decoded_cache = _ChunkCache(DECODED_CHUNK_CACHE)
+        self._patients = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._lock_file = None
+
+    def add_listener(self, listener: Callable[[str, Dict[str, np.ndarray]], None]):
+        self._listeners.append(listener)
+
+    def _notify(self, patient_id: str, batch: Dict[str, np.ndarray]):
+        for listener in self._listeners:
+            try:
+                listener(patient_id, batch)
+            except Exception as e:
+                print(f"Error in vitals store listener: {str(e)}")
+
+    def patient(self, patient_id: str, db: Optional[Session] = None) -> PatientVitalsStore:
+        with self._lock:
+            store = self._patients.get(patient_id)
+            if store is not None:
+                return store
+            self._acquire()
+            path = os.path.join(self.root, str(patient_id))
+            is_new = not os.path.isdir(path)
+            store = PatientVitalsStore(
+                path, self.chunk_rows, self.decoded_cache,
+                on_append=lambda batch: self._notify(patient_id, batch)
+            )
+            if is_new and db is not None:
+                self._backfill(store, patient_id, db)
+            self._patients[patient_id] = store
+            return store
+
+    def reconcile(self, patient_id: str, db: Session) -> int:
+        """Merge in ``VitalsReading`` rows the store is missing, e.g. after a failed append; returns how many"""
+        rows = self._readings(patient_id, db)
+        if not rows:
+            return 0
+        timestamps, systolic, diastolic, heart_rate, oxygen_saturation, activity = zip(*rows)
+        return self.patient(patient_id, db).merge(
+            to_epoch_ms(timestamps), systolic, diastolic, heart_rate, oxygen_saturation, activity
+        )
+
+    def flush(self):
+        with self._lock:
+            stores = list(self._patients.values())
+        for store in stores:
+            store.flush()
+
+    def close(self):
+        """Flush every patient and give up the directory, e.g. for another process to take over"""
+        self.flush()
+        with self._lock:
+            self._patients = {}
+            if self._lock_file is not None:
+                self._lock_file.close()  # releases the flock
+                self._lock_file = None
+
+    def _acquire(self):
+        if self._lock_file is not None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        lock_file = open(os.path.join(self.root, _LOCK_FILE), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise RuntimeError(
+                    f"Vitals store {self.root} is in use by another process; "
+                    "run a single worker or give each instance its own AIMED_VITALS_STORE_DIR"
+                )
+        self._lock_file = lock_file
+
+    def append_columns(self, patient_id: str, columns: Dict[str, list], db: Optional[Session] = None):
+        """Append a bulk-ingest column dict (see ``vitals_ingest``)"""
+        self.patient(patient_id, db).append(
+            to_epoch_ms(columns["timestamp"]), columns["systolic"], columns["diastolic"],
+            columns["heart_rate"], columns.get("oxygen_saturation"), columns.get("activity_type")
+        )
+
+    def merge_readings(self, patient_id: str, readings: Sequence[Dict], db: Optional[Session] = None) -> int:
+        """Merge live reading dicts (e.g. from the blob archive) the store doesn't hold yet"""
+        return self.patient(patient_id, db).merge(
+            to_epoch_ms([reading["timestamp"] for reading in readings]),
+            [reading["systolic"] for reading in readings], [reading["diastolic"] for reading in readings],
+            [reading["heart_rate"] for reading in readings],
+            [reading.get("oxygen_saturation") for reading in readings],
+            [reading.get("activity_type") for reading in readings]
+        )
+
+    def append_reading(self, patient_id: str, reading: Dict, db: Optional[Session] = None):
+        """Append one live reading dict (device twin shape)"""
+        self.append_columns(patient_id, {
+            "timestamp": [reading["timestamp"]],
+            "systolic": [reading["systolic"]],
+            "diastolic": [reading["diastolic"]],
+            "heart_rate": [reading["heart_rate"]],
+            "oxygen_saturation": [reading.get("oxygen_saturation")],
+            "activity_type": [reading.get("activity_type")],
+        }, db)
+
+    def scan(self, patient_id: str, start: datetime, end: datetime, db: Optional[Session] = None) -> VitalsSeries:
+        return self.patient(patient_id, db).scan(start, end)
+
+    @staticmethod
+    def _readings(patient_id: str, db: Session) -> List[tuple]:
+        return db.query(
+            VitalsReading.timestamp, VitalsReading.systolic, VitalsReading.diastolic, VitalsReading.heart_rate,
+            VitalsReading.oxygen_saturation, VitalsReading.activity_type
+        ).filter(
+            VitalsReading.patient_id == patient_id,
+            VitalsReading.timestamp.isnot(None)
+        ).order_by(VitalsReading.timestamp).all()
+
+    @classmethod
+    def _backfill(cls, store: PatientVitalsStore, patient_id: str, db: Session):
+        rows = cls._readings(patient_id, db)
+        if rows:
+            timestamps, systolic, diastolic, heart_rate, oxygen_saturation, activity = zip(*rows)
+            store.append(to_epoch_ms(timestamps), systolic, diastolic, heart_rate, oxygen_saturation, activity)
+
+
+vitals_store = VitalsStore()
@@ -0,0 +1,188 @@
+import struct
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from ..models.patient_vitals import VITALS_COLUMNS
+from .vitals_store import MISSING
+
+# Content type of the binary format for HTTP uploads, and the WebSocket subprotocol selecting it
+VITALS_MEDIA_TYPE = "application/vnd.aimed.vitals"
+WEBSOCKET_SUBPROTOCOL = "aimed.vitals.v1"
+
+# A message is a header, the device id, a vocabulary of the activity and location strings
+# (length-prefixed UTF-8), then one fixed-width row per reading, oldest first. Each row
+# stores its time as whole milliseconds after the previous reading (the first after the
+# header's base time) plus the microseconds within that millisecond, so every field of
+# VITALS_COLUMNS round-trips exactly. Absent integers are MISSING, absent floats NaN.
+# Vitals are stored as they are rather than as deltas: a fixed-width row gains nothing
+# from small differences, and keeping rows fixed-width lets the decoder read them in place.
+_MAGIC = b"AVW1"
+_HEADER = struct.Struct("<4sHHIq")  # magic, device id bytes, vocabulary entries, rows, base time (epoch ms)
+_STRING_LENGTH = struct.Struct("<H")
+_ROW = np.dtype([
+    ("timestamp_delta", "<u4"),
+    ("timestamp_us", "<u2"),
+    ("systolic", "<i2"),
+    ("diastolic", "<i2"),
+    ("heart_rate", "<i2"),
+    ("oxygen_saturation", "<i2"),
+    ("steps_count", "<i4"),
+    ("temperature", "<f8"),
+    ("ambient_temperature", "<f8"),
+    ("activity_type", "<i2"),  # index into the vocabulary, MISSING if none
+    ("location", "<i2"),
+])
+_INTEGER_FIELDS = ("systolic", "diastolic", "heart_rate", "oxygen_saturation", "steps_count")
+_FLOAT_FIELDS = ("temperature", "ambient_temperature")
+_STRING_FIELDS = ("activity_type", "location")
+_MAX_VOCABULARY = np.iinfo(np.int16).max
+_UPLOAD_REQUIRED = ("systolic", "diastolic", "heart_rate")
+
+
+class WireFormatError(ValueError):
+    """A payload is not a valid binary vitals message"""
+
+
+def _epoch_us(timestamps: Sequence) -> np.ndarray:
+    """datetimes or ISO strings (naive UTC) to int64 epoch microseconds"""
+    return np.array([np.datetime64(t, "us") for t in timestamps], dtype="datetime64[us]").astype(np.int64)
+
+
+def _column(columns: Dict[str, list], name: str, size: int):
+    # Columns may be numpy arrays, whose truth value is ambiguous
+    values = columns.get(name)
+    return [None] * size if values is None else values
+
+
+def encode_columns(columns: Dict[str, list], device_id: Optional[str] = None) -> bytes:
+    """Encode index-aligned columns (see ``vitals_ingest``); rows are written in time order"""
+    size = len(columns["timestamp"])
+    micros = _epoch_us(columns["timestamp"]) if size else np.empty(0, dtype=np.int64)
+    order = np.argsort(micros, kind="stable")
+    micros = micros[order]
+    millis = micros // 1000
+    base = int(millis[0]) if size else 0
+    deltas = np.diff(millis, prepend=base)
+    if size and deltas.max() > np.iinfo(np.uint32).max:
+        raise WireFormatError("Readings more than 49 days apart must be sent separately")
+
+    rows = np.empty(size, dtype=_ROW)
+    rows["timestamp_delta"] = deltas
+    rows["timestamp_us"] = micros % 1000
+    try:
+        for name in _INTEGER_FIELDS:
+            values = _column(columns, name, size)
+            rows[name] = np.array([MISSING if v is None else v for v in values], dtype=_ROW[name])[order]
+    except OverflowError as e:
+        raise WireFormatError(f"Value out of range: {str(e)}")
+    for name in _FLOAT_FIELDS:
+        values = _column(columns, name, size)
+        rows[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)[order]
+
+    vocabulary = {}
+    for name in _STRING_FIELDS:
+        values = _column(columns, name, size)
+        codes = np.array([
+            MISSING if value is None else vocabulary.setdefault(value, len(vocabulary)) for value in values
+        ], dtype=np.int64)
+        if len(vocabulary) > _MAX_VOCABULARY:
+            raise WireFormatError(f"At most {_MAX_VOCABULARY} distinct activities and locations per message")
+        rows[name] = codes[order]
+
+    device = (device_id or "").encode()
+    parts = [_HEADER.pack(_MAGIC, len(device), len(vocabulary), size, base), device]
+    for value in vocabulary:
+        encoded = value.encode()
+        if len(encoded) > np.iinfo(np.uint16).max:
+            raise WireFormatError("Activity and location names are limited to 65535 bytes")
+        parts.append(_STRING_LENGTH.pack(len(encoded)) + encoded)
+    parts.append(rows.tobytes())
+    return b"".join(parts)
+
+
+def decode_columns(data: bytes) -> Dict[str, list]:
+    """Columns in the bulk-ingest shape (absent fields are None), plus a per-row device_id column"""
+    device_id, micros, rows, vocabulary = _decode(data)
+    size = len(rows)
+    columns = {"timestamp": micros.astype("datetime64[us]").astype(datetime).tolist()}
+    for name in _INTEGER_FIELDS:
+        columns[name] = [None if v == MISSING else v for v in rows[name].tolist()]
+    for name in _FLOAT_FIELDS:
+        columns[name] = [None if v != v else v for v in rows[name].tolist()]
+    for name in _STRING_FIELDS:
+        columns[name] = [None if code == MISSING else vocabulary[code] for code in rows[name].tolist()]
+    columns = {name: columns[name] for name in VITALS_COLUMNS}
+    columns["device_id"] = [device_id] * size
+    return columns
+
+
+def decode_upload(data: bytes) -> Dict[str, list]:
+    """``decode_columns`` for a device upload, which must carry what the JSON upload models require"""
+    columns = decode_columns(data)
+    if columns["timestamp"] and columns["device_id"][0] is None:
+        raise WireFormatError("Uploads must name their device")
+    for name in _UPLOAD_REQUIRED:
+        if None in columns[name]:
+            raise WireFormatError(f"Every reading needs {name}")
+    return columns
+
+
+def encode_readings(readings: Sequence[Dict[str, Any]], device_id: Optional[str] = None) -> bytes:
+    """Encode live reading dicts (device twin shape)"""
+    return encode_columns({
+        name: [reading.get(name) for reading in readings] for name in VITALS_COLUMNS
+    }, device_id)
+
+
+def decode_readings(data: bytes) -> List[Dict[str, Any]]:
+    """Reading dicts with ISO timestamps; optional fields only where present"""
+    columns = decode_columns(data)
+    readings = []
+    for i, timestamp in enumerate(columns["timestamp"]):
+        reading = {
+            "timestamp": timestamp.isoformat(),
+            "systolic": columns["systolic"][i],
+            "diastolic": columns["diastolic"][i],
+            "heart_rate": columns["heart_rate"][i],
+        }
+        for name in VITALS_COLUMNS[4:]:
+            if columns[name][i] is not None:
+                reading[name] = columns[name][i]
+        readings.append(reading)
+    return readings
+
+
+def is_wire_format(data: bytes) -> bool:
+    return data[:len(_MAGIC)] == _MAGIC
+
+
+def _decode(data: bytes):
+    view = memoryview(data)
+    try:
+        magic, device_length, vocabulary_size, size, base = _HEADER.unpack_from(view)
+    except struct.error:
+        raise WireFormatError("Truncated header")
+    if magic != _MAGIC:
+        raise WireFormatError("Not a binary vitals message")
+    offset = _HEADER.size
+    try:
+        device_id = bytes(view[offset:offset + device_length]).decode()
+        offset += device_length
+        vocabulary = []
+        for _ in range(vocabulary_size):
+            (length,) = _STRING_LENGTH.unpack_from(view, offset)
+            offset += _STRING_LENGTH.size
+            vocabulary.append(bytes(view[offset:offset + length]).decode())
+            offset += length
+    except (struct.error, UnicodeDecodeError):
+        raise WireFormatError("Malformed device id or vocabulary")
+    if len(view) - offset != size * _ROW.itemsize:
+        raise WireFormatError(f"Expected {size} readings of {_ROW.itemsize} bytes")
+    rows = np.frombuffer(view, dtype=_ROW, count=size, offset=offset)
+    for name in _STRING_FIELDS:
+        if len(rows) and (rows[name].max() >= len(vocabulary) or rows[name].min() < MISSING):
+            raise WireFormatError(f"{name} index outside the vocabulary")
+    if len(rows) and rows["timestamp_us"].max() >= 1000:
+        raise WireFormatError("Sub-millisecond time out of range")
+    millis = base + np.cumsum(rows["timestamp_delta"], dtype=np.int64)
+    return device_id or None, millis * 1000 + rows["timestamp_us"], rows, vocabulary
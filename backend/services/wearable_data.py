@@ -1,4 +1,3 @@
-from azure.storage.blob import BlobServiceClient
 from azure.iot.hub import IoTHubRegistryManager
 from azure.iot.hub.models import Twin, TwinProperties
 from typing import Dict, List, Any
@@ -8,28 +7,91 @@ import asyncio
 from fastapi import WebSocket
 import os
 from sqlalchemy.orm import Session
-from ..models.patient_vitals import PatientVitalsThreshold, VitalsReading, DEFAULT_THRESHOLDS
-import numpy as np
-from scipy import stats
-import pandas as pd
+from ..database.db import SessionLocal
+from .device_hub import DeviceHub
+from .device_twins import default_twin_source, device_id_for, user_id_for
+from .vitals_archive import VitalsArchive, default_blob_store
+from .vitals_store import vitals_store, to_epoch_ms
+from .vitals_rollups import vitals_rollups
+from .vitals_stats import vitals_pattern_stats
+from .threshold_resolver import threshold_resolver
+from .alert_engine import alert_engine
+from .vitals_anomaly import vitals_anomaly
+from .vitals_wire import WEBSOCKET_SUBPROTOCOL, encode_readings
+
+# Hours of day (UTC) for time-of-day patterns
+NIGHT_HOURS = range(0, 6)
+MORNING_HOURS = range(6, 12)
+EVENING_HOURS = range(17, 23)
+
+# Process-wide live monitoring hub and wearable-data container, shared by all requests
+_device_hub = None
+_blob_store = None
+_archive = None
+
+def get_blob_store():
+    """Shared wearable-data container client (Blob Storage or the local stand-in)"""
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = default_blob_store()
+    return _blob_store
+
+def get_archive() -> VitalsArchive:
+    """Shared archive, so live readings of a patient are buffered into the same segments"""
+    global _archive
+    if _archive is None:
+        _archive = VitalsArchive(get_blob_store())
+    return _archive
+
+def get_device_hub() -> DeviceHub:
+    """The shared hub, created on first use inside the running event loop"""
+    global _device_hub
+    if _device_hub is None:
+        twin_source = default_twin_source()
+        _device_hub = DeviceHub(twin_source.get_vitals, on_reading=_handle_live_reading)
+    return _device_hub
+
+async def _handle_live_reading(device_id: str, bp_data: Dict[str, Any]):
+    """Archive and check each new live reading once, however many viewers are connected"""
+    db = SessionLocal()
+    try:
+        service = WearableDataService(db)
+        await service.archive.write_reading(user_id_for(device_id), bp_data)
+        # Off the loop: seeding a first-seen patient, sealing a chunk or backfilling can all take a while
+        anomalies = await asyncio.to_thread(_score_and_store, user_id_for(device_id), bp_data, db)
+        # Abnormal readings open or extend an alert episode; a normal one ends it
+        await alert_engine.observe(user_id_for(device_id), bp_data, anomalies.details(0))
+    finally:
+        db.close()
+
+def _score_and_store(user_id: str, bp_data: Dict[str, Any], db: Session):
+    # Scored against the patient's baseline before it joins the store the baseline is seeded from
+    anomalies = vitals_anomaly.observe_reading(user_id, bp_data, db)
+    vitals_store.append_reading(user_id, bp_data, db)
+    return anomalies
 
 class WearableDataService:
     def __init__(self, db: Session):
-        # Azure IoT Hub connection
+        # Azure IoT Hub connection, created on first use
         self.iothub_connection_str = os.getenv("AZURE_IOTHUB_CONNECTION_STRING")
-        self.registry_manager = IoTHubRegistryManager(self.iothub_connection_str)
+        self._registry_manager = None
         self.db = db
 
-        # Azure Blob Storage for historical data
-        self.blob_connection_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
-        self.blob_service_client = BlobServiceClient.from_connection_string(self.blob_connection_str)
-        self.container_name = "wearable-data"
+        # Azure Blob Storage for historical data, date-partitioned per user
+        self.blob_store = get_blob_store()
+        self.archive = get_archive()
+
+    @property
+    def registry_manager(self) -> IoTHubRegistryManager:
+        if self._registry_manager is None:
+            self._registry_manager = IoTHubRegistryManager(self.iothub_connection_str)
+        return self._registry_manager
 
     async def register_device(self, user_id: str, device_info: Dict[str, Any]) -> str:
         """Register an Apple Watch device with Azure IoT Hub"""
         try:
             # Create device identity
-            device_id = f"apple-watch-{user_id}"
+            device_id = device_id_for(user_id)
             device = self.registry_manager.create_device_with_sas(device_id)
 
             # Store device info in blob storage
@@ -38,11 +100,7 @@ class WearableDataService:
                 "user_id": user_id
             })
             
-            blob_client = self.blob_service_client.get_blob_client(
-                container=self.container_name,
-                blob=f"devices/{device_id}/info.json"
-            )
-            blob_client.upload_blob(json.dumps(device_info))
+            await self.blob_store.upload(f"devices/{device_id}/info.json", json.dumps(device_info).encode())
 
             return device.authentication.symmetric_key.primary_key
         except Exception as e:
@@ -52,231 +110,98 @@ class WearableDataService:
     async def get_live_bp_data(self, user_id: str) -> Dict[str, Any]:
         """Get live blood pressure data from Apple Watch"""
         try:
-            device_id = f"apple-watch-{user_id}"
-            twin = self.registry_manager.get_twin(device_id)
-            
-            # Get latest BP reading from device twin
-            reported_properties = twin.properties.reported
-            if "vitals" in reported_properties:
-                return {
-                    "systolic": reported_properties["vitals"]["bp_systolic"],
-                    "diastolic": reported_properties["vitals"]["bp_diastolic"],
-                    "timestamp": reported_properties["vitals"]["timestamp"],
-                    "heart_rate": reported_properties["vitals"]["heart_rate"]
-                }
-            return None
+            # Latest BP reading from the device twin, fetched off the event loop
+            return await get_device_hub().fetch(device_id_for(user_id))
         except Exception as e:
             print(f"Error getting BP data: {str(e)}")
             raise
 
     async def start_bp_monitoring(self, user_id: str, websocket: WebSocket):
-        """Start real-time BP monitoring through WebSocket"""
+        """Start real-time BP monitoring through WebSocket
+
+        The socket subscribes to the shared device hub: one poller per device
+        serves all viewers, and abnormal readings are handled once by the hub
+        rather than once per socket.
+        """
+        subscription = None
         try:
-            device_id = f"apple-watch-{user_id}"
-            await websocket.accept()
-
-            while True:
-                # Get latest BP data
-                bp_data = await self.get_live_bp_data(user_id)
-                if bp_data:
-                    # Send data through WebSocket
+            # Clients offering the binary subprotocol get one compact frame per reading instead of JSON
+            binary = WEBSOCKET_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+            await websocket.accept(subprotocol=WEBSOCKET_SUBPROTOCOL if binary else None)
+            subscription = get_device_hub().subscribe(device_id_for(user_id))
+
+            async for bp_data in subscription:
+                if binary:
+                    await websocket.send_bytes(encode_readings([bp_data]))
+                else:
                     await websocket.send_json(bp_data)
 
-                # Check for abnormal readings
-                if bp_data and self._is_bp_abnormal(bp_data):
-                    await self._handle_abnormal_bp(user_id, bp_data)
-
-                # Wait for 30 seconds before next reading
-                await asyncio.sleep(30)
+            if subscription.dropped:
+                # Fell too far behind; the client should reconnect
+                await websocket.close(code=1013)
 
         except Exception as e:
             print(f"Error in BP monitoring: {str(e)}")
             if websocket.client_state.CONNECTED:
                 await websocket.close()
-
-    def _is_bp_abnormal(self, bp_data: Dict[str, Any]) -> bool:
-        """Check if BP reading is abnormal"""
-        systolic = bp_data["systolic"]
-        diastolic = bp_data["diastolic"]
-
-        # Define BP thresholds
-        if systolic > 140 or systolic < 90 or diastolic > 90 or diastolic < 60:
-            return True
-        return False
-
-    async def _handle_abnormal_bp(self, user_id: str, bp_data: Dict[str, Any]):
-        """Handle abnormal BP readings with enhanced analytics"""
-        # Get patient's thresholds
-        threshold = self.db.query(PatientVitalsThreshold).filter(
-            PatientVitalsThreshold.patient_id == user_id
-        ).first()
-
-        if not threshold:
-            # Use default thresholds based on patient condition
-            patient = self.db.query(User).filter(User.id == user_id).first()
-            condition = patient.medical_condition or "normal"
-            threshold_values = DEFAULT_THRESHOLDS.get(condition, DEFAULT_THRESHOLDS["normal"])
-        else:
-            threshold_values = {
-                "systolic_max": threshold.systolic_max,
-                "systolic_min": threshold.systolic_min,
-                "diastolic_max": threshold.diastolic_max,
-                "diastolic_min": threshold.diastolic_min,
-                "heart_rate_max": threshold.heart_rate_max,
-                "heart_rate_min": threshold.heart_rate_min
-            }
-
-        # Analyze severity
-        severity = self._calculate_severity(bp_data, threshold_values)
-        
-        # Store reading with context
-        reading = VitalsReading(
-            patient_id=user_id,
-            device_id=f"apple-watch-{user_id}",
-            timestamp=datetime.fromisoformat(bp_data["timestamp"]),
-            systolic=bp_data["systolic"],
-            diastolic=bp_data["diastolic"],
-            heart_rate=bp_data["heart_rate"],
-            alert_generated=True,
-            alert_details={
-                "severity": severity,
-                "threshold_exceeded": self._get_exceeded_thresholds(bp_data, threshold_values),
-                "context": self._get_reading_context(bp_data)
-            }
-        )
-        self.db.add(reading)
-        self.db.commit()
-
-        # Generate alert if needed
-        if severity in ["high", "critical"]:
-            await self._generate_alert(user_id, bp_data, severity, threshold)
-
-    def _calculate_severity(self, bp_data: Dict[str, Any], thresholds: Dict[str, int]) -> str:
-        """Calculate the severity of abnormal readings"""
-        systolic = bp_data["systolic"]
-        diastolic = bp_data["diastolic"]
-        
-        # Calculate percentage deviation from thresholds
-        systolic_dev = max(
-            abs(systolic - thresholds["systolic_max"]) / thresholds["systolic_max"],
-            abs(systolic - thresholds["systolic_min"]) / thresholds["systolic_min"]
-        ) if systolic > thresholds["systolic_max"] or systolic < thresholds["systolic_min"] else 0
-
-        diastolic_dev = max(
-            abs(diastolic - thresholds["diastolic_max"]) / thresholds["diastolic_max"],
-            abs(diastolic - thresholds["diastolic_min"]) / thresholds["diastolic_min"]
-        ) if diastolic > thresholds["diastolic_max"] or diastolic < thresholds["diastolic_min"] else 0
-
-        max_deviation = max(systolic_dev, diastolic_dev)
-
-        if max_deviation > 0.2:  # More than 20% deviation
-            return "critical"
-        elif max_deviation > 0.1:  # 10-20% deviation
-            return "high"
-        else:
-            return "moderate"
-
-    def _get_exceeded_thresholds(self, bp_data: Dict[str, Any], thresholds: Dict[str, int]) -> List[str]:
-        """Identify which thresholds were exceeded"""
-        exceeded = []
-        if bp_data["systolic"] > thresholds["systolic_max"]:
-            exceeded.append("high_systolic")
-        if bp_data["systolic"] < thresholds["systolic_min"]:
-            exceeded.append("low_systolic")
-        if bp_data["diastolic"] > thresholds["diastolic_max"]:
-            exceeded.append("high_diastolic")
-        if bp_data["diastolic"] < thresholds["diastolic_min"]:
-            exceeded.append("low_diastolic")
-        if "heart_rate" in bp_data:
-            if bp_data["heart_rate"] > thresholds["heart_rate_max"]:
-                exceeded.append("high_heart_rate")
-            if bp_data["heart_rate"] < thresholds["heart_rate_min"]:
-                exceeded.append("low_heart_rate")
-        return exceeded
-
-    def _get_reading_context(self, bp_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Get contextual information for the reading"""
-        return {
-            "time_of_day": datetime.fromisoformat(bp_data["timestamp"]).strftime("%H:%M"),
-            "activity": bp_data.get("activity_type", "unknown"),
-            "location": bp_data.get("location", "unknown"),
-            "ambient_temp": bp_data.get("ambient_temperature")
-        }
+        finally:
+            if subscription is not None:
+                subscription.close()
 
     async def analyze_bp_patterns(self, user_id: str) -> Dict[str, Any]:
         """Analyze BP patterns and provide detailed insights"""
-        # Get readings from last 30 days
-        readings = self.db.query(VitalsReading).filter(
-            VitalsReading.patient_id == user_id,
-            VitalsReading.timestamp >= datetime.utcnow() - timedelta(days=30)
-        ).all()
+        end_date = datetime.utcnow()
+        await self._merge_archive(user_id, end_date - timedelta(hours=vitals_pattern_stats.window_hours), end_date)
+        # Running statistics over the last 30 days, maintained as readings arrive
+        patterns = vitals_pattern_stats.patterns(user_id, db=self.db)
 
-        if not readings:
+        if not patterns:
             return None
 
-        # Convert to pandas DataFrame for analysis
-        df = pd.DataFrame([{
-            'timestamp': r.timestamp,
-            'systolic': r.systolic,
-            'diastolic': r.diastolic,
-            'heart_rate': r.heart_rate,
-            'activity': r.activity_type,
-            'time_of_day': r.timestamp.strftime("%H:%M")
-        } for r in readings])
-
         # Time-based patterns
-        df['hour'] = df['timestamp'].dt.hour
-        morning_readings = df[df['hour'].between(6, 11)]
-        evening_readings = df[df['hour'].between(17, 22)]
+        morning = {vital: vitals_pattern_stats.hours_mean(patterns, MORNING_HOURS, vital)
+                   for vital in ("systolic", "diastolic")}
+        evening = {vital: vitals_pattern_stats.hours_mean(patterns, EVENING_HOURS, vital)
+                   for vital in ("systolic", "diastolic")}
 
         # Activity-based patterns
-        activity_patterns = df.groupby('activity').agg({
-            'systolic': ['mean', 'std'],
-            'diastolic': ['mean', 'std']
-        }).to_dict()
-
-        # Variability analysis
-        systolic_variability = np.std(df['systolic'])
-        diastolic_variability = np.std(df['diastolic'])
-
-        # Correlation analysis
-        hr_bp_corr = stats.pearsonr(df['heart_rate'], df['systolic'])[0]
+        activity_patterns = {
+            activity: {
+                vital: {"mean": moments["mean"][vital], "std": moments["std"][vital]}
+                for vital in ("systolic", "diastolic")
+            }
+            for activity, moments in patterns["activities"].items()
+        }
 
         # Morning surge analysis
-        if not morning_readings.empty and not evening_readings.empty:
-            morning_surge = morning_readings['systolic'].mean() - evening_readings['systolic'].mean()
+        if morning["systolic"] is not None and evening["systolic"] is not None:
+            morning_surge = morning["systolic"] - evening["systolic"]
         else:
             morning_surge = None
 
         return {
             "time_patterns": {
-                "morning_average": {
-                    "systolic": morning_readings['systolic'].mean() if not morning_readings.empty else None,
-                    "diastolic": morning_readings['diastolic'].mean() if not morning_readings.empty else None
-                },
-                "evening_average": {
-                    "systolic": evening_readings['systolic'].mean() if not evening_readings.empty else None,
-                    "diastolic": evening_readings['diastolic'].mean() if not evening_readings.empty else None
-                },
+                "morning_average": morning,
+                "evening_average": evening,
                 "morning_surge": morning_surge
             },
             "activity_patterns": activity_patterns,
             "variability": {
-                "systolic": systolic_variability,
-                "diastolic": diastolic_variability
+                "systolic": patterns["std"]["systolic"],
+                "diastolic": patterns["std"]["diastolic"]
             },
             "correlations": {
-                "heart_rate_bp": hr_bp_corr
+                "heart_rate_bp": patterns["correlation_hr_systolic"]
             },
-            "risk_factors": self._analyze_risk_factors(df)
+            "risk_factors": self._analyze_risk_factors(patterns)
         }
 
-    def _analyze_risk_factors(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+    def _analyze_risk_factors(self, patterns: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Analyze potential risk factors from BP patterns"""
         risk_factors = []
 
         # High variability risk
-        systolic_cv = np.std(df['systolic']) / np.mean(df['systolic'])
+        systolic_cv = patterns["std"]["systolic"] / patterns["mean"]["systolic"]
         if systolic_cv > 0.15:  # More than 15% coefficient of variation
             risk_factors.append({
                 "type": "high_variability",
@@ -286,10 +211,9 @@ class WearableDataService:
             })
 
         # Morning surge risk
-        df['hour'] = df['timestamp'].dt.hour
-        morning = df[df['hour'].between(6, 11)]['systolic'].mean()
-        night = df[df['hour'].between(0, 5)]['systolic'].mean()
-        if morning - night > 20:  # More than 20 mmHg surge
+        morning = vitals_pattern_stats.hours_mean(patterns, MORNING_HOURS, "systolic")
+        night = vitals_pattern_stats.hours_mean(patterns, NIGHT_HOURS, "systolic")
+        if morning is not None and night is not None and morning - night > 20:  # More than 20 mmHg surge
             risk_factors.append({
                 "type": "morning_surge",
                 "description": "Significant morning blood pressure surge detected",
@@ -298,7 +222,7 @@ class WearableDataService:
             })
 
         # Sustained elevation risk
-        elevated_readings = len(df[df['systolic'] >= 140]) / len(df) * 100
+        elevated_readings = patterns["elevated_fraction"] * 100
         if elevated_readings > 30:  # More than 30% readings are elevated
             risk_factors.append({
                 "type": "sustained_elevation",
@@ -315,54 +239,76 @@ class WearableDataService:
         start_date: datetime,
         end_date: datetime
     ) -> List[Dict[str, Any]]:
-        """Get historical BP data from Azure Blob Storage"""
+        """Get historical BP data from Azure Blob Storage
+
+        Only the date partitions overlapping the range are listed, and their
+        readings are downloaded concurrently.
+        """
         try:
-            container_client = self.blob_service_client.get_container_client(self.container_name)
-            blobs = container_client.list_blobs(name_starts_with=f"data/{user_id}/")
-            
-            bp_data = []
-            for blob in blobs:
-                blob_client = container_client.get_blob_client(blob)
-                data = json.loads(blob_client.download_blob().readall())
-                
-                # Filter by date range
-                timestamp = datetime.fromisoformat(data["timestamp"])
-                if start_date <= timestamp <= end_date:
-                    bp_data.append(data)
-            
-            return sorted(bp_data, key=lambda x: x["timestamp"])
+            return await self.archive.read_range(user_id, start_date, end_date)
         except Exception as e:
             print(f"Error getting historical BP data: {str(e)}")
             raise
 
-    async def analyze_bp_trends(self, user_id: str) -> Dict[str, Any]:
-        """Analyze BP trends over time"""
+    async def analyze_bp_trends(self, user_id: str, days: int = 30) -> Dict[str, Any]:
+        """Analyze BP trends over time
+
+        Aggregates come from the vitals rollups (whole days, with hours and
+        minutes at the edges), so the cost follows the number of buckets in
+        the range rather than the number of readings.
+        """
         end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=30)  # Last 30 days
-        
-        bp_data = await self.get_historical_bp_data(user_id, start_date, end_date)
-        
-        if not bp_data:
+        start_date = end_date - timedelta(days=days)
+        await self._merge_archive(user_id, start_date, end_date)
+
+        summary = vitals_rollups.summary(user_id, start_date, end_date, self.db)
+        systolic, diastolic = summary["systolic"], summary["diastolic"]
+        if not systolic["count"]:
             return None
 
-        # Calculate averages and trends
-        systolic_values = [reading["systolic"] for reading in bp_data]
-        diastolic_values = [reading["diastolic"] for reading in bp_data]
-        
+        recent = vitals_rollups.recent(user_id, end_date, 5, self.db)
+        recent_readings = [
+            {"timestamp": int(timestamp), "systolic": int(value)}
+            for timestamp, value in zip(recent["timestamp"], recent["systolic"])
+        ]
+
         analysis = {
-            "average_systolic": sum(systolic_values) / len(systolic_values),
-            "average_diastolic": sum(diastolic_values) / len(diastolic_values),
-            "max_systolic": max(systolic_values),
-            "max_diastolic": max(diastolic_values),
-            "min_systolic": min(systolic_values),
-            "min_diastolic": min(diastolic_values),
-            "readings_count": len(bp_data),
-            "abnormal_readings": sum(1 for reading in bp_data if self._is_bp_abnormal(reading)),
-            "trend": self._calculate_bp_trend(bp_data)
+            "average_systolic": systolic["mean"],
+            "average_diastolic": diastolic["mean"],
+            "max_systolic": systolic["max"],
+            "max_diastolic": diastolic["max"],
+            "min_systolic": systolic["min"],
+            "min_diastolic": diastolic["min"],
+            "readings_count": systolic["count"],
+            "abnormal_readings": vitals_rollups.count_outside(
+                user_id, start_date, end_date, threshold_resolver.bp_limits(user_id), self.db
+            ),
+            "trend": self._calculate_bp_trend(recent_readings)
         }
-        
+
         return analysis
 
+    async def _merge_archive(self, user_id: str, start: datetime, end: datetime):
+        """Bring archived readings from [start, end] into the columnar store the analyses read.
+
+        Live readings reach both, but history archived before the store
+        existed only lives in Blob Storage. Each range is merged once; the
+        store remembers how far back it has been merged.
+        """
+        try:
+            store = await asyncio.to_thread(vitals_store.patient, user_id, self.db)
+            start_ms = int(to_epoch_ms([start])[0])
+            merged_from = store.archive_merged_from
+            if merged_from is not None:
+                if merged_from <= start_ms:
+                    return
+                end = min(end, datetime(1970, 1, 1) + timedelta(milliseconds=merged_from))
+            readings = await self.archive.read_range(user_id, start, end)
+            await asyncio.to_thread(vitals_store.merge_readings, user_id, readings, self.db)
+            store.archive_merged_from = start_ms
+        except Exception as e:
+            print(f"Error merging archived vitals: {str(e)}")
+
     def _calculate_bp_trend(self, bp_data: List[Dict[str, Any]]) -> str:
         """Calculate BP trend direction"""
         if len(bp_data) < 2:
@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import Column, String, create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend.database import Base
+from backend.services.vitals_store import VitalsStore
+
+if "users" not in Base.metadata.tables:
+    # Users are pydantic-only in this tree; the tables' foreign keys and relationships need a mapped stand-in
+    class User(Base):
+        __tablename__ = "users"
+
+        id = Column(String, primary_key=True)
+
+
+@pytest.fixture
+def store(tmp_path):
+    vitals_store = VitalsStore(str(tmp_path / "vitals"), chunk_rows=500)
+    yield vitals_store
+    vitals_store.close()
+
+
+@pytest.fixture
+def db():
+    from backend.models.patient_vitals import VitalsReading
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine, tables=[Base.metadata.tables["users"], VitalsReading.__table__])
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
@@ -0,0 +1,16 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from backend.services.vitals_store import to_epoch_ms
+
+T0 = datetime(2025, 1, 1)
+
+
+def minutes(count: int, start: datetime = T0, seconds: int = 0) -> np.ndarray:
+    """Epoch-ms timestamps one minute apart"""
+    return to_epoch_ms([start + timedelta(minutes=i, seconds=seconds) for i in range(count)])
+
+
+def to_ms(moment: datetime) -> int:
+    return int(to_epoch_ms([moment])[0])
@@ -0,0 +1,122 @@
+import numpy as np
+
+from backend.services.vitals_anomaly import MIN_STD, RATE_LIMITS, VitalsAnomalyDetector, flag_names
+
+from tests.helpers import T0, to_ms
+
+WINDOW = 40
+WARMUP = 10
+ALPHA = 0.1
+
+
+def _readings(count: int, seed: int = 0, gaps: bool = True):
+    rng = np.random.default_rng(seed)
+    timestamps = to_ms(T0) + np.arange(count, dtype=np.int64) * 30 * 1000
+    values = np.column_stack([rng.normal(125, 5, count), rng.normal(80, 4, count), rng.normal(70, 6, count)]).round()
+    if gaps:
+        values[rng.random((count, 3)) < 0.05] = np.nan
+    return timestamps, values
+
+
+def _detector(store) -> VitalsAnomalyDetector:
+    return VitalsAnomalyDetector(store, window=WINDOW, alpha=ALPHA, warmup=WARMUP)
+
+
+def _brute_force(timestamps, values):
+    """Scores of each reading against the readings before it, one reading at a time"""
+    size, vitals = values.shape
+    zscore, ewma_zscore, rate = (np.full((size, vitals), np.nan) for _ in range(3))
+    for i in range(vitals):
+        mean = var = 0.0
+        seen = 0
+        previous = None
+        for row in range(size):
+            x = values[row, i]
+            window = values[max(0, row - WINDOW):row, i]
+            window = window[~np.isnan(window)]
+            if len(window) >= WARMUP and not np.isnan(x):
+                zscore[row, i] = (x - window.mean()) / max(window.std(), MIN_STD)
+            if np.isnan(x):
+                continue
+            if previous is not None:
+                minutes = max((timestamps[row] - timestamps[previous]) / 60000, 1.0)
+                rate[row, i] = (x - values[previous, i]) / minutes
+            if seen:
+                diff = x - mean
+                if seen >= WARMUP:
+                    ewma_zscore[row, i] = diff / max(var ** 0.5, MIN_STD)
+                mean += ALPHA * diff
+                var = (1 - ALPHA) * (var + diff * ALPHA * diff)
+            else:
+                mean = x
+            seen += 1
+            previous = row
+    return zscore, ewma_zscore, rate
+
+
+def test_scores_match_a_reading_by_reading_baseline(store):
+    timestamps, values = _readings(300)
+    anomalies = _detector(store).observe("p", timestamps, values)
+    zscore, ewma_zscore, rate = _brute_force(timestamps, values)
+    np.testing.assert_allclose(anomalies.zscore, zscore, equal_nan=True, atol=1e-6)
+    np.testing.assert_allclose(anomalies.ewma_zscore, ewma_zscore, equal_nan=True, atol=1e-9)
+    np.testing.assert_allclose(anomalies.rate, rate, equal_nan=True, atol=1e-9)
+
+
+def test_batches_score_the_same_as_one_batch(store):
+    timestamps, values = _readings(500, seed=1)
+    whole = _detector(store).observe("a", timestamps, values)
+    chunked = _detector(store)
+    parts = [chunked.observe("a", timestamps[start:start + 37], values[start:start + 37]) for start in range(0, 500, 37)]
+    for column, whole_column in zip(zip(*parts), whole):
+        np.testing.assert_allclose(np.concatenate(column), whole_column, equal_nan=True, atol=1e-6)
+
+
+def test_unsorted_batches_are_scored_in_time_order(store):
+    timestamps, values = _readings(400, seed=2)
+    values[300, 0] = 200
+    ordered = _detector(store).observe("p", timestamps, values)
+    permutation = np.random.default_rng(3).permutation(400)
+    shuffled = _detector(store).observe("p", timestamps[permutation], values[permutation])
+    assert np.array_equal(ordered.flags[permutation], shuffled.flags)
+    np.testing.assert_allclose(ordered.zscore[permutation], shuffled.zscore, equal_nan=True)
+    assert "systolic_zscore" in flag_names(int(ordered.flags[300]))
+
+
+def test_stale_readings_are_left_unscored(store):
+    detector = _detector(store)
+    timestamps, values = _readings(100, seed=4, gaps=False)
+    detector.observe("p", timestamps, values)
+    late = detector.observe("p", np.array([timestamps[10], timestamps[-1] + 30000]), [[300, 80, 70], [126, 80, 70]])
+    assert late.flags[0] == 0 and np.isnan(late.zscore[0]).all()
+    assert not np.isnan(late.zscore[1]).all()
+
+
+def test_scoring_without_commit_leaves_the_baseline(store):
+    detector = _detector(store)
+    timestamps, values = _readings(100, seed=5, gaps=False)
+    detector.observe("p", timestamps, values)
+    baseline = detector._patients["p"]
+    before = baseline.copy()
+
+    spike = (np.array([timestamps[-1] + 60000]), [[250, 80, 70]])
+    preview = detector.observe("p", *spike, commit=False)
+    assert baseline.newest_ms == before.newest_ms and baseline.position == before.position
+    np.testing.assert_array_equal(baseline.ewma_mean, before.ewma_mean)
+    np.testing.assert_array_equal(baseline.ring, before.ring)
+
+    committed = detector.observe("p", *spike)
+    assert np.array_equal(preview.flags, committed.flags)
+    assert baseline.newest_ms == spike[0][0]
+    assert abs(committed.rate[0, 0]) > RATE_LIMITS[0]
+
+
+def test_baseline_is_seeded_from_the_store(store):
+    timestamps, values = _readings(200, seed=6, gaps=False)
+    store.patient("seeded").append(timestamps[:150], *values[:150].T.astype(int))
+    seeded = _detector(store).observe("seeded", timestamps[150:], values[150:])
+    fed = _detector(store)
+    fed.observe("fed", timestamps[:150], values[:150])
+    expected = fed.observe("fed", timestamps[150:], values[150:])
+    assert np.array_equal(seeded.flags, expected.flags)
+    np.testing.assert_allclose(seeded.zscore, expected.zscore, equal_nan=True, atol=1e-6)
@@ -0,0 +1,103 @@
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from backend.services.vitals_rollups import VitalsRollups, _ms_to_datetime
+
+from tests.helpers import T0, to_ms
+
+DAYS = 130  # spans all three resolutions and both retention horizons
+LIMITS = {"systolic": (90, 140), "diastolic": (60, 90)}
+
+
+@pytest.fixture
+def readings(store):
+    rng = np.random.default_rng(1)
+    count = DAYS * 24 * 60 // 7
+    timestamps = np.sort(to_ms(T0) + rng.integers(0, DAYS * 24 * 3600 * 1000, count))
+    systolic = rng.integers(80, 170, count)
+    diastolic = rng.integers(50, 100, count)
+    heart_rate = rng.integers(50, 120, count)
+    oxygen_saturation = np.where(np.arange(count) % 5 == 0, -1, rng.integers(88, 100, count))
+    return {"timestamp": timestamps, "systolic": systolic, "diastolic": diastolic,
+            "heart_rate": heart_rate, "oxygen_saturation": oxygen_saturation}
+
+
+@pytest.fixture
+def rollups(store, readings):
+    rollups = VitalsRollups(store)
+    half = len(readings["timestamp"]) // 2
+    columns = [readings[name] for name in ("timestamp", "systolic", "diastolic", "heart_rate")]
+    spo2 = [None if v < 0 else int(v) for v in readings["oxygen_saturation"]]
+    store.patient("p").append(*(column[:half] for column in columns), spo2[:half])
+    rollups.summary("p", T0, T0)  # built from the store here, then maintained by the append listener
+    store.patient("p").append(*(column[half:] for column in columns), spo2[half:])
+    return rollups
+
+
+def _random_ranges(readings, count, seed):
+    rng = np.random.default_rng(seed)
+    first, last = int(readings["timestamp"][0]), int(readings["timestamp"][-1])
+    for i in range(count):
+        start = int(rng.integers(first - 3600 * 1000, last))
+        span = 60 * 86400 * 1000 if i % 2 else 3 * 86400 * 1000
+        yield _ms_to_datetime(start), _ms_to_datetime(start + int(rng.integers(1, span)))
+
+
+def _in_range(readings, start, end):
+    return (readings["timestamp"] >= to_ms(start)) & (readings["timestamp"] <= to_ms(end))
+
+
+def test_summary_matches_raw_readings(rollups, readings):
+    for start, end in _random_ranges(readings, 60, seed=2):
+        mask = _in_range(readings, start, end)
+        summary = rollups.summary("p", start, end)
+        systolic = readings["systolic"][mask]
+        assert summary["systolic"]["count"] == mask.sum()
+        if mask.any():
+            assert summary["systolic"]["mean"] == pytest.approx(systolic.mean())
+            assert summary["systolic"]["std"] == pytest.approx(systolic.std(), abs=1e-6)
+            assert (summary["systolic"]["min"], summary["systolic"]["max"]) == (systolic.min(), systolic.max())
+        spo2 = readings["oxygen_saturation"][mask]
+        assert summary["oxygen_saturation"]["count"] == (spo2 >= 0).sum()
+
+
+def test_count_outside_matches_raw_readings(rollups, readings):
+    outside = ((readings["systolic"] < 90) | (readings["systolic"] > 140)
+               | (readings["diastolic"] < 60) | (readings["diastolic"] > 90))
+    for start, end in _random_ranges(readings, 60, seed=3):
+        assert rollups.count_outside("p", start, end, LIMITS) == (outside & _in_range(readings, start, end)).sum()
+
+
+def test_recent_returns_the_last_readings_before_end(rollups, readings):
+    for _, end in _random_ranges(readings, 30, seed=4):
+        expected = readings["timestamp"][readings["timestamp"] <= to_ms(end)][-5:]
+        assert rollups.recent("p", end, 5)["timestamp"].tolist() == expected.tolist()
+
+
+def test_late_reading_behind_the_retention_horizons_is_counted(store, rollups, readings):
+    late = T0 + timedelta(days=3, seconds=1)
+    store.patient("p").append(np.array([to_ms(late)]), [300], [100], [60])
+    start, end = late - timedelta(minutes=30), late + timedelta(hours=2)
+    expected = _in_range(readings, start, end).sum() + 1
+    assert rollups.summary("p", start, end)["systolic"]["count"] == expected
+    assert rollups.summary("p", start, end)["systolic"]["max"] == 300
+
+
+def test_buckets_pick_the_finest_resolution_that_fits(rollups, readings):
+    end = _ms_to_datetime(int(readings["timestamp"][-1]))
+    assert rollups.buckets("p", end - timedelta(hours=6), end)["resolution"] == "minute"
+    assert rollups.buckets("p", end - timedelta(days=7), end)["resolution"] == "hour"
+    chart = rollups.buckets("p", end - timedelta(days=90), end)
+    assert chart["resolution"] == "day"
+    assert len(chart["points"]) <= 500
+
+    # An old range is served from days once its hour buckets have expired
+    old = rollups.buckets("p", T0 + timedelta(days=5), T0 + timedelta(days=8))
+    assert old["resolution"] == "day"
+    first = to_ms(T0 + timedelta(days=5))
+    last = to_ms(T0 + timedelta(days=9))
+    assert sum(point["count"] for point in old["points"]) == (
+        (readings["timestamp"] >= first) & (readings["timestamp"] < last)
+    ).sum()
@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from backend.services.vitals_stats import VitalsPatternStats
+
+from tests.helpers import T0, minutes
+
+HOUR_MS = 3600 * 1000
+ACTIVITIES = ["resting", "walking", "exercising", None]
+
+
+@pytest.fixture
+def readings():
+    rng = np.random.default_rng(2)
+    count = 20 * 24 * 60
+    systolic = rng.normal(130, 15, count).astype(int)
+    return {
+        "timestamp": minutes(count, seconds=13),
+        "systolic": systolic,
+        "diastolic": rng.normal(80, 10, count).astype(int),
+        "heart_rate": (0.5 * systolic + rng.normal(10, 8, count)).astype(int),
+        "activity": np.array([ACTIVITIES[i % 4] for i in range(count)], dtype=object),
+    }
+
+
+def _append(store, readings, rows: slice):
+    store.patient("p").append(
+        readings["timestamp"][rows], readings["systolic"][rows], readings["diastolic"][rows],
+        readings["heart_rate"][rows], None, readings["activity"][rows].tolist()
+    )
+
+
+@pytest.mark.parametrize("now", [T0 + timedelta(days=20, minutes=30), T0 + timedelta(days=23, hours=5)])
+def test_patterns_match_raw_readings_in_the_window(store, readings, now):
+    stats = VitalsPatternStats(store, window_days=7)
+    half = len(readings["timestamp"]) // 2
+    _append(store, readings, slice(0, half))
+    stats.patterns("p", T0 + timedelta(days=10))  # built here, then kept current by the append listener
+    _append(store, readings, slice(half, None))
+
+    patterns = stats.patterns("p", now)
+    now_hour = int(np.datetime64(now, "ms").astype(np.int64)) // HOUR_MS
+    hours = readings["timestamp"] // HOUR_MS
+    window = (hours >= now_hour - 7 * 24) & (hours <= now_hour)
+    systolic, diastolic, heart_rate = (readings[name][window] for name in ("systolic", "diastolic", "heart_rate"))
+
+    assert patterns["count"] == window.sum()
+    assert patterns["mean"]["systolic"] == pytest.approx(systolic.mean())
+    assert patterns["std"]["diastolic"] == pytest.approx(diastolic.std())
+    assert patterns["correlation_hr_systolic"] == pytest.approx(np.corrcoef(heart_rate, systolic)[0, 1])
+    assert patterns["elevated_fraction"] == pytest.approx((systolic >= 140).mean())
+    for hour in range(24):
+        in_hour = window & (hours % 24 == hour)
+        assert patterns["hourly"][hour]["count"] == in_hour.sum()
+        assert patterns["hourly"][hour]["mean"]["systolic"] == pytest.approx(readings["systolic"][in_hour].mean())
+    assert set(patterns["activities"]) == {"resting", "walking", "exercising"}
+    for name, moments in patterns["activities"].items():
+        in_activity = window & (readings["activity"] == name)
+        assert moments["count"] == in_activity.sum()
+        assert moments["std"]["systolic"] == pytest.approx(readings["systolic"][in_activity].std(ddof=1))
+
+    morning = window & np.isin(hours % 24, range(6, 12))
+    assert VitalsPatternStats.hours_mean(patterns, range(6, 12), "systolic") == pytest.approx(
+        readings["systolic"][morning].mean()
+    )
+
+
+def test_patterns_are_none_without_readings_in_the_window(store, readings):
+    stats = VitalsPatternStats(store, window_days=7)
+    _append(store, readings, slice(0, 600))
+    assert stats.patterns("p", T0 + timedelta(days=30)) is None
+    assert stats.patterns("other", T0) is None
@@ -0,0 +1,92 @@
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from backend.models.patient_vitals import VitalsReading
+from backend.services import vitals_store as vitals_store_module
+from backend.services.vitals_store import MISSING, VitalsStore
+
+from tests.helpers import T0, minutes, to_ms
+
+
+def _readings(count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    timestamps = minutes(count)
+    systolic = rng.integers(90, 180, count)
+    diastolic = rng.integers(50, 110, count)
+    heart_rate = rng.integers(40, 150, count)
+    oxygen_saturation = [None if i % 7 == 0 else int(v) for i, v in enumerate(rng.integers(88, 100, count))]
+    activity = [["resting", "walking", None][i % 3] for i in range(count)]
+    return timestamps, systolic, diastolic, heart_rate, oxygen_saturation, activity
+
+
+def _assert_series(series, expected, lo, hi):
+    timestamps, systolic, diastolic, heart_rate, oxygen_saturation, activity = expected
+    assert series.timestamp.tolist() == timestamps[lo:hi].tolist()
+    assert series.systolic.tolist() == systolic[lo:hi].tolist()
+    assert series.diastolic.tolist() == diastolic[lo:hi].tolist()
+    assert series.heart_rate.tolist() == heart_rate[lo:hi].tolist()
+    assert series.oxygen_saturation.tolist() == [MISSING if v is None else v for v in oxygen_saturation[lo:hi]]
+    names = series.activities + [None]  # MISSING (-1) indexes the trailing None
+    assert [names[code] for code in series.activity.tolist()] == activity[lo:hi]
+
+
+def test_scan_returns_appended_readings(store):
+    expected = _readings(3000)
+    for start in range(0, 3000, 400):
+        store.patient("p").append(*(column[start:start + 400] for column in expected))
+
+    start, end = T0 + timedelta(minutes=700), T0 + timedelta(minutes=2210, seconds=30)
+    lo = np.searchsorted(expected[0], to_ms(start))
+    hi = np.searchsorted(expected[0], to_ms(end), side="right")
+    _assert_series(store.scan("p", start, end), expected, lo, hi)
+
+
+def test_late_readings_are_scanned_in_time_order(store):
+    timestamps, *columns = _readings(1200)
+    store.patient("p").append(timestamps, *columns)
+    late = timestamps[:3] + 30 * 1000
+    store.patient("p").append(late[::-1], [200, 201, 202], [100, 101, 102], [90, 91, 92], None, ["exercising"] * 3)
+
+    series = store.scan("p", T0, T0 + timedelta(days=1))
+    assert len(series) == 1203
+    assert np.all(np.diff(series.timestamp) >= 0)
+    assert series.systolic[:6].tolist() == [columns[0][0], 202, columns[0][1], 201, columns[0][2], 200]
+
+
+def test_reopened_store_keeps_readings_and_rechunks(tmp_path):
+    root = str(tmp_path / "vitals")
+    expected = _readings(2600)
+    first = VitalsStore(root, chunk_rows=500)
+    first.patient("p").append(*expected)
+    first.close()
+
+    # A different chunk size only affects new chunks; sealed and head rows read back unchanged
+    second = VitalsStore(root, chunk_rows=300)
+    try:
+        _assert_series(second.scan("p", T0, T0 + timedelta(days=2)), expected, 0, 2600)
+    finally:
+        second.close()
+
+
+@pytest.mark.skipif(vitals_store_module.fcntl is None, reason="store locking needs fcntl")
+def test_second_store_on_the_same_root_is_refused(store):
+    store.patient("p")
+    with pytest.raises(RuntimeError, match="in use"):
+        VitalsStore(store.root).patient("p")
+
+
+def test_reconcile_merges_rows_the_store_is_missing(store, db):
+    timestamps, *columns = _readings(100)
+    store.patient("p").append(timestamps, *columns)
+    for i in range(10):
+        db.add(VitalsReading(id=str(i), patient_id="p", device_id="d", systolic=130, diastolic=85, heart_rate=60,
+                             timestamp=T0 + timedelta(minutes=2 * i, seconds=30)))
+    db.commit()
+
+    assert store.reconcile("p", db) == 10
+    assert store.reconcile("p", db) == 0
+    series = store.scan("p", T0, T0 + timedelta(days=1))
+    assert len(series) == 110
+    assert np.all(np.diff(series.timestamp) > 0)
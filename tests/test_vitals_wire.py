@@ -0,0 +1,119 @@
+import asyncio
+import struct
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from backend.services.vitals_archive import LocalBlobStore, VitalsArchive
+from backend.services.vitals_wire import (
+    WireFormatError, decode_columns, decode_readings, decode_upload, encode_columns, encode_readings, is_wire_format
+)
+
+from tests.helpers import T0
+
+FULL_READING = {
+    "timestamp": (T0 + timedelta(seconds=30, microseconds=123456)).isoformat(),
+    "systolic": 121, "diastolic": 79, "heart_rate": 70, "oxygen_saturation": 97, "temperature": 36.6,
+    "activity_type": "walking", "steps_count": 1234, "location": "home", "ambient_temperature": -3.25,
+}
+
+
+def _random_columns(count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+
+    def optional(values, every):
+        return [None if i % every == 0 else value for i, value in enumerate(values)]
+
+    offsets = np.sort(rng.integers(0, 10 * 86400 * 10**6, count))
+    return {
+        "timestamp": [T0 + timedelta(microseconds=int(offset)) for offset in offsets],
+        "systolic": rng.integers(40, 300, count).tolist(),
+        "diastolic": rng.integers(20, 200, count).tolist(),
+        "heart_rate": rng.integers(20, 300, count).tolist(),
+        "oxygen_saturation": optional(rng.integers(50, 101, count).tolist(), 3),
+        "temperature": optional(rng.normal(36.8, 0.5, count).tolist(), 4),
+        "activity_type": optional([["resting", "walking", "café run"][i % 3] for i in range(count)], 5),
+        "steps_count": optional(rng.integers(0, 50000, count).tolist(), 6),
+        "location": optional([f"room {i % 11}" for i in range(count)], 7),
+        "ambient_temperature": optional(rng.normal(20, 8, count).tolist(), 2),
+    }
+
+
+def test_columns_round_trip_exactly():
+    columns = _random_columns(2000)
+    data = encode_columns(columns, device_id="watch-1")
+    assert is_wire_format(data)
+    decoded = decode_columns(data)
+    assert decoded.pop("device_id") == ["watch-1"] * 2000
+    assert decoded == columns
+
+
+def test_rows_are_encoded_in_time_order():
+    columns = _random_columns(300, seed=1)
+    order = np.random.default_rng(2).permutation(300)
+    shuffled = {name: [values[i] for i in order] for name, values in columns.items()}
+    decoded = decode_columns(encode_columns(shuffled))
+    assert decoded.pop("device_id") == [None] * 300
+    assert decoded == columns
+
+
+def test_numpy_columns_are_encoded_like_lists():
+    columns = _random_columns(50, seed=3)
+    arrays = dict(columns, systolic=np.array(columns["systolic"]), diastolic=np.array(columns["diastolic"]))
+    assert encode_columns(arrays) == encode_columns(columns)
+
+
+def test_readings_round_trip_with_only_present_fields():
+    sparse = {"timestamp": (T0 + timedelta(days=1)).isoformat(), "systolic": 120, "diastolic": 80, "heart_rate": 60}
+    assert decode_readings(encode_readings([FULL_READING, sparse])) == [FULL_READING, sparse]
+
+
+def test_out_of_range_values_are_rejected():
+    with pytest.raises(WireFormatError):
+        encode_readings([dict(FULL_READING, systolic=40000)])
+    far = dict(FULL_READING, timestamp=(T0 + timedelta(days=60)).isoformat())
+    with pytest.raises(WireFormatError):
+        encode_readings([FULL_READING, far])
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:10],  # truncated header
+    lambda data: b"XXXX" + data[4:],  # wrong magic
+    lambda data: data[:-1],  # truncated rows
+    lambda data: data + b"\0",  # trailing bytes
+    lambda data: data[:-4] + struct.pack("<h", 5) + data[-2:],  # activity index outside the vocabulary
+])
+def test_malformed_messages_are_rejected(corrupt):
+    with pytest.raises(WireFormatError):
+        decode_columns(corrupt(encode_readings([FULL_READING], device_id="watch-1")))
+
+
+def test_uploads_must_name_their_device_and_carry_required_vitals():
+    assert decode_upload(encode_readings([FULL_READING], device_id="watch-1"))["systolic"] == [121]
+    with pytest.raises(WireFormatError, match="device"):
+        decode_upload(encode_readings([FULL_READING]))
+    missing = {key: value for key, value in FULL_READING.items() if key != "heart_rate"}
+    with pytest.raises(WireFormatError, match="heart_rate"):
+        decode_upload(encode_readings([missing], device_id="watch-1"))
+
+
+def test_archive_segments_round_trip_through_the_blob_store(tmp_path):
+    readings = [
+        dict(FULL_READING, timestamp=(T0 + timedelta(seconds=30 * i, microseconds=7)).isoformat(), systolic=100 + i % 50)
+        for i in range(300)
+    ]
+
+    async def run():
+        blob_store = LocalBlobStore(str(tmp_path))
+        archive = VitalsArchive(blob_store, archive_format="binary", flush_seconds=3600)
+        for reading in readings:
+            await archive.write_reading("u", reading)
+        # Buffered readings are served before their segment is written
+        assert await archive.read_range("u", T0, T0 + timedelta(days=1)) == readings
+        await archive.close()
+        names = await blob_store.list("data/u/")
+        assert names and all(name.endswith(".avw") for name in names)
+        return await VitalsArchive(blob_store).read_range("u", T0, T0 + timedelta(days=1))
+
+    assert asyncio.run(run()) == readings